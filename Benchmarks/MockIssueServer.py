@@ -0,0 +1,192 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# Paths the mock serves the two APIs under, see github_api_url and jira_base_url
+GITHUB_PREFIX = '/github/'
+JIRA_PREFIX = '/jira/rest/api/2/'
+
+GITHUB_MAX_PER_PAGE = 100
+JIRA_MAX_RESULTS = 100 # JIRA lowers larger maxResults to its configured maximum
+PULL_REQUEST_SHARE = 0.2 # GitHub lists pull requests on the issues endpoint as well
+RATE_LIMIT = 5000
+
+START_DATE = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+def generate_github_issues(count, seed=1):
+    """
+    Return count GitHub issues and pull requests, newest first like the issues endpoint.
+    """
+    rng = random.Random(seed)
+    issues = []
+    for number in range(1, count + 1):
+        created = START_DATE + timedelta(hours=number * 6)
+        updated = created + timedelta(hours=rng.randrange(24 * 90))
+        issue = {
+            'id': 1000000 + number,
+            'number': number,
+            'title': f'Synthetic issue {number}',
+            'state': 'closed' if rng.random() < 0.7 else 'open',
+            'labels': [{'name': rng.choice(['bug', 'enhancement', 'question'])}],
+            'user': {'login': f'reporter{rng.randrange(50)}'},
+            'created_at': created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'updated_at': updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'body': ' '.join(f'word{rng.randrange(1000)}' for _ in range(rng.randrange(10, 100)))
+        }
+        if rng.random() < PULL_REQUEST_SHARE:
+            issue['pull_request'] = {'url': f'https://api.github.com/repos/benchmark/synthetic/pulls/{number}'}
+        issues.append(issue)
+    return issues[::-1]
+
+def generate_jira_issues(count, project_key, seed=1):
+    """
+    Return count JIRA bug issues of a project, newest key first like the searches of GetBugIssueDataJira.
+    """
+    rng = random.Random(seed)
+    issues = []
+    for number in range(1, count + 1):
+        created = START_DATE + timedelta(hours=number * 6)
+        updated = created + timedelta(hours=rng.randrange(24 * 90))
+        issues.append({
+            'id': str(2000000 + number),
+            'key': f'{project_key}-{number}',
+            'fields': {
+                'summary': f'Synthetic bug {number}',
+                'issuetype': {'name': 'Bug'},
+                'status': {'name': rng.choice(['Open', 'Resolved', 'Closed'])},
+                'priority': {'name': rng.choice(['Minor', 'Major', 'Critical'])},
+                'created': created.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+                'updated': updated.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+                'labels': [],
+                'description': ' '.join(f'word{rng.randrange(1000)}' for _ in range(rng.randrange(10, 100)))
+            }
+        })
+    return issues[::-1]
+
+class MockIssueRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the pooled sessions of the fetchers expect
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock.count_request()
+        if mock.latency:
+            time.sleep(mock.latency)
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path.startswith(GITHUB_PREFIX):
+            self.route_github(mock, url.path[len(GITHUB_PREFIX):], query)
+        elif url.path.startswith(JIRA_PREFIX):
+            self.route_jira(mock, url.path[len(JIRA_PREFIX):], query)
+        else:
+            self.send_json({'message': 'Not Found'}, status=404)
+
+    def route_github(self, mock, path, query):
+        match = re.fullmatch(r'repos/([^/]+)/([^/]+)(/issues)?', path)
+        if not match:
+            self.send_json({'message': 'Not Found'}, status=404)
+        elif not match.group(3):
+            self.send_json({'full_name': f'{match.group(1)}/{match.group(2)}', 'has_issues': True})
+        else:
+            issues = mock.github_issues
+            if 'since' in query:
+                issues = [issue for issue in issues if issue['updated_at'] >= query['since']]
+            per_page = min(int(query.get('per_page', 30)), GITHUB_MAX_PER_PAGE)
+            page = int(query.get('page', 1))
+            last_page = max(1, -(-len(issues) // per_page))
+            links = []
+            if page < last_page:
+                links.append(f'<{self.get_page_url(mock, query, page + 1)}>; rel="next"')
+                links.append(f'<{self.get_page_url(mock, query, last_page)}>; rel="last"')
+            self.send_json(issues[(page - 1) * per_page:page * per_page], headers={'Link': ', '.join(links)} if links else {})
+
+    def route_jira(self, mock, path, query):
+        if path == 'project':
+            self.send_json([{'key': mock.jira_project_key, 'name': mock.jira_project_key.title()}])
+        elif path == 'search':
+            issues = mock.jira_issues
+            match = re.search(r'updated >= "([^"]+)"', query.get('jql', ''))
+            if match:
+                since = datetime.strptime(match.group(1), '%Y/%m/%d %H:%M').strftime('%Y-%m-%dT%H:%M')
+                issues = [issue for issue in issues if issue['fields']['updated'] >= since]
+            start_at = int(query.get('startAt', 0))
+            max_results = min(int(query.get('maxResults', 50)), JIRA_MAX_RESULTS)
+            fields = query.get('fields', '*all')
+            page = issues[start_at:start_at + max_results]
+            if fields != '*all':
+                wanted = set(fields.split(','))
+                page = [{**issue, 'fields': {name: value for name, value in issue['fields'].items() if name in wanted}} for issue in page]
+            self.send_json({'startAt': start_at, 'maxResults': max_results, 'total': len(issues), 'issues': page})
+        else:
+            self.send_json({'errorMessages': ['Not Found']}, status=404)
+
+    def get_page_url(self, mock, query, page):
+        return f'{mock.github_api_url}{self.path[len(GITHUB_PREFIX):].split("?")[0]}?{urlencode({**query, "page": page})}'
+
+    def send_json(self, content, status=200, headers=None):
+        body = json.dumps(content).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        not_modified = status == 200 and self.headers.get('If-None-Match') == etag
+        self.send_response(304 if not_modified else status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('X-RateLimit-Limit', str(RATE_LIMIT))
+        self.send_header('X-RateLimit-Remaining', str(RATE_LIMIT))
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0' if not_modified else str(len(body)))
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body)
+
+class MockIssueServer:
+    """
+    Local stand-in for the GitHub issues API and the JIRA search API, serving generated issues with
+    pagination, ETags and rate limit headers like the real services. latency (in seconds) is added
+    to every request to model the round trip to the real services. Use as a context manager.
+    """
+    def __init__(self, github_issues, jira_issues, jira_project_key, latency=0.0):
+        self.github_issues = github_issues
+        self.jira_issues = jira_issues
+        self.jira_project_key = jira_project_key
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockIssueRequestHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def github_api_url(self):
+        return f'{self.url}{GITHUB_PREFIX}'
+
+    @property
+    def jira_base_url(self):
+        return f'{self.url}{JIRA_PREFIX}'
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
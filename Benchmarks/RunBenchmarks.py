@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import GetBugIssueData
+import GetBugIssueDataJira
+import HttpCache
+import LocCache
+import Metrics
+from DeveloperEffort import collect_refactoring_developer_effort
+from GetGitDiff import get_commit_diff
+from LoggerManager import get_logger
+from MockIssueServer import MockIssueServer, generate_github_issues, generate_jira_issues
+from SyntheticRepository import (SYNTHETIC_REPOSITORY_URL, add_parameter_arguments, ensure_synthetic_repository,
+                                 get_parameter_overrides, get_parameters)
+
+# Results of every run, one JSON file per run, compared with --compare
+BENCHMARK_RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Results')
+REPOSITORY_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+DEFAULT_REPEAT = 3
+DEFAULT_ISSUE_COUNT = 2000
+DEFAULT_LATENCY = 0.02 # in seconds, added by the mock server to every request
+REGRESSION_THRESHOLD = 0.1 # slowdown of the median wall time reported as a regression
+JIRA_PROJECT_KEY = 'SYNTHETIC'
+
+class BenchmarkContext:
+    """
+    Inputs shared by the benchmarks of a run. Every output and cache of the stages is kept in work_dir,
+    so runs start from the same state and never touch the caches and outputs of real batches.
+    """
+    def __init__(self, work_dir, repo_path, refactoring_miner_output_path, server, github_issue_count, jira_issue_count):
+        self.work_dir = work_dir
+        self.repo_path = repo_path
+        self.refactoring_miner_output_path = refactoring_miner_output_path
+        self.server = server
+        self.github_issue_count = github_issue_count
+        self.jira_issue_count = jira_issue_count
+        self.loc_cache_path = os.path.join(work_dir, 'loc_cache.sqlite')
+        self.http_cache_path = os.path.join(work_dir, 'http_cache.sqlite')
+        self.output_dir = os.path.join(work_dir, 'outputs')
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def get_output_path(self, file_name):
+        return os.path.join(self.output_dir, file_name)
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def reset_http_cache(context):
+    HttpCache.close_connection()
+    remove_database(context.http_cache_path)
+
+def ensure_exists(path, function):
+    if not os.path.exists(path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+
+# Each benchmark prepares its inputs outside of the measured block and returns the call to measure.
+
+def commit_diff_git(context):
+    return lambda: get_commit_diff(context.repo_path, context.get_output_path('diff_git.jsonl.gz'), context.refactoring_miner_output_path, 'git')
+
+def commit_diff_pydriller(context):
+    return lambda: get_commit_diff(context.repo_path, context.get_output_path('diff_pydriller.jsonl.gz'), context.refactoring_miner_output_path, 'pydriller')
+
+def measure_developer_effort(context, tloc_mode, repo_path=None):
+    collect_refactoring_developer_effort(repo_path or context.repo_path, context.refactoring_miner_output_path,
+                                         context.get_output_path(f'developer_effort_{tloc_mode}.csv'), tloc_mode)
+
+def developer_effort_trees_cold(context):
+    remove_database(context.loc_cache_path)
+    return lambda: measure_developer_effort(context, 'trees')
+
+def developer_effort_trees_warm(context):
+    ensure_exists(context.loc_cache_path, lambda: measure_developer_effort(context, 'trees'))
+    return lambda: measure_developer_effort(context, 'trees')
+
+def developer_effort_checkout(context):
+    # Checking out moves HEAD, which the other stages read, so a clone sharing the objects is checked out instead
+    clone_path = os.path.join(context.work_dir, 'checkout')
+    shutil.rmtree(clone_path, ignore_errors=True)
+    subprocess.check_call(['git', 'clone', '--quiet', '--shared', context.repo_path, clone_path])
+    return lambda: measure_developer_effort(context, 'checkout', clone_path)
+
+def fetch_github_issues(context, incremental=False):
+    if not GetBugIssueData.main('benchmark', 'token', SYNTHETIC_REPOSITORY_URL, incremental):
+        raise RuntimeError('fetching the GitHub issues failed, see run_results.txt')
+    issues = GetBugIssueData.load_existing_issues(GetBugIssueData.get_output_file_path('synthetic.json'))
+    if issues is None or len(issues) != context.github_issue_count:
+        raise RuntimeError(f'fetched {0 if issues is None else len(issues)} GitHub issues instead of {context.github_issue_count}')
+
+def github_issues_cold(context):
+    reset_http_cache(context)
+    return lambda: fetch_github_issues(context)
+
+def github_issues_revalidated(context):
+    ensure_exists(context.http_cache_path, lambda: fetch_github_issues(context))
+    return lambda: fetch_github_issues(context)
+
+def github_issues_incremental(context):
+    ensure_exists(GetBugIssueData.get_output_file_path('synthetic.json'), lambda: fetch_github_issues(context))
+    return lambda: fetch_github_issues(context, incremental=True)
+
+def fetch_jira_issues(context):
+    if not GetBugIssueDataJira.main('token', SYNTHETIC_REPOSITORY_URL, project_key=JIRA_PROJECT_KEY):
+        raise RuntimeError('fetching the JIRA issues failed, see run_results.txt')
+    issues = GetBugIssueData.load_existing_issues(GetBugIssueData.get_output_file_path(f'jira_{JIRA_PROJECT_KEY.lower()}.json'))
+    if issues is None or len(issues) != context.jira_issue_count:
+        raise RuntimeError(f'fetched {0 if issues is None else len(issues)} JIRA issues instead of {context.jira_issue_count}')
+
+def jira_issues_cold(context):
+    reset_http_cache(context)
+    return lambda: fetch_jira_issues(context)
+
+def jira_issues_revalidated(context):
+    ensure_exists(GetBugIssueData.get_output_file_path(f'jira_{JIRA_PROJECT_KEY.lower()}.json'), lambda: fetch_jira_issues(context))
+    return lambda: fetch_jira_issues(context)
+
+def is_pydriller_installed():
+    try:
+        import pydriller
+    except ImportError:
+        return False
+    return True
+
+# name -> (benchmark, whether it can run on this machine)
+BENCHMARKS = {
+    'commit_diff_git': (commit_diff_git, lambda: True),
+    'commit_diff_pydriller': (commit_diff_pydriller, is_pydriller_installed),
+    'developer_effort_trees_cold': (developer_effort_trees_cold, lambda: True),
+    'developer_effort_trees_warm': (developer_effort_trees_warm, lambda: True),
+    'developer_effort_checkout': (developer_effort_checkout, lambda: shutil.which('scc') is not None),
+    'github_issues_cold': (github_issues_cold, lambda: True),
+    'github_issues_revalidated': (github_issues_revalidated, lambda: True),
+    'github_issues_incremental': (github_issues_incremental, lambda: True),
+    'jira_issues_cold': (jira_issues_cold, lambda: True),
+    'jira_issues_revalidated': (jira_issues_revalidated, lambda: True)
+}
+
+def redirect_outputs(context):
+    """
+    Point the stages at the work directory and the issue fetchers at the mock server.
+    """
+    LocCache.LOC_CACHE_PATH = context.loc_cache_path
+    HttpCache.HTTP_CACHE_PATH = context.http_cache_path
+    HttpCache.close_connection()
+    GetBugIssueData.ISSUE_OUTPUT_DIR = context.output_dir
+    GetBugIssueData.GITHUB_API_URL = context.server.github_api_url
+    GetBugIssueDataJira.SEARCH_URL = f'{context.server.jira_base_url}search'
+    GetBugIssueDataJira.PROJECT_URL = f'{context.server.jira_base_url}project'
+
+def run_benchmarks(context, names, repeat, logger):
+    """
+    Run every benchmark repeat times, each run in a metrics span, and return the spans.
+    """
+    spans_path = os.path.join(context.work_dir, 'spans.jsonl')
+    Metrics.configure(spans_path)
+    for name in names:
+        benchmark, _ = BENCHMARKS[name]
+        for run in range(repeat):
+            logger.info(f"Running {name} ({run + 1}/{repeat})")
+            with contextlib.redirect_stdout(io.StringIO()): # the stages print every commit and page
+                measured = benchmark(context)
+                with Metrics.span(name):
+                    measured()
+    return Metrics.load_spans(spans_path)
+
+def summarize_spans(spans):
+    stages = {}
+    for record in spans:
+        stages.setdefault(record['stage'], []).append(record)
+    results = {}
+    for name, records in stages.items():
+        wall_seconds = [record['wall_seconds'] for record in records]
+        cpu_seconds = [record['cpu_seconds'] + (record['children_cpu_seconds'] or 0) for record in records]
+        results[name] = {
+            'wall_seconds': wall_seconds,
+            'median_wall_seconds': statistics.median(wall_seconds),
+            'min_wall_seconds': min(wall_seconds),
+            'median_cpu_seconds': statistics.median(cpu_seconds),
+            'peak_rss_mb': max((record['peak_rss_mb'] for record in records if record['peak_rss_mb'] is not None), default=None),
+            'counters': records[-1]['counters']
+        }
+    return results
+
+def get_revision():
+    """
+    Return the commit of the analyser the benchmarks ran against, marked -dirty with local changes.
+    """
+    try:
+        revision = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPOSITORY_ROOT,
+                                           universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'unknown'
+    return revision
+
+def get_environment():
+    git_version = subprocess.check_output(['git', '--version'], universal_newlines=True).strip()
+    return {'python': platform.python_version(), 'git': git_version, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+def save_results(results, output_path=None):
+    if output_path is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(BENCHMARK_RESULTS_DIR, f"{results['revision']}_{timestamp}.json")
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+    return output_path
+
+def compare_results(baseline, results, threshold=REGRESSION_THRESHOLD):
+    """
+    Return a report of the median wall time of every benchmark against a baseline run, and the names
+    of the benchmarks that slowed down by more than threshold.
+    """
+    lines = [f"Compared with {baseline['revision']} ({baseline['created']}):"]
+    for name in ('parameters', 'issues', 'latency', 'environment'):
+        if baseline.get(name) != results.get(name):
+            lines.append(f'  warning: the {name} differ, the timings are not directly comparable')
+    regressions = []
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            lines.append(f"  {stage['median_wall_seconds']:10.3f}s  {name} (new)")
+            continue
+        baseline_seconds = baseline['stages'][name]['median_wall_seconds']
+        ratio = stage['median_wall_seconds'] / baseline_seconds if baseline_seconds else 1.0
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        lines.append(f"  {baseline_seconds:10.3f}s -> {stage['median_wall_seconds']:10.3f}s  {ratio:6.2f}x  {name}{'  REGRESSION' if regressed else ''}")
+    return '\n'.join(lines), regressions
+
+def main(parameters, seed, names, repeat, issue_count, latency, logger, output_path=None):
+    """
+    Run the benchmarks on a synthetic repository and the mock issue server, save the results and return them.
+    """
+    repo_path, refactoring_miner_output_path = ensure_synthetic_repository(parameters, seed)
+    github_issues = generate_github_issues(issue_count, seed)
+    jira_issues = generate_jira_issues(issue_count, JIRA_PROJECT_KEY, seed)
+    github_issue_count = sum(1 for issue in github_issues if 'pull_request' not in issue)
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        with MockIssueServer(github_issues, jira_issues, JIRA_PROJECT_KEY, latency) as server:
+            context = BenchmarkContext(work_dir, repo_path, refactoring_miner_output_path, server, github_issue_count, len(jira_issues))
+            redirect_outputs(context)
+            spans = run_benchmarks(context, names, repeat, logger)
+    finally:
+        HttpCache.close_connection()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'revision': get_revision(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': get_environment(),
+        'parameters': parameters,
+        'seed': seed,
+        'issues': issue_count,
+        'latency': latency,
+        'repeat': repeat,
+        'stages': summarize_spans(spans)
+    }
+    logger.info(f"Results saved to {save_results(results, output_path)}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the analysis stages on a synthetic repository and a mock issue server.")
+    add_parameter_arguments(parser)
+    parser.add_argument("--benchmarks", default=','.join(BENCHMARKS), help="Comma separated benchmarks to run.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs of every benchmark. The median is compared.")
+    parser.add_argument("--issues", type=int, default=DEFAULT_ISSUE_COUNT, help="GitHub and JIRA issues served by the mock server.")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds the mock server waits before every response.")
+    parser.add_argument("--output", help="Results file. Defaults to Results/<revision>_<timestamp>.json.")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Slowdown reported as a regression, 0.1 for 10%%.")
+    args = parser.parse_args()
+
+    logger = get_logger("Benchmarks")
+
+    names = [name for name in args.benchmarks.split(',') if name]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    skipped = [name for name in names if not BENCHMARKS[name][1]()]
+    if skipped:
+        logger.warning(f"Skipping benchmarks whose tools are not installed: {', '.join(skipped)}")
+
+    results = main(get_parameters(args.preset, get_parameter_overrides(args)), args.seed, [name for name in names if name not in skipped],
+                   args.repeat, args.issues, args.latency, logger, args.output)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            report, regressions = compare_results(json.load(file), results, args.threshold)
+        logger.info(report)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from RefactoringMinerOutput import iter_commits, write_commits
+
+# Shape of a generated repository:
+#   commits           commits on the main branch
+#   files             source files of the first commit
+#   churn             files modified by every commit
+#   lines_changed     lines replaced, added or removed in every modified file
+#   rename_rate       share of the commits that rename a class or move it to another package
+#   refactoring_rate  share of the other commits listed with an Extract Method refactoring
+#   authors           distinct commit authors
+REPOSITORY_PRESETS = {
+    'small': {'commits': 200, 'files': 100, 'churn': 3, 'lines_changed': 5, 'rename_rate': 0.05, 'refactoring_rate': 0.3, 'authors': 5},
+    'medium': {'commits': 2000, 'files': 1000, 'churn': 5, 'lines_changed': 8, 'rename_rate': 0.05, 'refactoring_rate': 0.3, 'authors': 20},
+    'large': {'commits': 10000, 'files': 5000, 'churn': 8, 'lines_changed': 10, 'rename_rate': 0.05, 'refactoring_rate': 0.3, 'authors': 50}
+}
+DEFAULT_PRESET = 'small'
+DEFAULT_SEED = 1
+
+# Bump when the generated content changes, so repositories generated by an older version are not reused
+GENERATOR_VERSION = 1
+SYNTHETIC_REPOSITORY_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Cache', 'BenchmarkRepositories')
+SYNTHETIC_REPOSITORY_URL = 'https://github.com/benchmark/synthetic'
+
+FILE_LINES = (20, 200) # range of the line count of a new file
+FILES_PER_PACKAGE = 25
+START_TIMESTAMP = 1262304000 # 2010-01-01, every commit is an hour after the previous one
+COMMIT_INTERVAL = 3600
+
+class SyntheticHistory:
+    """
+    Deterministic history of a Java-like code base. Commits modify a few files, rename or move classes
+    and add new ones. The same parameters and seed always produce the same commits, so the SHA-1s and
+    every stage output are comparable between runs and machines.
+    """
+    def __init__(self, parameters, seed=DEFAULT_SEED):
+        self.parameters = parameters
+        self.random = random.Random(seed)
+        self.package_count = max(1, parameters['files'] // FILES_PER_PACKAGE)
+        self.files = {} # path -> (package, class name, lines)
+        self.next_class = 0
+        self.next_value = 0
+
+    def generate_line(self):
+        self.next_value += 1
+        value = self.next_value
+        choice = self.random.random()
+        if choice < 0.15:
+            return ''
+        if choice < 0.3:
+            return f'    // keeps value {value} in range'
+        if choice < 0.7:
+            return f'    private int field{value} = {value % 97};'
+        return f'    int method{value}(int x) {{ return x * {value % 13} + field{value - 1}; }}'
+
+    def new_class(self):
+        self.next_class += 1
+        package = f'package{self.random.randrange(self.package_count)}'
+        class_name = f'Class{self.next_class}'
+        lines = [self.generate_line() for _ in range(self.random.randint(*FILE_LINES))]
+        return package, class_name, lines
+
+    @staticmethod
+    def get_path(package, class_name):
+        return f'src/main/java/org/example/{package}/{class_name}.java'
+
+    @staticmethod
+    def render(package, class_name, lines):
+        return '\n'.join([f'package org.example.{package};', '', f'public class {class_name} {{', *lines, '}', ''])
+
+    def modify(self, lines):
+        lines = list(lines)
+        for _ in range(self.parameters['lines_changed']):
+            choice = self.random.random()
+            position = self.random.randrange(len(lines) + 1)
+            if choice < 0.5 and position < len(lines):
+                lines[position] = self.generate_line()
+            elif choice < 0.75 or len(lines) < 2:
+                lines.insert(position, self.generate_line())
+            elif position < len(lines):
+                del lines[position]
+        return lines
+
+    def initial_commit(self):
+        changes = {}
+        for _ in range(self.parameters['files']):
+            package, class_name, lines = self.new_class()
+            path = self.get_path(package, class_name)
+            self.files[path] = (package, class_name, lines)
+            changes[path] = self.render(package, class_name, lines)
+        return changes, []
+
+    def next_commit(self):
+        """
+        Return ({path: content, or None for a deleted file}, refactorings) of the next commit.
+        """
+        changes = {}
+        refactorings = []
+        if self.random.random() < self.parameters['rename_rate']:
+            old_path = self.random.choice(sorted(self.files))
+            package, class_name, lines = self.files.pop(old_path)
+            if self.random.random() < 0.5:
+                self.next_class += 1
+                new_package, new_class_name = package, f'Class{self.next_class}'
+                refactorings.append(get_refactoring('Rename Class', f'org.example.{package}.{class_name} renamed to org.example.{package}.{new_class_name}', old_path, 3))
+            else:
+                new_package, new_class_name = f'package{self.random.randrange(self.package_count)}', class_name
+                refactorings.append(get_refactoring('Move Class', f'org.example.{package}.{class_name} moved to org.example.{new_package}.{class_name}', old_path, 3))
+            new_path = self.get_path(new_package, new_class_name)
+            self.files[new_path] = (new_package, new_class_name, lines)
+            changes[old_path] = None
+            changes[new_path] = self.render(new_package, new_class_name, lines)
+
+        for path in self.random.sample(sorted(self.files), min(self.parameters['churn'], len(self.files))):
+            package, class_name, lines = self.files[path]
+            lines = self.modify(lines)
+            self.files[path] = (package, class_name, lines)
+            changes[path] = self.render(package, class_name, lines)
+            if not refactorings and self.random.random() < self.parameters['refactoring_rate']:
+                refactorings.append(get_refactoring('Extract Method', f'method{self.next_value}() extracted from {class_name}', path, 4))
+
+        if self.random.random() < 0.1:
+            package, class_name, lines = self.new_class()
+            path = self.get_path(package, class_name)
+            self.files[path] = (package, class_name, lines)
+            changes[path] = self.render(package, class_name, lines)
+        return changes, refactorings
+
+def get_refactoring(refactoring_type, description, file_path, line):
+    location = {'filePath': file_path, 'startLine': line, 'endLine': line, 'startColumn': 1, 'endColumn': 1,
+                'codeElementType': 'TYPE_DECLARATION' if refactoring_type.endswith('Class') else 'METHOD_DECLARATION'}
+    return {'type': refactoring_type, 'description': f'{refactoring_type}\t{description}',
+            'leftSideLocations': [location], 'rightSideLocations': [location]}
+
+def write_data(stream, data):
+    data = data.encode('utf-8')
+    stream.write(b'data %d\n' % len(data))
+    stream.write(data)
+    stream.write(b'\n')
+
+def write_fast_import_stream(stream, history, authors):
+    """
+    Write the whole history as a git fast-import stream and return the refactorings of every commit mark.
+    """
+    refactorings_by_mark = {}
+    for mark in range(1, history.parameters['commits'] + 1):
+        changes, refactorings = history.initial_commit() if mark == 1 else history.next_commit()
+        refactorings_by_mark[mark] = refactorings
+        author = authors[history.random.randrange(len(authors))]
+        timestamp = START_TIMESTAMP + mark * COMMIT_INTERVAL
+        stream.write(f'commit refs/heads/main\nmark :{mark}\n'.encode('utf-8'))
+        stream.write(f'author {author} {timestamp} +0000\ncommitter {author} {timestamp} +0000\n'.encode('utf-8'))
+        write_data(stream, f'Synthetic commit {mark}')
+        for path, content in changes.items():
+            if content is None:
+                stream.write(f'D {path}\n'.encode('utf-8'))
+            else:
+                stream.write(f'M 100644 inline {path}\n'.encode('utf-8'))
+                write_data(stream, content)
+        stream.write(b'\n')
+    return refactorings_by_mark
+
+def read_marks(marks_path):
+    with open(marks_path, 'r', encoding='utf-8') as file:
+        return {int(mark[1:]): sha for mark, sha in (line.split() for line in file if line.strip())}
+
+def generate_repository(repo_path, refactoring_miner_output_path, parameters, seed=DEFAULT_SEED):
+    """
+    Generate a synthetic repository at repo_path with its HEAD checked out, and the RefactoringMiner
+    output it would produce at refactoring_miner_output_path, newest commit first like RefactoringMiner.
+    """
+    os.makedirs(repo_path)
+    subprocess.check_call(['git', 'init', '--quiet', '--initial-branch=main', repo_path])
+    history = SyntheticHistory(parameters, seed)
+    authors = [f'Developer {index} <developer{index}@example.com>' for index in range(parameters['authors'])]
+    marks_path = os.path.join(repo_path, '.git', 'synthetic_marks')
+
+    process = subprocess.Popen(['git', 'fast-import', '--quiet', f'--export-marks={marks_path}'], cwd=repo_path, stdin=subprocess.PIPE)
+    try:
+        refactorings_by_mark = write_fast_import_stream(process.stdin, history, authors)
+    finally:
+        process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f'git fast-import failed with exit code {process.returncode}')
+    subprocess.check_call(['git', 'reset', '--quiet', '--hard', 'main'], cwd=repo_path)
+
+    shas = read_marks(marks_path)
+    os.remove(marks_path)
+    # RefactoringMiner does not analyse the root commit
+    commits = ({'repository': f'{SYNTHETIC_REPOSITORY_URL}.git', 'sha1': shas[mark], 'url': f'{SYNTHETIC_REPOSITORY_URL}/commit/{shas[mark]}',
+                'refactorings': refactorings_by_mark[mark]} for mark in range(len(shas), 1, -1))
+    write_commits(commits, refactoring_miner_output_path)
+
+def get_repository_key(parameters, seed):
+    key = json.dumps({'parameters': parameters, 'seed': seed, 'version': GENERATOR_VERSION}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def ensure_synthetic_repository(parameters, seed=DEFAULT_SEED, output_dir=SYNTHETIC_REPOSITORY_DIR):
+    """
+    Return (repository path, RefactoringMiner output path) of a synthetic repository, generating it on
+    first use. Generated repositories are kept per parameters and seed and reused by later runs.
+    """
+    directory = os.path.join(output_dir, get_repository_key(parameters, seed))
+    repo_path = os.path.join(directory, 'repository')
+    refactoring_miner_output_path = os.path.join(directory, 'refactorings.json')
+    if not os.path.exists(refactoring_miner_output_path): # written last, so its presence marks a complete repository
+        shutil.rmtree(directory, ignore_errors=True)
+        generate_repository(repo_path, refactoring_miner_output_path, parameters, seed)
+    return repo_path, refactoring_miner_output_path
+
+def get_parameters(preset, overrides):
+    parameters = dict(REPOSITORY_PRESETS[preset])
+    parameters.update({name: value for name, value in overrides.items() if value is not None})
+    return parameters
+
+def add_parameter_arguments(parser):
+    parser.add_argument("--preset", choices=sorted(REPOSITORY_PRESETS), default=DEFAULT_PRESET, help="Size of the synthetic repository.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the generated history.")
+    for name, value in REPOSITORY_PRESETS[DEFAULT_PRESET].items():
+        parser.add_argument(f"--{name}", type=type(value), help=f"Override the {name} of the preset.")
+
+def get_parameter_overrides(args):
+    return {name: getattr(args, name) for name in REPOSITORY_PRESETS[DEFAULT_PRESET]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic git repository and its RefactoringMiner output.")
+    add_parameter_arguments(parser)
+    parser.add_argument("--output_dir", default=SYNTHETIC_REPOSITORY_DIR, help="Directory the generated repositories are kept in.")
+    args = parser.parse_args()
+
+    repo_path, refactoring_miner_output_path = ensure_synthetic_repository(
+        get_parameters(args.preset, get_parameter_overrides(args)), args.seed, args.output_dir)
+    commit_count = sum(1 for commit in iter_commits(refactoring_miner_output_path) if commit['refactorings'])
+    print(f'Repository: {repo_path}\nRefactoringMiner output: {refactoring_miner_output_path} ({commit_count} refactoring commits)')
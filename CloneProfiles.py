@@ -0,0 +1,79 @@
+import subprocess
+
+# How a repository is cloned for a run:
+#   filter    partial clone filter of the mirror, None for a mirror with every object
+#   checkout  what the working clone checks out: 'full' the whole tree of HEAD, 'sparse' only the
+#             files counted by LocCounter (INCLUDE_EXT), 'none' nothing, the stages read the object store
+CLONE_PROFILES = {
+    'full': {'filter': None, 'checkout': 'full'},
+    'no_checkout': {'filter': None, 'checkout': 'none'},
+    'sparse': {'filter': None, 'checkout': 'sparse'},
+    'blobless': {'filter': 'blob:none', 'checkout': 'none'}
+}
+DEFAULT_CLONE_PROFILE = 'full'
+
+def get_sparse_patterns(include_ext):
+    return [f'*.{extension}' for extension in include_ext]
+
+def get_partial_clone_filter(repo_path):
+    """
+    Return the filter of a partial clone, or None if the repository has every object.
+    """
+    process = subprocess.run(['git', 'config', '--get', 'remote.origin.partialclonefilter'], cwd=repo_path,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+    return process.stdout.strip() if process.returncode == 0 else None
+
+def is_partial_clone(repo_path):
+    """
+    Check whether objects of a repository may be missing locally and fetched from its origin on demand.
+    """
+    return get_partial_clone_filter(repo_path) is not None
+
+def set_partial_clone(repo_path, blob_filter):
+    """
+    Let git fetch the objects a clone of a partial mirror is missing from its origin when they are read.
+    """
+    subprocess.check_call(['git', 'config', 'remote.origin.promisor', 'true'], cwd=repo_path)
+    subprocess.check_call(['git', 'config', 'remote.origin.partialclonefilter', blob_filter], cwd=repo_path)
+
+def complete_partial_clone(repo_path):
+    """
+    Download every object a partial clone is missing, so it can serve profiles that read all blobs.
+    """
+    # The filter is only removed once every object arrived, a failed fetch leaves a mirror that still reports its missing blobs
+    subprocess.check_call(['git', 'fetch', '--refetch', '--no-filter', '--tags', 'origin'], cwd=repo_path)
+    subprocess.check_call(['git', 'config', '--unset', 'remote.origin.partialclonefilter'], cwd=repo_path)
+
+def set_sparse_checkout(repo_path, include_ext):
+    """
+    Limit the checkouts of a clone to the files with the given extensions.
+    """
+    subprocess.check_call(['git', 'sparse-checkout', 'set', '--no-cone', *get_sparse_patterns(include_ext)], cwd=repo_path)
+
+def get_missing_objects(repo_path, revisions):
+    """
+    Return the objects reachable from the trees of the given commits or trees that are not present
+    locally, without fetching them. Parents of the commits are not walked.
+    """
+    process = subprocess.run(['git', 'rev-list', '--objects', '--no-walk', '--missing=print', '--stdin'], cwd=repo_path,
+                             input='\n'.join(revisions) + '\n', stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return {line[1:].strip() for line in process.stdout.splitlines() if line.startswith('?')}
+
+def fetch_objects(repo_path, object_shas):
+    """
+    Download the given objects from the origin of a partial clone with a single request, the way git
+    fetches a missing object when it is read, instead of one request per object.
+    """
+    subprocess.run(['git', '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', 'origin', '--no-tags', '--no-write-fetch-head',
+                    '--recurse-submodules=no', '--filter=blob:none', '--stdin'], cwd=repo_path,
+                   input='\n'.join(object_shas) + '\n', universal_newlines=True, check=True)
+
+def prefetch_blobs(repo_path, revisions, blob_shas):
+    """
+    Download those of the given blobs of the given commits or trees that a partial clone is missing with a single request.
+    """
+    if not blob_shas:
+        return
+    missing = get_missing_objects(repo_path, revisions) & set(blob_shas)
+    if missing:
+        fetch_objects(repo_path, sorted(missing))
@@ -0,0 +1,278 @@
+import csv
+import json
+import os
+import shutil
+from datetime import datetime
+
+from DiffStore import decode_hunks, iter_commit_diffs
+from RefactoringMinerOutput import iter_commits
+
+# Parquet datasets, one directory per output kind, partitioned by repository (ParquetOutputs/<dataset>/repository=<name>/)
+PARQUET_OUTPUT_DIR = 'ParquetOutputs'
+EXPORT_BATCH_SIZE = 10000 # rows per record batch, so large outputs are converted without loading them whole
+
+REFACTORINGS = 'refactorings'
+COMMIT_DIFFS = 'commit_diffs'
+DEVELOPER_EFFORT = 'developer_effort'
+GITHUB_ISSUES = 'github_issues'
+JIRA_ISSUES = 'jira_issues'
+
+def import_pyarrow():
+    """
+    pyarrow is only needed for the Parquet export, so it is imported when the export is used.
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Parquet export requires pyarrow. Install it with: pip install pyarrow")
+    return pyarrow
+
+def get_schemas(pa):
+    """
+    Return the schema of every dataset. Names that repeat on many rows (repositories, developers,
+    refactoring types, issue states) are dictionary-encoded.
+    """
+    name = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp('s', tz='UTC')
+    location = pa.struct([
+        ('file_path', pa.string()),
+        ('start_line', pa.int32()),
+        ('end_line', pa.int32()),
+        ('code_element_type', name),
+        ('code_element', pa.string())
+    ])
+    return {
+        REFACTORINGS: pa.schema([
+            ('repository', name),
+            ('commit_hash', pa.string()),
+            ('type', name),
+            ('description', pa.string()),
+            ('left_side_locations', pa.list_(location)),
+            ('right_side_locations', pa.list_(location))
+        ]),
+        COMMIT_DIFFS: pa.schema([
+            ('repository', name),
+            ('commit_hash', pa.string()),
+            ('previous_commit_hash', pa.string()),
+            ('insertions', pa.int32()),
+            ('deletions', pa.int32()),
+            ('files_modified', pa.int32()),
+            ('filename', pa.string()),
+            ('added_line_numbers', pa.list_(pa.int32())),
+            ('added_lines', pa.list_(pa.string())),
+            ('deleted_line_numbers', pa.list_(pa.int32())),
+            ('deleted_lines', pa.list_(pa.string()))
+        ]),
+        DEVELOPER_EFFORT: pa.schema([
+            ('repository', name),
+            ('developer', name),
+            ('refactoring_hash', pa.string()),
+            ('previous_hash', pa.string()),
+            ('tloc', pa.int64()),
+            ('current_loc', pa.int64()),
+            ('previous_loc', pa.int64())
+        ]),
+        GITHUB_ISSUES: pa.schema([
+            ('repository', name),
+            ('id', pa.int64()),
+            ('number', pa.int64()),
+            ('title', pa.string()),
+            ('state', name),
+            ('user', name),
+            ('labels', pa.list_(pa.string())),
+            ('created_at', timestamp),
+            ('updated_at', timestamp),
+            ('closed_at', timestamp),
+            ('comments', pa.int32()),
+            ('body', pa.string())
+        ]),
+        JIRA_ISSUES: pa.schema([
+            ('repository', name),
+            ('id', pa.string()),
+            ('key', pa.string()),
+            ('summary', pa.string()),
+            ('issue_type', name),
+            ('status', name),
+            ('resolution', name),
+            ('priority', name),
+            ('created', timestamp),
+            ('updated', timestamp),
+            ('resolution_date', timestamp)
+        ])
+    }
+
+def parse_timestamp(value, date_format=None):
+    if not value:
+        return None
+    if date_format:
+        return datetime.strptime(value, date_format)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def parse_int(value):
+    return int(value) if value not in (None, '', 'None') else None
+
+def get_name(field, key='name'):
+    """Return the name of a nested JIRA or GitHub object such as a status or user, or None if it is not set."""
+    return field.get(key) if isinstance(field, dict) else None
+
+def location_rows(locations):
+    return [{
+        'file_path': location.get('filePath'),
+        'start_line': location.get('startLine'),
+        'end_line': location.get('endLine'),
+        'code_element_type': location.get('codeElementType'),
+        'code_element': location.get('codeElement')
+    } for location in locations]
+
+def iter_refactoring_rows(repository, refminer_output_path):
+    for commit in iter_commits(refminer_output_path):
+        for refactoring in commit['refactorings']:
+            yield {
+                'repository': repository,
+                'commit_hash': commit['sha1'],
+                'type': refactoring.get('type'),
+                'description': refactoring.get('description'),
+                'left_side_locations': location_rows(refactoring.get('leftSideLocations', [])),
+                'right_side_locations': location_rows(refactoring.get('rightSideLocations', []))
+            }
+
+def iter_commit_diff_rows(repository, commit_diff_path):
+    for commit in iter_commit_diffs(commit_diff_path):
+        for file_diff in commit['files']:
+            added_lines = list(decode_hunks(file_diff['added']))
+            deleted_lines = list(decode_hunks(file_diff['deleted']))
+            yield {
+                'repository': repository,
+                'commit_hash': commit['commit_hash'],
+                'previous_commit_hash': commit['previous_commit_hash'],
+                'insertions': commit['diff_stats']['insertions'],
+                'deletions': commit['diff_stats']['deletions'],
+                'files_modified': commit['diff_stats']['files_modified'],
+                'filename': file_diff['filename'],
+                'added_line_numbers': [line_number for line_number, _ in added_lines],
+                'added_lines': [content for _, content in added_lines],
+                'deleted_line_numbers': [line_number for line_number, _ in deleted_lines],
+                'deleted_lines': [content for _, content in deleted_lines]
+            }
+
+def iter_developer_effort_rows(repository, developer_effort_csv_path):
+    with open(developer_effort_csv_path, 'r', newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader, None) # header
+        for developer, refactoring_hash, previous_hash, tloc, current_loc, previous_loc in reader:
+            yield {
+                'repository': repository,
+                'developer': developer,
+                'refactoring_hash': refactoring_hash,
+                'previous_hash': previous_hash,
+                'tloc': parse_int(tloc),
+                'current_loc': parse_int(current_loc),
+                'previous_loc': parse_int(previous_loc)
+            }
+
+def iter_github_issue_rows(repository, issues_path):
+    with open(issues_path, 'r', encoding='utf-8') as file:
+        issues = json.load(file)
+    for issue in issues:
+        yield {
+            'repository': repository,
+            'id': issue['id'],
+            'number': issue.get('number'),
+            'title': issue.get('title'),
+            'state': issue.get('state'),
+            'user': get_name(issue.get('user'), 'login'),
+            'labels': [label['name'] for label in issue.get('labels', [])],
+            'created_at': parse_timestamp(issue.get('created_at')),
+            'updated_at': parse_timestamp(issue.get('updated_at')),
+            'closed_at': parse_timestamp(issue.get('closed_at')),
+            'comments': issue.get('comments'),
+            'body': issue.get('body')
+        }
+
+def iter_jira_issue_rows(repository, issues_path):
+    jira_date_format = '%Y-%m-%dT%H:%M:%S.%f%z'
+    with open(issues_path, 'r', encoding='utf-8') as file:
+        issues = json.load(file)
+    for issue in issues:
+        fields = issue.get('fields', {})
+        yield {
+            'repository': repository,
+            'id': issue['id'],
+            'key': issue.get('key'),
+            'summary': fields.get('summary'),
+            'issue_type': get_name(fields.get('issuetype')),
+            'status': get_name(fields.get('status')),
+            'resolution': get_name(fields.get('resolution')),
+            'priority': get_name(fields.get('priority')),
+            'created': parse_timestamp(fields.get('created'), jira_date_format),
+            'updated': parse_timestamp(fields.get('updated'), jira_date_format),
+            'resolution_date': parse_timestamp(fields.get('resolutiondate'), jira_date_format)
+        }
+
+def iter_record_batches(pa, rows, schema, batch_size=EXPORT_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield pa.RecordBatch.from_pylist(batch, schema=schema)
+            batch = []
+    if batch:
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+def get_partition_path(pa, partitioning, dataset, repository, output_dir=PARQUET_OUTPUT_DIR):
+    """
+    Return the directory of the partition of a repository, with the repository name encoded like pyarrow writes it.
+    """
+    partition_dir, _ = partitioning.format(pa.dataset.field('repository') == pa.scalar(repository, pa.string()))
+    return os.path.join(output_dir, dataset, partition_dir)
+
+def write_partition(dataset, repository, rows, output_dir=PARQUET_OUTPUT_DIR):
+    """
+    Write the rows of one repository into its partition of a dataset, replacing a previous export of it.
+    Returns the number of rows written. Without rows, the previous export is removed.
+    """
+    pa = import_pyarrow()
+    schema = get_schemas(pa)[dataset]
+    partitioning = pa.dataset.partitioning(pa.schema([schema.field('repository')]), flavor='hive')
+    row_count = 0
+
+    def count_rows(batches):
+        nonlocal row_count
+        for batch in batches:
+            row_count += batch.num_rows
+            yield batch
+
+    pa.dataset.write_dataset(
+        count_rows(iter_record_batches(pa, rows, schema)), os.path.join(output_dir, dataset), schema=schema,
+        format='parquet', partitioning=partitioning, existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet')
+    if row_count == 0:
+        # Nothing was written to the partition, so write_dataset did not replace it
+        shutil.rmtree(get_partition_path(pa, partitioning, dataset, repository, output_dir), ignore_errors=True)
+    return row_count
+
+def export_refactorings(repository, refminer_output_path, output_dir=PARQUET_OUTPUT_DIR):
+    return write_partition(REFACTORINGS, repository, iter_refactoring_rows(repository, refminer_output_path), output_dir)
+
+def export_commit_diffs(repository, commit_diff_path, output_dir=PARQUET_OUTPUT_DIR):
+    return write_partition(COMMIT_DIFFS, repository, iter_commit_diff_rows(repository, commit_diff_path), output_dir)
+
+def export_developer_effort(repository, developer_effort_csv_path, output_dir=PARQUET_OUTPUT_DIR):
+    return write_partition(DEVELOPER_EFFORT, repository, iter_developer_effort_rows(repository, developer_effort_csv_path), output_dir)
+
+def export_github_issues(repository, issues_path, output_dir=PARQUET_OUTPUT_DIR):
+    return write_partition(GITHUB_ISSUES, repository, iter_github_issue_rows(repository, issues_path), output_dir)
+
+def export_jira_issues(repository, issues_path, output_dir=PARQUET_OUTPUT_DIR):
+    return write_partition(JIRA_ISSUES, repository, iter_jira_issue_rows(repository, issues_path), output_dir)
+
+def read_dataset(dataset, columns=None, filters=None, output_dir=PARQUET_OUTPUT_DIR):
+    """
+    Read a dataset across all repositories as a pyarrow Table. Only the given columns are read, and
+    filters such as [('repository', '=', 'shiro'), ('tloc', '>', 100)] skip whole partitions and row
+    groups whose statistics rule them out. Use .to_pandas() on the result for a DataFrame.
+    """
+    pa = import_pyarrow()
+    return pa.parquet.read_table(os.path.join(output_dir, dataset), columns=columns, filters=filters, partitioning='hive')
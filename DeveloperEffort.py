@@ -2,33 +2,35 @@ import json
 import subprocess
 import csv
 from pathlib import Path
+from LocCache import LocCache
+from LocCounter import INCLUDE_EXT, TreeLocCounter, total_counts
+from Metrics import timer
+from RefactoringMinerOutput import iter_commits
+
+# 'trees' reads the line counts from the git object store, 'checkout' checks out each commit and runs scc
+TLOC_MODES = ('trees', 'checkout')
+TLOC_BATCH_SIZE = 200 # refactoring commits measured together in 'trees' mode
+
+def run_scc_languages(repo_path):
+    """
+    Run SCC on the current checked-out commit and return {language: (code, comments, blanks)} from its JSON output
+    """
+    include_ext = ','.join(INCLUDE_EXT)  # Include only these languages (can be modified in LocCounter)
+
+    result = subprocess.check_output(
+        ['scc', '--format', 'json', '--no-complexity', '--include-ext', include_ext],
+        cwd=repo_path,
+        universal_newlines=True
+    )
+    return {language['Name']: (language['Code'], language['Comment'], language['Blank']) for language in json.loads(result) or []}
 
 def run_scc(repo_path):
     """
     Run SCC on the current checked-out commit and return the TLOC (Total Lines of Code)
     """
-    include_ext = 'c,cpp,h,hpp,py,java,js,rb,go,cs,php,swift,ts,rs,kt,scala,pl,sh,ps1'  # Include only these languages (can be modified)
-
     try:
-        #SCC command to be executed with the flags
-        scc_command = f'scc --no-complexity --by-file --include-ext {include_ext}'
-
-        result = subprocess.check_output(
-            scc_command,
-            shell=True,  
-            cwd=repo_path,  
-            universal_newlines=True
-        )
-
-        total_tloc = 0
-        for line in result.splitlines():
-            if "Total" in line:
-                parts = line.split()
-                if len(parts) >= 3 and parts[2].isdigit(): 
-                    total_tloc = int(parts[2])  # Use the third value as TLOC
-                    break 
-
-        print(f"Total TLOC from SCC: {total_tloc}") 
+        total_tloc = sum(total_counts(run_scc_languages(repo_path)))
+        print(f"Total TLOC from SCC: {total_tloc}")
         return total_tloc
 
     except subprocess.CalledProcessError as e:
@@ -41,12 +43,16 @@ def calculate_tloc_diff(repo_path, commit_hash):
     """
     try:
         # Get the LOC for the current commit
-        subprocess.check_call(['git', 'checkout', commit_hash], cwd=repo_path)
-        current_tloc = run_scc(repo_path)
+        with timer('git_checkout'):
+            subprocess.check_call(['git', 'checkout', commit_hash], cwd=repo_path)
+        with timer('scc'):
+            current_tloc = run_scc(repo_path)
 
         # Checkout to the previous commit
-        subprocess.check_call(['git', 'checkout', commit_hash + '^'], cwd=repo_path)
-        previous_tloc = run_scc(repo_path)
+        with timer('git_checkout'):
+            subprocess.check_call(['git', 'checkout', commit_hash + '^'], cwd=repo_path)
+        with timer('scc'):
+            previous_tloc = run_scc(repo_path)
 
         # The absolute difference between the two TLOCs
         tloc_diff = abs(current_tloc - previous_tloc)
@@ -56,29 +62,67 @@ def calculate_tloc_diff(repo_path, commit_hash):
         print(f"Error occurred while calculating TLOC difference for commit {commit_hash}: {e}")
         return 0, 0, 0
 
-def collect_refactoring_developer_effort(repo_path, refminer_output_path, output_csv_path):
+def calculate_tloc_diffs_from_trees(loc_counter, commit_hashes):
+    """
+    Calculate the TLOC difference between a batch of refactoring commits and their previous commits
+    from the git object store. The repository is never checked out.
+    Returns {commit hash: (tloc diff, current TLOC, previous TLOC)}.
+    """
+    measured = loc_counter.measure_revisions([revision for commit_hash in commit_hashes for revision in (commit_hash, commit_hash + '~1')])
+
+    tloc_diffs = {}
+    for commit_hash in commit_hashes:
+        current_languages = measured[commit_hash]
+        previous_languages = measured[commit_hash + '~1']
+        if current_languages is None or previous_languages is None:
+            print(f"Error occurred while calculating TLOC difference for commit {commit_hash}: revision not found")
+            tloc_diffs[commit_hash] = (0, 0, 0)
+            continue
+
+        current_tloc = sum(total_counts(current_languages))
+        previous_tloc = sum(total_counts(previous_languages))
+        tloc_diffs[commit_hash] = (abs(current_tloc - previous_tloc), current_tloc, previous_tloc)
+    return tloc_diffs
+
+def collect_refactoring_developer_effort(repo_path, refminer_output_path, output_csv_path, tloc_mode='trees'):
     """
     Collect developer effort for refactorings and store the results in a CSV file.
     """
-    
-    with open(refminer_output_path, 'r', encoding="utf-8") as json_file:
-        refactorings_data = json.load(json_file)
-
-    
     p = Path(output_csv_path)
     directory = str(p.parent)
     Path(directory).mkdir(parents=True, exist_ok=True)
+    loc_counter = TreeLocCounter(repo_path, LocCache()) if tloc_mode == 'trees' else None
+    try:
+        write_developer_effort(repo_path, refminer_output_path, output_csv_path, loc_counter)
+    finally:
+        if loc_counter:
+            loc_counter.close()
+            loc_counter.cache.close()
+
+    print(f"Developer effort analysis saved to {output_csv_path}")
+
+def write_developer_effort(repo_path, refminer_output_path, output_csv_path, loc_counter):
     with open(output_csv_path, mode='w', newline='', encoding='utf-8') as csv_file:
         writer = csv.writer(csv_file)
         # Add columns for both current and previous LOC
         writer.writerow(['Developer', 'Refactoring Hash', 'Previous Hash', 'TLOC (Touched Lines of Code)', 'Current LOC', 'Previous LOC'])
 
+        # Refactoring commits waiting to be measured together in 'trees' mode
+        batch = []
+
         # Iterate over the commits with refactorings
-        for commit in refactorings_data['commits']:
+        for commit in iter_commits(refminer_output_path):
             commit_hash = commit['sha1']
             if commit['refactorings']:  # Only consider commits with refactorings
                 print(f"Processing commit {commit_hash} with refactorings")
 
+                if loc_counter:
+                    batch.append(commit_hash)
+                    if len(batch) >= TLOC_BATCH_SIZE:
+                        write_tree_batch(writer, loc_counter, batch)
+                        batch = []
+                    continue
+
                 # Get commit metadata (developer and parent hash)
                 git_log = subprocess.check_output(
                     ['git', 'log', '--pretty=format:%P,%an', '-n', '1', commit_hash],
@@ -96,4 +140,30 @@ def collect_refactoring_developer_effort(repo_path, refminer_output_path, output
                 # Skip the commits that have no refactorings
                 print(f"Skipping commit {commit_hash} (no refactorings)")
 
-    print(f"Developer effort analysis saved to {output_csv_path}")
\ No newline at end of file
+        if batch:
+            write_tree_batch(writer, loc_counter, batch)
+
+def write_tree_batch(writer, loc_counter, commit_hashes):
+    """
+    Measure a batch of refactoring commits from the object store and write their rows in order.
+    """
+    tloc_diffs = calculate_tloc_diffs_from_trees(loc_counter, commit_hashes)
+    for commit_hash in commit_hashes:
+        # Commit metadata is read from the object store as well
+        parent_hashes, developer = loc_counter.commit_info(commit_hash)
+        tloc_diff, current_tloc, previous_tloc = tloc_diffs[commit_hash]
+        writer.writerow([developer, commit_hash, ' '.join(parent_hashes), tloc_diff, current_tloc, previous_tloc])
+
+def merge_developer_effort(input_csv_paths, output_csv_path):
+    """
+    Concatenate developer effort files, such as those of the RefactoringMiner shards newest range first, under a single header.
+    """
+    with open(output_csv_path, mode='w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        for index, input_csv_path in enumerate(input_csv_paths):
+            with open(input_csv_path, mode='r', newline='', encoding='utf-8') as input_file:
+                reader = csv.reader(input_file)
+                header = next(reader, None)
+                if index == 0 and header:
+                    writer.writerow(header)
+                writer.writerows(reader)
@@ -0,0 +1,165 @@
+import gzip
+import io
+import json
+import os
+
+# Extension of the commit diff outputs written by Runner. The format of a store follows its extension:
+#   .json                          the original indented JSON array with one object per added or deleted line
+#   .jsonl, .jsonl.gz, .jsonl.zst  one compact commit record per line, optionally gzip or zstd compressed
+DEFAULT_EXTENSION = '.jsonl.gz'
+GZIP_COMPRESSION_LEVEL = 6
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst diff stores requires zstandard. Install it with: pip install zstandard")
+    return zstandard
+
+def is_json_array(path):
+    return path.endswith('.json')
+
+def open_store(path, mode, format_path=None):
+    """
+    Open a diff store as text for reading ('r') or writing ('w'), with the compression given by the
+    extension of format_path, which defaults to path.
+    """
+    format_path = format_path or path
+    if format_path.endswith('.gz'):
+        # No timestamp in the gzip header, so the same diffs always give a byte-identical store
+        return io.TextIOWrapper(gzip.GzipFile(path, mode + 'b', compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0), encoding='utf-8')
+    if format_path.endswith('.zst'):
+        zstandard = import_zstandard()
+        raw_file = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw_file, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw_file, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def encode_hunks(lines):
+    """
+    Run-length encode [(line_number, content)] into hunks [[first_line_number, [content, ...]]] of consecutive lines.
+    """
+    hunks = []
+    next_line_number = None
+    for line_number, content in lines:
+        if line_number != next_line_number:
+            hunks.append([line_number, []])
+        hunks[-1][1].append(content)
+        next_line_number = line_number + 1
+    return hunks
+
+def decode_hunks(hunks):
+    """
+    Yield the (line_number, content) pairs of run-length encoded hunks.
+    """
+    for first_line_number, contents in hunks:
+        for offset, content in enumerate(contents):
+            yield first_line_number + offset, content
+
+def create_commit_diff(commit_hash, previous_commit_hash, diff_stats, file_diffs):
+    """
+    Build the compact record of a commit. file_diffs is [(filename, added_lines, deleted_lines)]
+    where the lines are (line_number, content) pairs, e.g. the diff_parsed lists of PyDriller.
+    """
+    return {
+        'commit_hash': commit_hash,
+        'previous_commit_hash': previous_commit_hash,
+        'diff_stats': diff_stats,
+        'files': [{
+            'filename': filename,
+            'added': encode_hunks(added_lines),
+            'deleted': encode_hunks(deleted_lines)
+        } for filename, added_lines, deleted_lines in file_diffs]
+    }
+
+def expand_commit_diff(commit_diff):
+    """
+    Turn a compact record into the original format, with a {'line_number', 'content'} object per line.
+    """
+    return {
+        'commit_hash': commit_diff['commit_hash'],
+        'previous_commit_hash': commit_diff['previous_commit_hash'],
+        'diff_stats': commit_diff['diff_stats'],
+        'diff_content': [{
+            'filename': file_diff['filename'],
+            'added_lines': [{'line_number': line_number, 'content': content} for line_number, content in decode_hunks(file_diff['added'])],
+            'deleted_lines': [{'line_number': line_number, 'content': content} for line_number, content in decode_hunks(file_diff['deleted'])]
+        } for file_diff in commit_diff['files']]
+    }
+
+def compact_commit_diff(commit_diff):
+    """
+    Turn a record of the original format into a compact record.
+    """
+    return create_commit_diff(commit_diff['commit_hash'], commit_diff['previous_commit_hash'], commit_diff['diff_stats'], [
+        (file_diff['filename'],
+         [(line['line_number'], line['content']) for line in file_diff['added_lines']],
+         [(line['line_number'], line['content']) for line in file_diff['deleted_lines']])
+        for file_diff in commit_diff['diff_content']])
+
+class DiffStoreWriter:
+    """
+    Appends compact commit records to a diff store as they are produced, so memory use does not grow
+    with the number of commits. The store replaces the output file atomically when it is closed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.temporary_path = f'{path}.tmp'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open_store(self.temporary_path, 'w', format_path=path)
+        self.commit_count = 0
+        if is_json_array(path):
+            self.file.write('[\n')
+
+    def write(self, commit_diff):
+        """
+        Append a compact commit record, as built by create_commit_diff.
+        """
+        if is_json_array(self.path):
+            if self.commit_count > 0:
+                self.file.write(',\n')
+            self.file.write(json.dumps(expand_commit_diff(commit_diff), indent=4))
+        else:
+            self.file.write(json.dumps(commit_diff, separators=(',', ':')))
+            self.file.write('\n')
+        self.commit_count += 1
+
+    def close(self):
+        if is_json_array(self.path):
+            self.file.write('\n]')
+        self.file.close()
+        os.replace(self.temporary_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temporary_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard() # a failed run leaves the previous output in place
+
+def iter_commit_diffs(path, expand=False):
+    """
+    Yield the commits of a diff store one at a time as compact records, or in the original
+    format with expand=True. Stores in the original .json format are read as well.
+    """
+    if is_json_array(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            commit_diffs = json.load(file)
+        for commit_diff in commit_diffs:
+            yield commit_diff if expand else compact_commit_diff(commit_diff)
+        return
+
+    with open_store(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                commit_diff = json.loads(line)
+                yield expand_commit_diff(commit_diff) if expand else commit_diff
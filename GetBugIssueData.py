@@ -1,16 +1,28 @@
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import json
 import os
 import argparse
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from HttpCache import cached_get
+from Metrics import add, bind_spans
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+MAX_SEARCH_RESULTS_PER_PAGE = 100
+MAX_CONCURRENT_PAGE_REQUESTS = 8
+RATE_LIMIT_RESTRICT_THRESHOLD = 2000 # in essence this ensures that a minor delay is issued between every Github API call.
+GITHUB_API_URL = "https://api.github.com/"
+ISSUE_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'BugIssueDataOutputs')
 
 def ensure_valid_http_result(status):
     return status < 400
 
-def run_http_query(endpoint, user, token, print_result = False, terminate_on_invalid_response = True):
-    r = requests.get(endpoint, auth=(user, token))
+def run_http_query(endpoint, user, token, print_result = False, terminate_on_invalid_response = True, session = None):
+    r = cached_get(endpoint, session=session, auth=(user, token))
     if(ensure_valid_http_result(r.status_code) == False):
         print(f'failed to fetch information from endpoint: {endpoint}. Result: {r.text}')
         if(terminate_on_invalid_response):
@@ -32,17 +44,6 @@ def get_repository(repository_url):
     repo_name = match.group(1) if match else None
     return repo_name
 
-def ensure_api_limit_respect(remaining, used, reset):
-    remaining_int = int(remaining)
-    if(remaining_int < RATE_LIMIT_RESTRICT_THRESHOLD):
-        time_until_reset = float(calculate_time_until_rate_reset(reset))
-        sleep_time = 5
-        if(time_until_reset != 0 and remaining_int != 0):
-            sleep_time = (time_until_reset / remaining_int) + 0.1
-        print(f'sleeping for: {sleep_time} remaining: {remaining}. used: {used}.')
-        time.sleep(sleep_time)
-        return
-
 def calculate_time_until_rate_reset(reset):
     ts = float(reset)
     tsUtc = datetime.utcfromtimestamp(ts).timestamp() # UTC conversion
@@ -60,55 +61,159 @@ def bug_filter(issue):
         issue_type = issue['labels'][0]['name']
     return issue_type.lower() == bug_id
 
+def get_output_file_path(file_name):
+    return os.path.join(ISSUE_OUTPUT_DIR, file_name)
+
 # appends info to the index.txt file
 def update_results_index_file(result):
-    output_file_path = f'{os.path.dirname(__file__)}' + f'./BugIssueDataOutputs/run_results.txt'
+    output_file_path = get_output_file_path('run_results.txt')
     with open(output_file_path, 'a') as file:
         file.write(result + "\n")
 
+class RateLimiter:
+    """
+    Token bucket shared by concurrent requests. The refill rate follows the X-RateLimit-Remaining and
+    X-RateLimit-Reset headers: requests are unrestricted while plenty of quota remains, and are spread
+    evenly over the time left until the reset once fewer than RATE_LIMIT_RESTRICT_THRESHOLD remain.
+    """
+    def __init__(self, capacity):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_rate = None # tokens per second, None when unrestricted
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0
+        self.slept = 0.0
+
+    def update(self, headers):
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        remaining = int(headers['X-RateLimit-Remaining'])
+        with self.lock:
+            if remaining >= RATE_LIMIT_RESTRICT_THRESHOLD:
+                self.refill_rate = None
+                return
+            time_until_reset = max(float(calculate_time_until_rate_reset(headers['X-RateLimit-Reset'])), 1.0)
+            if remaining <= 0:
+                # Quota exhausted, nothing can be sent before the reset
+                self.tokens = 0
+                self.blocked_until = time.monotonic() + time_until_reset
+                self.refill_rate = 1.0
+            else:
+                self.refill_rate = remaining / time_until_reset
+                self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.refill_rate is None:
+                    return
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.refill_rate)
+                    self.refilled_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.refill_rate
+                self.slept += wait
+            print(f'rate limited, sleeping for: {wait:.2f}')
+            add('rate_limit_sleep_seconds', wait)
+            time.sleep(wait)
+
+def create_session(user, token, pool_size=MAX_CONCURRENT_PAGE_REQUESTS):
+    """
+    Create a keep-alive session whose connection pool fits all concurrent page requests.
+    """
+    session = requests.Session()
+    session.auth = (user, token)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_page_url(url, page):
+    """
+    Return url with its page query parameter set to page.
+    """
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def get_page_number(url):
+    return int(dict(parse_qsl(urlsplit(url).query)).get('page', 1))
+
+def fetch_page(url, user, token, session, rate_limiter):
+    rate_limiter.acquire()
+    r = run_http_query(url, user, token, session=session)
+    rate_limiter.update(r.headers)
+    return r
+
 ### Gets items with support for pagination ###
-def get_items(endpoint, user, token, items_key=''):
-    r = run_http_query(endpoint, user, token)
-
-    rate_used = int(r.headers['X-RateLimit-Used'])
-    rate_remaining = int(r.headers['X-RateLimit-Remaining'])
-    rate_reset = r.headers['X-RateLimit-Reset']
-    ensure_api_limit_respect(rate_remaining, rate_used, rate_reset)
-    if(rate_remaining < 0):
-        rate_remaining = 5000
-        rate_used = 0
-
-    items = list(r.json())
-    content = r.links.get('next')
-    if(content == None):
-        return items
-    url = content['url']
-    while content != None:
-        url = content['url']
-        r = run_http_query(url, user, token)
-
-        rate_used = int(r.headers['X-RateLimit-Used'])
-        rate_remaining = int(r.headers['X-RateLimit-Remaining'])
-        rate_reset = r.headers['X-RateLimit-Reset']
-        ensure_api_limit_respect(rate_remaining, rate_used, rate_reset)
-        if(rate_remaining < 0):
-            rate_remaining = 5000
-            rate_used = 0
-
-        for issue in list(r.json()):
-            items.append(issue)
-        content = r.links.get('next')
+def get_items(endpoint, user, token, items_key='', max_workers=MAX_CONCURRENT_PAGE_REQUESTS):
+    """
+    Fetch every page of a GitHub list endpoint. The page count is read from the Link header of the
+    first response and the remaining pages are fetched concurrently over one pooled session.
+    """
+    session = create_session(user, token, max_workers)
+    rate_limiter = RateLimiter(max_workers)
+    try:
+        r = fetch_page(endpoint, user, token, session, rate_limiter)
+        items = list(r.json())
+
+        last = r.links.get('last')
+        if last is not None:
+            page_urls = [get_page_url(last['url'], page) for page in range(2, get_page_number(last['url']) + 1)]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pages = executor.map(bind_spans(lambda url: fetch_page(url, user, token, session, rate_limiter).json()), page_urls)
+                for page_items in pages: # map keeps the page order
+                    items.extend(page_items)
+        else:
+            # Without a last link the pages can only be followed one by one
+            content = r.links.get('next')
+            while content != None:
+                r = fetch_page(content['url'], user, token, session, rate_limiter)
+                items.extend(r.json())
+                content = r.links.get('next')
+    finally:
+        session.close()
+
+    if rate_limiter.slept:
+        print(f'total rate limit sleep: {rate_limiter.slept:.2f} seconds')
     only_issues = list((x for x in items if "pull_request" not in x)) # this removes pull requests from the list, which Github API returns from the issues endpoint for some reason. 
     return only_issues
 
+def load_existing_issues(output_file_path):
+    """
+    Load the issues of a previous run, or None if the repository has not been fetched before.
+    """
+    if not os.path.exists(output_file_path):
+        return None
+    with open(output_file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def merge_issues(existing_issues, updated_issues, key='id'):
+    """
+    Upsert updated issues into the issues of a previous run. Updated issues replace their old version
+    in place and new issues are put first, keeping the newest-first order of the issue listings.
+    """
+    updated_by_key = {issue[key]: issue for issue in updated_issues}
+    existing_keys = {issue[key] for issue in existing_issues}
+    new_issues = [issue for issue in updated_issues if issue[key] not in existing_keys]
+    return new_issues + [updated_by_key.get(issue[key], issue) for issue in existing_issues]
+
 def get_issue_info(search_endpoint, user, token):
     issues = get_items(search_endpoint, user, token, items_key='items')
     return issues
 
-MAX_SEARCH_RESULTS_PER_PAGE = 100
-RATE_LIMIT_RESTRICT_THRESHOLD = 2000 # in essence this ensures that a minor delay is issued between every Github API call.
 
-def main(user, token, repository_url):
+def main(user, token, repository_url, incremental=False):
+    """
+    Fetch the issues of a GitHub repository. The result is appended to run_results.txt, and False is returned if the fetch failed.
+    """
     user = user
     token = token
 
@@ -121,36 +226,47 @@ def main(user, token, repository_url):
             print(f'could not find repository name for repository address:{repository_url}. Terminating run..')
 
         uses_github_as_ITS = None
-        r = run_http_query(f"https://api.github.com/repos/{owner}/{repository}", user, token)
+        r = run_http_query(f"{GITHUB_API_URL}repos/{owner}/{repository}", user, token)
         repo_uses_github_issue_tracking = r.json()["has_issues"]
         uses_github_as_ITS = repo_uses_github_issue_tracking
         if(not repo_uses_github_issue_tracking):
             run_results = f'"repository":{repository}, "result":True, "github_ITS": {uses_github_as_ITS}, "timestamp":{datetime.utcnow().strftime("%m/%d/%Y, %H:%M:%S")}"'
             update_results_index_file(run_results)
-            return
-        search_url_issues = f"https://api.github.com/repos/{owner}/{repository}/issues?state=all&per_page=100" #f"https://api.github.com/search/issues?per_page={MAX_SEARCH_RESULTS_PER_PAGE}&q=is:issue%20repo:{owner}/{repository}"
+            return True
+        search_url_issues = f"{GITHUB_API_URL}repos/{owner}/{repository}/issues?state=all&per_page=100" #f"https://api.github.com/search/issues?per_page={MAX_SEARCH_RESULTS_PER_PAGE}&q=is:issue%20repo:{owner}/{repository}"
 
-        issues = get_issue_info(search_url_issues, user, token)
+        output_file_path = get_output_file_path(f'{repository}.json')
+        existing_issues = load_existing_issues(output_file_path) if incremental else None
+        if existing_issues:
+            # Only request issues updated since the newest update seen in the previous run
+            high_water_mark = max(issue['updated_at'] for issue in existing_issues)
+            print(f'fetching issues of {repository} updated since {high_water_mark}')
+            updated_issues = get_issue_info(f'{search_url_issues}&since={high_water_mark}', user, token)
+            issues = merge_issues(existing_issues, updated_issues)
+        else:
+            issues = get_issue_info(search_url_issues, user, token)
 
         # Filter is NOT used at the moment to get only bug related issues. The instructions seem unclear. Will need to resolve later.
         #issues_bug_list = list(filter(bug_filter, issues))
 
         # Output results
         json_object = json.dumps(issues, indent=4)
-        output_file_path = f'{os.path.dirname(__file__)}' + f'./BugIssueDataOutputs/{repository}.json'
         with open(output_file_path, 'w') as file:
             file.write(json_object)
         run_results = f'"repository":{repository}, "result":True, "github_ITS": {uses_github_as_ITS}, "issues_count": "{len(issues)}", "timestamp":{datetime.utcnow().strftime("%m/%d/%Y, %H:%M:%S")}"'
         update_results_index_file(run_results)
+        return True
     except Exception as e:
         run_results = f'"repository":{repository}, "result":Fail, "github_ITS": {uses_github_as_ITS}, "exception": "{e}", "timestamp":{datetime.utcnow().strftime("%m/%d/%Y, %H:%M:%S")}"'
         update_results_index_file(run_results)
+        return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetch GitHub repository information.")
     parser.add_argument("--user", required=True, help="GitHub username")
     parser.add_argument("--token", required=True, help="GitHub access token")
     parser.add_argument("--repository_url", required=True, help="URL of the Github repository")
+    parser.add_argument("--incremental", action="store_true", help="Only fetch issues updated since the previous output and merge them into it.")
     args = parser.parse_args()
 
-    main(args.user, args.token, args.repository_url)
\ No newline at end of file
+    main(args.user, args.token, args.repository_url, args.incremental)
\ No newline at end of file
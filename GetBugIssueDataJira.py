@@ -1,22 +1,60 @@
-import requests
 import json
 import os
+import re
+import time
 import argparse
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from HttpCache import cached_get
+from Metrics import bind_spans
+from GetBugIssueData import get_output_file_path, load_existing_issues, merge_issues
 
 JIRA_BASE_URL = "https://issues.apache.org/jira/rest/api/2/"
 SEARCH_URL = f"{JIRA_BASE_URL}search"
 PROJECT_URL = f"{JIRA_BASE_URL}project"
 
+# The project list changes rarely, so it is downloaded at most once per TTL and shared by all runs
+JIRA_PROJECT_INDEX_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'jira_projects.json')
+JIRA_PROJECT_INDEX_TTL = 24 * 3600 # in seconds
+
+# Repository name prefixes that are not part of the project name, e.g. incubator-milagro-MPC
+IGNORED_REPOSITORY_PREFIXES = ('incubator-',)
+# Projects split into many repositories whose names do not match the project, as (pattern, project name).
+# Only these are tried after the whole name, guessing from parts of a name maps repositories to unrelated projects.
+REPOSITORY_NAME_PATTERNS = (
+    (re.compile(r'sling-.+'), 'sling'),           # sling-org-apache-sling-starter
+    (re.compile(r'logging-(log4\w+)'), r'\1'),   # logging-log4cxx
+    (re.compile(r'commons-(\w+)'), r'\1')        # commons-lang, tracked as LANG
+)
+
+# Page size requested from the search endpoint. JIRA lowers it to its configured maximum and
+# reports the value it used in maxResults, which is then used to compute the page offsets.
+MAX_RESULTS_PER_PAGE = 1000
+MAX_CONCURRENT_PAGE_REQUESTS = 8
+
+# Fields fetched for every issue instead of all of them. 'updated' is always included for incremental syncs.
+ISSUE_FIELDS = ('summary', 'issuetype', 'status', 'resolution', 'priority', 'created', 'updated', 'resolutiondate',
+                'versions', 'fixVersions', 'components', 'labels', 'reporter', 'assignee')
+ALL_FIELDS = '*all'
+
+# JQL compares dates in the timezone of the JIRA user at minute precision, so incremental
+# syncs look back this far before the newest update of the previous run
+INCREMENTAL_SYNC_MARGIN = timedelta(days=1)
+
 def ensure_valid_http_result(status):
     return status < 400
 
-def run_http_query(endpoint, token, print_result=False, terminate_on_invalid_response=True):
-    headers = {
+def get_headers(token):
+    return {
         "Accept": "application/json",
         "Authorization": f"Bearer {token}"
     }
-    r = requests.get(endpoint, headers=headers)
+
+def run_http_query(endpoint, token, print_result=False, terminate_on_invalid_response=True, session=None):
+    r = cached_get(endpoint, session=session, headers=get_headers(token))
     if not ensure_valid_http_result(r.status_code):
         print(f'Failed to fetch information from endpoint: {endpoint}. Result: {r.text}')
         if terminate_on_invalid_response:
@@ -29,82 +67,204 @@ def run_http_query(endpoint, token, print_result=False, terminate_on_invalid_res
     return r
 
 def update_results_index_file(result):
-    output_file_path = f'{os.path.dirname(__file__)}/BugIssueDataOutputs/run_results.txt'
+    output_file_path = get_output_file_path('run_results.txt')
     with open(output_file_path, 'a') as file:
         file.write(result + "\n")
 
 def get_projects(token):
-    """Fetch JIRA projects and retain only single-word keys."""
+    """Fetch the key and name of every JIRA project."""
     projects = []
     r = run_http_query(PROJECT_URL, token)
-    
+
     if r:
         for project in r.json():
-            project_key = project.get("key", "").lower()
-            if project_key.isalpha() and len(project_key.split()) == 1:
-                projects.append(project_key)
+            if project.get("key"):
+                projects.append({'key': project['key'], 'name': project.get('name', '')})
     return projects
 
-def get_items(endpoint, token):
-    """Retrieve all bug issues from JIRA with pagination support."""
-    issues = []
-    r = run_http_query(endpoint, token)
+def normalize_name(name):
+    """Lowercase a project or repository name and keep only its letters and digits, without a leading 'Apache'."""
+    name = re.sub(r'^apache[\s-]+', '', name.lower())
+    return re.sub(r'[^a-z0-9]', '', name)
 
-    items = r.json().get('issues', [])
-    issues.extend(items)
+def build_project_index(projects):
+    """Map the normalized key and name of every project to its key. Keys win over names that normalize the same."""
+    index = {normalize_name(project['name']): project['key'] for project in projects if normalize_name(project['name'])}
+    index.update({normalize_name(project['key']): project['key'] for project in projects})
+    return index
 
-    total = r.json().get('total', 0)
-    start_at = r.json().get('startAt', 0)
-    max_results = r.json().get('maxResults', 50)
+def load_project_index(token, index_path=JIRA_PROJECT_INDEX_PATH, ttl=JIRA_PROJECT_INDEX_TTL):
+    """Return the project index, from the local copy of the project list when it is younger than ttl."""
+    if os.path.exists(index_path) and time.time() - os.path.getmtime(index_path) < ttl:
+        with open(index_path, 'r', encoding='utf-8') as file:
+            return build_project_index(json.load(file))
 
-    while start_at + max_results < total:
-        start_at += max_results
-        paginated_endpoint = f"{endpoint}&startAt={start_at}"
-        r = run_http_query(paginated_endpoint, token)
-        items = r.json().get('issues', [])
-        issues.extend(items)
+    projects = get_projects(token)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    temporary_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(projects, file)
+    os.replace(temporary_path, index_path) # parallel runs never read a partial file
+    return build_project_index(projects)
 
-    return issues
+def get_name_candidates(repository):
+    """
+    Return the normalized names a repository may be tracked under in JIRA: its whole name, then the project names
+    of the REPOSITORY_NAME_PATTERNS it matches. For example sling-org-apache-sling-starter yields
+    slingorgapacheslingstarter and sling, and logging-log4cxx yields logginglog4cxx and log4cxx.
+    """
+    name = repository.rstrip('/').split('/')[-1].lower()
+    name = name[:-len('.git')] if name.endswith('.git') else name
+    for prefix in IGNORED_REPOSITORY_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
 
-def get_issue_info(project_key, token):
-    """Get JIRA bug issues for a specified project."""
-    search_endpoint = f"{SEARCH_URL}?jql=project={project_key} AND issuetype=Bug&maxResults=50"
-    issues = get_items(search_endpoint, token)
-    return issues
+    candidates = [normalize_name(name)]
+    for pattern, project_name in REPOSITORY_NAME_PATTERNS:
+        match = pattern.fullmatch(name)
+        if match:
+            candidates.append(normalize_name(match.expand(project_name)))
+    return list(dict.fromkeys(candidate for candidate in candidates if candidate))
+
+def resolve_project_key(repository, project_index):
+    """Return the JIRA project key of a repository URL or name, or None if no project matches."""
+    candidates = get_name_candidates(repository)
+    for candidate in candidates:
+        if candidate in project_index:
+            if candidate != candidates[0]:
+                print(f'Repository {repository} has no JIRA project of the same name, using {project_index[candidate]} from its name pattern.')
+            return project_index[candidate]
+    return None
 
-def get_base_repo_name(repository):
-    """Extract base repository name from the URL and sanitize it by removing hyphens."""
-    return repository.split('/')[-1].lower().replace('-', '')  
+def resolve_project_keys(token, repositories):
+    """Resolve the JIRA project keys of many repositories with a single project index. Returns {repository: key or None}."""
+    project_index = load_project_index(token)
+    return {repository: resolve_project_key(repository, project_index) for repository in repositories}
 
-def main(token, repository):
+def create_session(pool_size=MAX_CONCURRENT_PAGE_REQUESTS):
+    """Create a keep-alive session whose connection pool fits all concurrent page requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_page(endpoint, token, session, start_at):
+    return run_http_query(f"{endpoint}&startAt={start_at}", token, session=session).json()
+
+def get_items(endpoint, token, max_workers=MAX_CONCURRENT_PAGE_REQUESTS):
+    """
+    Retrieve all issues of a JIRA search. The offsets of all pages are computed from the total and
+    page size of the first response, and the remaining pages are fetched concurrently over one pooled session.
+    """
+    session = create_session(max_workers)
     try:
-        projects = get_projects(token)
+        first_page = get_page(endpoint, token, session, 0)
+        issues = first_page.get('issues', [])
+        total = first_page.get('total', 0)
+        page_size = first_page.get('maxResults') or len(issues)
+
+        if page_size > 0:
+            offsets = range(first_page.get('startAt', 0) + page_size, total, page_size)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pages = executor.map(bind_spans(lambda start_at: get_page(endpoint, token, session, start_at)), offsets)
+                for page in pages: # map keeps the page order
+                    issues.extend(page.get('issues', []))
+    finally:
+        session.close()
+
+    # Issues created while paging shift the later pages, which can return an issue twice
+    seen_ids = set()
+    unique_issues = []
+    for issue in issues:
+        if issue['id'] not in seen_ids:
+            seen_ids.add(issue['id'])
+            unique_issues.append(issue)
+    return unique_issues
+
+def get_updated_since(issues):
+    """Return the JQL date to fetch issues updated after the newest update in issues."""
+    newest_update = max(datetime.strptime(issue['fields']['updated'], '%Y-%m-%dT%H:%M:%S.%f%z') for issue in issues)
+    return (newest_update - INCREMENTAL_SYNC_MARGIN).strftime('%Y/%m/%d %H:%M')
+
+def get_fields_parameter(fields):
+    """Return the fields query parameter for a list of fields, or for all fields when fields is None."""
+    if fields is None:
+        return ALL_FIELDS
+    return ','.join(dict.fromkeys([*fields, 'updated']))
 
-        base_repo_name = get_base_repo_name(repository)  
+def get_fields_file_path(output_file_path):
+    return f'{output_file_path}.fields'
+
+def load_output_fields(output_file_path):
+    """Return the fields parameter the issues of an output were fetched with, or None if it was not recorded."""
+    fields_file_path = get_fields_file_path(output_file_path)
+    if not os.path.exists(fields_file_path):
+        return None
+    with open(fields_file_path, 'r', encoding='utf-8') as file:
+        return file.read().strip()
+
+def get_issue_info(project_key, token, updated_since=None, fields=ISSUE_FIELDS):
+    """Get JIRA bug issues for a specified project, optionally only those updated since a JQL date."""
+    jql = f"project={project_key} AND issuetype=Bug"
+    if updated_since:
+        jql += f' AND updated >= "{updated_since}"'
+    jql += " ORDER BY key DESC" # a fixed order keeps the pages consistent while they are fetched concurrently
+    query = urlencode({'jql': jql, 'maxResults': MAX_RESULTS_PER_PAGE, 'fields': get_fields_parameter(fields)})
+    issues = get_items(f"{SEARCH_URL}?{query}", token)
+    return issues
+
+def main(token, repository, incremental=False, fields=ISSUE_FIELDS, project_key=None):
+    """
+    Fetch the bug issues of the JIRA project of a repository. A project_key resolved beforehand,
+    e.g. by resolve_project_keys for a whole batch, skips the lookup in the project index.
+    The result is appended to run_results.txt, and False is returned if the fetch failed.
+    """
+    try:
+        if project_key is None:
+            project_key = resolve_project_key(repository, load_project_index(token))
 
-        if base_repo_name in projects:  
-            print(f"Fetching bug-fixing issues for JIRA project: {base_repo_name}")
-            issues = get_issue_info(base_repo_name, token)
+        if project_key is not None:
+            base_repo_name = project_key.lower()
+            output_file_path = get_output_file_path(f'jira_{base_repo_name}.json')
+            existing_issues = load_existing_issues(output_file_path) if incremental else None
+            # Issues fetched with other fields cannot be merged with the updates, the output would mix two schemas
+            if existing_issues and load_output_fields(output_file_path) != get_fields_parameter(fields):
+                print(f"Issues of JIRA project {project_key} were fetched with other fields, fetching all of them again")
+                existing_issues = None
+            if existing_issues:
+                updated_since = get_updated_since(existing_issues)
+                print(f"Fetching bug-fixing issues for JIRA project: {project_key} updated since {updated_since}")
+                issues = merge_issues(existing_issues, get_issue_info(project_key, token, updated_since, fields))
+            else:
+                print(f"Fetching bug-fixing issues for JIRA project: {project_key}")
+                issues = get_issue_info(project_key, token, fields=fields)
 
             json_object = json.dumps(issues, indent=4)
-            output_file_path = f'{os.path.dirname(__file__)}/BugIssueDataOutputs/jira_{base_repo_name}.json'
             with open(output_file_path, 'w') as file:
                 file.write(json_object)
+            with open(get_fields_file_path(output_file_path), 'w', encoding='utf-8') as file:
+                file.write(get_fields_parameter(fields))
 
             run_results = f'"project":{base_repo_name}, "result":True, "issues_count": "{len(issues)}", "timestamp":{datetime.utcnow().strftime("%m/%d/%Y, %H:%M:%S")}"'
             update_results_index_file(run_results)
             print(f"Successfully fetched issues for {base_repo_name}.")
         else:
-            print(f"No matching JIRA project found for repository: {base_repo_name}")
+            print(f"No matching JIRA project found for repository: {repository}")
+        return True
 
     except Exception as e:
         run_results = f'"project":None, "result":Fail, "exception": "{str(e)}", "timestamp":{datetime.utcnow().strftime("%m/%d/%Y, %H:%M:%S")}"'
         update_results_index_file(run_results)
+        return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetch bug-fixing issues from JIRA.")
     parser.add_argument("--token", required=True, help="JIRA API token")
     parser.add_argument("--repository", required=True, help="Repository URL to match")
+    parser.add_argument("--incremental", action="store_true", help="Only fetch issues updated since the previous output and merge them into it.")
+    parser.add_argument("--fields", default=','.join(ISSUE_FIELDS), help=f"Comma separated issue fields to fetch, or {ALL_FIELDS} for all fields.")
     args = parser.parse_args()
 
-    main(args.token, args.repository)
+    fields = None if args.fields == ALL_FIELDS else args.fields.split(',')
+    main(args.token, args.repository, args.incremental, fields)
@@ -1,79 +1,339 @@
-import json
-from pydriller import Repository
-from pathlib import Path
+import codecs
+import heapq
+import math
+import multiprocessing
+import re
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from CloneProfiles import is_partial_clone, prefetch_blobs
+from DiffStore import DiffStoreWriter, create_commit_diff, iter_commit_diffs
+from RefactoringMinerOutput import get_refactoring_commit_shas
+
+# 'git' parses the output of two git processes for all commits, 'pydriller' traverses the commits with PyDriller
+DIFF_BACKENDS = ('git', 'pydriller')
+
+DIFF_CHUNK_SIZE = 200 # commits extracted by one worker task when diffs are extracted in parallel
+
+commit_header = re.compile(rb'^[0-9a-f]{40}$')
+null_blob = b'0' * 40
+
+# Held by a worker process while PyDriller opens the repository, which writes to .git/config under a lock file
+repository_open_lock = None
 
 def get_refactorings(refactoring_miner_output_file_path):
-    refactoring_commits = []
     if(refactoring_miner_output_file_path == None):
-        return refactoring_commits
-    
-    with open(refactoring_miner_output_file_path, encoding="utf-8") as json_file:
-        refactorings_data = json.load(json_file)
-        if refactorings_data == None:
-            return refactoring_commits
-    
-    # Iterate over the commits with refactorings
-    for commit in refactorings_data['commits']:
-        if commit['refactorings']:  # Only consider commits with refactorings
-            commit_hash = commit['sha1']
-            refactoring_commits.append(commit_hash)
-
-    return refactoring_commits
-
-
-def get_commit_diff(repo_path, output_file, refactoring_miner_output_file_path):
-    # Container for the JSON output
-    commit_diffs = []
+        return []
 
-    refactoring_commit_hashes = get_refactorings(refactoring_miner_output_file_path)
+    # Only the SHA-1s of commits with refactorings are needed, so the output is streamed instead of loaded
+    return get_refactoring_commit_shas(refactoring_miner_output_file_path)
+
+def get_ordered_commits(repo_path, commit_hashes):
+    """
+    Return [(commit, parents)] for the given commits that are reachable from HEAD, oldest first.
+    This is the order in which PyDriller traverses them.
+    """
+    wanted_commits = set(commit_hashes)
+    output = subprocess.check_output(['git', 'rev-list', '--reverse', '--parents', 'HEAD'], cwd=repo_path, universal_newlines=True)
+    commits = []
+    for line in output.splitlines():
+        commit, *parents = line.split()
+        if commit in wanted_commits:
+            commits.append((commit, parents))
+    return commits
+
+def stream_git_output(repo_path, args, input_lines):
+    """
+    Run a git command that reads revisions from stdin and yield its output lines as bytes while they are produced.
+    Stdin is fed from a thread so neither process waits on a full pipe.
+    """
+    process = subprocess.Popen(['git', '-c', 'core.quotePath=false', *args], cwd=repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            for line in input_lines:
+                process.stdin.write(line.encode('ascii') + b'\n')
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        yield from process.stdout
+    finally:
+        process.stdout.close()
+        feeder.join()
+        process.wait()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+def get_diff_stats(repo_path, commits):
+    """
+    Return {commit: (insertions, deletions)} against the first parent, as reported by 'git diff --numstat'.
+    Binary files count as zero lines, like in PyDriller.
+    """
+    stats = {}
+    current = None
+    lines = stream_git_output(repo_path, ['log', '--no-walk=unsorted', '--stdin', '--format=@%H', '--numstat', '--diff-merges=first-parent'],
+                              (commit for commit, _ in commits))
+    for line in lines:
+        if line.startswith(b'@'):
+            current = stats[line[1:].strip().decode('ascii')] = [0, 0]
+        elif b'\t' in line:
+            insertions, deletions, _ = line.split(b'\t', 2)
+            current[0] += int(insertions) if insertions != b'-' else 0
+            current[1] += int(deletions) if deletions != b'-' else 0
+    return {commit: tuple(counts) for commit, counts in stats.items()}
+
+def unquote_path(path):
+    """
+    Undo the C-style quoting git applies to paths with special characters.
+    """
+    if path.startswith(b'"') and path.endswith(b'"'):
+        return codecs.escape_decode(path[1:-1])[0]
+    return path
+
+def get_header_path(header):
+    """
+    Return the new path of a 'diff --git a/<old path> b/<new path>' line. Renamed files are
+    resolved from their 'rename to' line instead, so the two paths are the same here.
+    """
+    paths = header[len(b'diff --git '):]
+    if paths.endswith(b'"'):
+        return unquote_path(paths[paths.rindex(b' "') + 1:])[2:]
+    return paths[(len(paths) + 1) // 2 + 2:]
+
+def get_filename(path):
+    return path.rsplit(b'/', 1)[-1].decode('utf-8', 'replace')
+
+def get_line_numbers(line):
+    tokens = line.split(' ')
+    return int(tokens[1].split(',')[0].replace('-', '')) - 1, int(tokens[2].split(',')[0]) - 1
+
+class FileDiffParser:
+    """
+    Collects the added and deleted lines of one file in a patch, numbered exactly like PyDriller's
+    ModifiedFile.diff_parsed: lines are stripped of trailing whitespace and numbered from the hunk headers.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.in_hunks = False
+        self.added = []
+        self.deleted = []
+        self.count_deletions = 0
+        self.count_additions = 0
+
+    def header_line(self, line):
+        if line.startswith(b'rename to '):
+            self.path = unquote_path(line[len(b'rename to '):])
+        elif line.startswith(b'+++ ') and line != b'+++ /dev/null':
+            self.path = unquote_path(line[len(b'+++ '):].rstrip(b'\t'))[2:]
+
+    def diff_line(self, raw_line):
+        line = raw_line.decode('utf-8', 'ignore').rstrip()
+        self.count_deletions += 1
+        self.count_additions += 1
+
+        if line.startswith('@@'):
+            self.count_deletions, self.count_additions = get_line_numbers(line)
+        if line.startswith('-'):
+            self.deleted.append((self.count_deletions, line[1:]))
+            self.count_additions -= 1
+        if line.startswith('+'):
+            self.added.append((self.count_additions, line[1:]))
+            self.count_deletions -= 1
+        if line == r'\ No newline at end of file':
+            self.count_deletions -= 1
+            self.count_additions -= 1
+
+    def parse(self, line):
+        if not self.in_hunks and line.startswith(b'@@'):
+            self.in_hunks = True
+        if self.in_hunks:
+            self.diff_line(line)
+        else:
+            self.header_line(line)
+
+    def result(self):
+        return get_filename(self.path), self.added, self.deleted
+
+def iter_patches(repo_path, commits):
+    """
+    Yield (commit, [(filename, added_lines, deleted_lines)]) for the commits with a single parent, in order,
+    from one 'git diff-tree --stdin' process. These are the same diffs GitPython produces for PyDriller.
+    """
+    lines = stream_git_output(repo_path, ['diff-tree', '--stdin', '-r', '-p', '-M', '--full-index', '--no-color', '--no-ext-diff', '--abbrev=40'],
+                              (commit for commit, parents in commits if len(parents) == 1))
+    current = None
+    file_diffs = []
+    file_parser = None
+    for line in lines:
+        line = line[:-1] if line.endswith(b'\n') else line
+        if commit_header.match(line):
+            if file_parser:
+                file_diffs.append(file_parser.result())
+            if current:
+                yield current, file_diffs
+            current, file_diffs, file_parser = line.decode('ascii'), [], None
+        elif line.startswith(b'diff --git '):
+            if file_parser:
+                file_diffs.append(file_parser.result())
+            file_parser = FileDiffParser(get_header_path(line))
+        elif file_parser:
+            file_parser.parse(line)
+    if file_parser:
+        file_diffs.append(file_parser.result())
+    if current:
+        yield current, file_diffs
+
+def iter_git_commit_diffs(repo_path, commit_hashes):
+    """
+    Yield the compact diff record of every commit with a parent, oldest first. Commits are read by
+    a numstat pass and a patch pass over all hashes instead of one GitPython diff per commit.
+    """
+    commits = [(commit, parents) for commit, parents in get_ordered_commits(repo_path, commit_hashes) if parents]
+    return iter_ordered_git_commit_diffs(repo_path, commits)
+
+def iter_ordered_git_commit_diffs(repo_path, commits):
+    """
+    Yield the compact diff records of [(commit, parents)] in the given order. Every commit must have a parent.
+    """
+    stats = get_diff_stats(repo_path, commits)
+    # diff-tree prints nothing for merges and for commits without changes, so those keep an empty file list
+    patches = iter_patches(repo_path, commits)
+    next_patch = next(patches, None)
+
+    for commit, parents in commits:
+        file_diffs = []
+        if next_patch and next_patch[0] == commit:
+            file_diffs = next_patch[1]
+            next_patch = next(patches, None)
+        insertions, deletions = stats[commit]
+        diff_stats = {
+            'insertions': insertions,
+            'deletions': deletions,
+            'files_modified': len(file_diffs)
+        }
+        yield create_commit_diff(commit, parents[0], diff_stats, file_diffs)
+
+def prefetch_commit_blobs(repo_path, commit_hashes):
+    """
+    Download the blobs on both sides of the first-parent diffs of the commits into a partial clone with
+    a single request, instead of letting git fetch them commit by commit while the diffs are extracted.
+    """
+    commits = [(commit, parents) for commit, parents in get_ordered_commits(repo_path, commit_hashes) if parents]
+    blobs = set()
+    # Without rename detection, renamed files are listed as a deletion and an addition, so both blobs are included
+    lines = stream_git_output(repo_path, ['log', '--no-walk=unsorted', '--stdin', '--format=', '--raw', '--no-abbrev', '--no-renames', '--diff-merges=first-parent'],
+                              (commit for commit, _ in commits))
+    for line in lines:
+        if line.startswith(b':'):
+            blobs.update(blob.decode('ascii') for blob in line.split(b'\t', 1)[0].split()[2:4] if blob != null_blob)
+    prefetch_blobs(repo_path, [commit for commit, _ in commits] + [parents[0] for _, parents in commits], blobs)
+
+def iter_pydriller_commit_diffs(repo_path, commit_hashes):
+    """
+    Yield the compact diff record of every commit with a parent, oldest first, using PyDriller.
+    """
+    from pydriller import Repository
 
     # Iterate through the commits in the repository
-    for commit in Repository(repo_path, only_commits=refactoring_commit_hashes).traverse_commits():
-        
+    for commit in Repository(repo_path, only_commits=commit_hashes).traverse_commits():
+
         # Check if the commit has a parent (meaning its not the first commit)
         if len(commit.parents) == 0:
             continue
-        
+
         # Get the previous commit hash
         prev_commit_hash = commit.parents[0]
-        
+
         # Collect diff stats and parsed diff content for each modified file in the commit
         diff_stats = {
             'insertions': commit.insertions,
             'deletions': commit.deletions,
             'files_modified': len(commit.modified_files)
         }
-        diff_content = []
+        file_diffs = []
 
         for modified_file in commit.modified_files:
             if modified_file.diff_parsed:
                 # Collecting added and removed lines
-                added_lines = modified_file.diff_parsed['added']
-                deleted_lines = modified_file.diff_parsed['deleted']
-
-                # Prepare structured diff content
-                diff_content.append({
-                    'filename': modified_file.filename,
-                    'added_lines': [{'line_number': line[0], 'content': line[1]} for line in added_lines],
-                    'deleted_lines': [{'line_number': line[0], 'content': line[1]} for line in deleted_lines]
-                })
-
-        # Store commit information
-        commit_info = {
-            'commit_hash': commit.hash,
-            'previous_commit_hash': prev_commit_hash,
-            'diff_stats': diff_stats,
-            'diff_content': diff_content
-        }
+                file_diffs.append((modified_file.filename, modified_file.diff_parsed['added'], modified_file.diff_parsed['deleted']))
+
+        yield create_commit_diff(commit.hash, prev_commit_hash, diff_stats, file_diffs)
+
+def init_diff_worker(lock):
+    """
+    Process pool initializer that installs the shared repository open lock in a worker process.
+    """
+    global repository_open_lock
+    repository_open_lock = lock
+
+def extract_chunk(repo_path, commits, backend):
+    """
+    Return the diff records of one chunk of oldest-first [(commit, parents)]. Runs in a worker process.
+    """
+    if backend == 'git':
+        return list(iter_ordered_git_commit_diffs(repo_path, commits))
+
+    commit_diffs = iter_pydriller_commit_diffs(repo_path, [commit for commit, _ in commits])
+    with repository_open_lock:
+        first_commit_diff = next(commit_diffs, None) # the repository is opened before the first commit is yielded
+    if first_commit_diff is None:
+        return []
+    return [first_commit_diff, *commit_diffs]
+
+def iter_parallel_commit_diffs(repo_path, commit_hashes, backend, workers, chunk_size=DIFF_CHUNK_SIZE):
+    """
+    Yield the same records as the sequential backends, extracted in chunks by a process pool that reads
+    the same clone. Chunks are yielded in commit order, and only a few chunks per worker are in flight
+    at a time, so memory use does not grow with the number of commits.
+    """
+    commits = [(commit, parents) for commit, parents in get_ordered_commits(repo_path, commit_hashes) if parents]
+    # Small histories are still split evenly over all workers
+    chunk_size = max(1, min(chunk_size, math.ceil(len(commits) / workers)))
+    chunks = [commits[start:start + chunk_size] for start in range(0, len(commits), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_diff_worker, initargs=(multiprocessing.Lock(),)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(extract_chunk, repo_path, chunk, backend))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def get_commit_diff(repo_path, output_file, refactoring_miner_output_file_path, backend='git', workers=1):
+    """
+    Write the diff of every refactoring commit to output_file as it is produced. The format follows
+    the extension of output_file, see DiffStore. Both backends produce the same records, and with
+    workers > 1 they are extracted by a process pool in the same order.
+    """
+    refactoring_commit_hashes = get_refactorings(refactoring_miner_output_file_path)
+    if is_partial_clone(repo_path):
+        prefetch_commit_blobs(repo_path, refactoring_commit_hashes)
+
+    if workers > 1:
+        commit_diffs = iter_parallel_commit_diffs(repo_path, refactoring_commit_hashes, backend, workers)
+    elif backend == 'git':
+        commit_diffs = iter_git_commit_diffs(repo_path, refactoring_commit_hashes)
+    else:
+        commit_diffs = iter_pydriller_commit_diffs(repo_path, refactoring_commit_hashes)
 
-        # Add to the list
-        commit_diffs.append(commit_info)
+    with DiffStoreWriter(output_file) as diff_store:
+        for commit_diff in commit_diffs:
+            diff_store.write(commit_diff)
 
-    # Ensure that the directory exists
-    p = Path(output_file)
-    directory = str(p.parent)
-    Path(directory).mkdir(parents=True, exist_ok=True)
+def merge_commit_diffs(repo_path, input_files, output_file):
+    """
+    Merge diff stores of disjoint sets of commits, such as the diffs of the RefactoringMiner shards,
+    into output_file in the order get_commit_diff writes them, without loading the stores.
+    """
+    output = subprocess.check_output(['git', 'rev-list', '--reverse', 'HEAD'], cwd=repo_path, universal_newlines=True)
+    positions = {commit: position for position, commit in enumerate(output.split())}
+    commit_diffs = heapq.merge(*(iter_commit_diffs(input_file) for input_file in input_files), key=lambda commit_diff: positions[commit_diff['commit_hash']])
 
-    # Write the collected data to a JSON file
-    with open(output_file, 'w') as f:
-        json.dump(commit_diffs, f, indent=4)
\ No newline at end of file
+    with DiffStoreWriter(output_file) as diff_store:
+        for commit_diff in commit_diffs:
+            diff_store.write(commit_diff)
@@ -1,9 +1,12 @@
-import requests
 import re
 import json
 import os
+import sys
 import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from HttpCache import cached_get
+
 class RepositoryInformation:
     github_owner = ''
     github_repository = ''
@@ -18,7 +21,7 @@ def ensureValidHttpResult(status):
     return status < 400
 
 def runHttpQuery(endpoint, user, token, printResult = False, terminateOnInvalidResponse = True):
-    r = requests.get(endpoint, auth=(user, token))
+    r = cached_get(endpoint, auth=(user, token))
     if(ensureValidHttpResult(r.status_code) == False):
         print(f'failed to fetch information from endpoint: {endpoint}. Result: {r.text}')
         if(terminateOnInvalidResponse):
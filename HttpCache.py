@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from Metrics import add, timer
+
+# Responses with an ETag or Last-Modified header are kept here and revalidated with conditional requests
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'http_cache.sqlite')
+HTTP_CACHE_MAX_AGE = 30 * 24 * 3600 # in seconds. Entries not revalidated for this long are evicted.
+HTTP_CACHE_MAX_SIZE = 2 * 1024 ** 3 # in bytes. Least recently used entries are evicted above this.
+
+# Headers of a 304 response that replace the cached ones, so rate limit handling sees the current quota
+FRESH_HEADERS = ('X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Used', 'X-RateLimit-Reset', 'Date')
+
+lock = threading.Lock()
+connection = None
+connection_pid = None # process that opened connection. SQLite connections must not be used across a fork.
+
+def reset_after_fork():
+    """
+    Give a forked child a new lock and let it open its own connection, another thread may have held the lock during the fork.
+    """
+    global lock, connection
+    lock = threading.Lock()
+    connection = None
+
+if hasattr(os, 'register_at_fork'): # not available on Windows, which does not fork
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+def get_connection(path=None):
+    """
+    Open the cache database on first use in a process, and again in a forked child, which must not use
+    the connection inherited from its parent. Old and oversized entries are evicted on open.
+    """
+    global connection, connection_pid
+    if connection is not None and connection_pid != os.getpid():
+        connection = None # abandoned without closing, closing it would touch the parent's database state
+    if connection is None:
+        path = path or HTTP_CACHE_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        connection_pid = os.getpid()
+        connection.execute('PRAGMA journal_mode=WAL') # parallel Runner workers share the file
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                encoding TEXT,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )''')
+        connection.commit()
+        evict(connection)
+    return connection
+
+def close_connection():
+    """
+    Close the cache database, so the next request opens HTTP_CACHE_PATH again.
+    """
+    global connection
+    with lock:
+        if connection is not None:
+            connection.close()
+            connection = None
+
+def evict(connection, max_age=HTTP_CACHE_MAX_AGE, max_size=HTTP_CACHE_MAX_SIZE):
+    with connection:
+        connection.execute('DELETE FROM http_cache WHERE fetched_at < ?', (time.time() - max_age,))
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        if total_size <= max_size:
+            return
+        for key, size in connection.execute('SELECT key, size FROM http_cache ORDER BY last_used').fetchall():
+            connection.execute('DELETE FROM http_cache WHERE key = ?', (key,))
+            total_size -= size
+            if total_size <= max_size:
+                break
+
+def cache_key(url, headers):
+    # The same URL can return different representations depending on the Accept header
+    return f"{headers.get('Accept', '')} {url}"
+
+def build_cached_response(entry, not_modified_response, url):
+    """
+    Build a 200 response from a cache entry, with the fresh headers of the 304 response that validated it.
+    """
+    headers, body, encoding = entry
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response._content = body
+    response.encoding = encoding
+    response.headers = CaseInsensitiveDict(json.loads(headers))
+    for header in FRESH_HEADERS:
+        if header in not_modified_response.headers:
+            response.headers[header] = not_modified_response.headers[header]
+    response.request = not_modified_response.request
+    response.from_cache = True
+    return response
+
+def cached_get(url, session=None, headers=None, **kwargs):
+    """
+    GET through the cache. A cached URL is requested with If-None-Match / If-Modified-Since, and on
+    304 Not Modified the stored body is returned as a normal 200 response. GitHub does not count
+    304 responses against the rate limit.
+    """
+    client = session or requests
+    headers = dict(headers or {})
+    key = cache_key(url, headers)
+
+    with lock:
+        entry = get_connection().execute(
+            'SELECT etag, last_modified, headers, body, encoding FROM http_cache WHERE key = ?', (key,)).fetchone()
+    if entry:
+        etag, last_modified = entry[0], entry[1]
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    with timer('http'):
+        r = client.get(url, headers=headers, **kwargs)
+    add('http_requests')
+
+    if r.status_code == 304 and entry:
+        add('http_not_modified')
+        with lock, get_connection() as cache:
+            cache.execute('UPDATE http_cache SET fetched_at = ?, last_used = ? WHERE key = ?', (time.time(), time.time(), key))
+        return build_cached_response(entry[2:], r, url)
+
+    add('bytes_downloaded', len(r.content))
+    etag = r.headers.get('ETag')
+    last_modified = r.headers.get('Last-Modified')
+    if r.status_code == 200 and (etag or last_modified):
+        body = r.content
+        with lock, get_connection() as cache:
+            cache.execute('INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (key, etag, last_modified, json.dumps(dict(r.headers)), body, r.encoding, time.time(), time.time(), len(body)))
+    r.from_cache = False
+    return r
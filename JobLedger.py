@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+
+from Metrics import add
+
+# State of every repository and stage of the Runner batches, so an interrupted batch can be resumed
+JOB_LEDGER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'job_ledger.sqlite')
+RETRY_BACKOFF = 30 # in seconds, doubled after every failed attempt of a stage
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Stage name of the row tracking a repository as a whole
+REPOSITORY_STAGE = 'repository'
+
+class JobLedger:
+    """
+    Durable record of the state (pending, running, done, failed), attempts and durations of every
+    repository and stage of a Runner batch. Rows are committed as soon as a state changes, so after
+    a crash the rows still marked running show where the batch was interrupted.
+    """
+    def __init__(self, path=JOB_LEDGER_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock() # stages of a repository can run in several threads
+        self.connection.execute('PRAGMA journal_mode=WAL') # parallel Runner workers share the file
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                repository TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                started_at REAL,
+                finished_at REAL,
+                duration REAL,
+                error TEXT,
+                PRIMARY KEY (repository, stage)
+            )''')
+        self.connection.commit()
+
+    def reset(self, repositories):
+        """
+        Start a new batch of repositories: forget their previous runs and mark them pending.
+        """
+        with self.connection:
+            for repository in repositories:
+                self.connection.execute('DELETE FROM jobs WHERE repository = ?', (repository,))
+                self.connection.execute('INSERT INTO jobs (repository, stage, state) VALUES (?, ?, ?)', (repository, REPOSITORY_STAGE, PENDING))
+
+    def resume(self, repositories):
+        """
+        Return the repositories that are not done yet, in order. Runs of these repositories that were interrupted
+        while running are marked failed first, and repositories missing from the ledger are added as pending.
+        Rows of other batches sharing the ledger are left alone, they may still be running.
+        """
+        with self.connection:
+            for repository in repositories:
+                self.connection.execute("UPDATE jobs SET state = ?, error = 'interrupted' WHERE repository = ? AND state = ?", (FAILED, repository, RUNNING))
+                self.connection.execute('INSERT OR IGNORE INTO jobs (repository, stage, state) VALUES (?, ?, ?)', (repository, REPOSITORY_STAGE, PENDING))
+        done = {row[0] for row in self.connection.execute('SELECT repository FROM jobs WHERE stage = ? AND state = ?', (REPOSITORY_STAGE, DONE))}
+        return [repository for repository in repositories if repository not in done]
+
+    def start(self, repository, stage_name=REPOSITORY_STAGE):
+        with self.lock, self.connection:
+            self.connection.execute('''
+                INSERT INTO jobs (repository, stage, state, attempts, started_at) VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT (repository, stage) DO UPDATE SET
+                    state = excluded.state, attempts = attempts + 1, started_at = excluded.started_at,
+                    finished_at = NULL, duration = NULL, error = NULL''',
+                (repository, stage_name, RUNNING, time.time()))
+
+    def finish(self, repository, stage_name=REPOSITORY_STAGE, error=None):
+        """
+        Mark the running attempt of a stage done, or failed with the given error.
+        """
+        with self.lock, self.connection:
+            self.connection.execute('''
+                UPDATE jobs SET state = ?, finished_at = ?, duration = ? - started_at, error = ?
+                WHERE repository = ? AND stage = ?''',
+                (FAILED if error else DONE, time.time(), time.time(), error, repository, stage_name))
+
+    def run_stage(self, repository, stage_name, function, *args, retries=0, logger=None):
+        """
+        Run function(*args) as a stage of a repository and return its result. A stage that raises is
+        retried up to `retries` times, waiting RETRY_BACKOFF seconds and twice as long after each failure.
+        The exception of the last attempt is raised.
+        """
+        for attempt in range(retries + 1):
+            self.start(repository, stage_name)
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.finish(repository, stage_name, error=str(e) or type(e).__name__)
+                if attempt == retries:
+                    raise
+                backoff = RETRY_BACKOFF * 2 ** attempt
+                if logger:
+                    logger.warning(f"Stage {stage_name} of {repository} failed, retrying in {backoff} seconds: {e}")
+                add('retry_backoff_seconds', backoff)
+                time.sleep(backoff)
+            else:
+                self.finish(repository, stage_name)
+                return result
+
+    def get_state_counts(self, repositories, stage_name=REPOSITORY_STAGE):
+        """
+        Return {state: number of repositories} for a stage of the given repositories.
+        """
+        with self.lock:
+            states = dict(self.connection.execute('SELECT repository, state FROM jobs WHERE stage = ?', (stage_name,)).fetchall())
+        counts = {}
+        for repository in repositories:
+            state = states.get(repository, PENDING)
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def close(self):
+        self.connection.close()
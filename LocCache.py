@@ -0,0 +1,55 @@
+import os
+import sqlite3
+
+# Line counts of blobs are shared by all repositories analysed on this machine
+LOC_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'loc_cache.sqlite')
+LOOKUP_BATCH_SIZE = 500 # stays below the SQLite host parameter limit
+
+class LocCache:
+    """
+    Persistent map of (git blob SHA, language) to (code, comments, blanks) line counts.
+    A blob has the same SHA in every commit and every repository it appears in, so each blob is counted once.
+    """
+    def __init__(self, path=None):
+        path = path or LOC_CACHE_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL') # parallel Runner workers share the file
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS blob_loc (
+                blob_sha TEXT NOT NULL,
+                language TEXT NOT NULL,
+                code INTEGER NOT NULL,
+                comments INTEGER NOT NULL,
+                blanks INTEGER NOT NULL,
+                PRIMARY KEY (blob_sha, language)
+            ) WITHOUT ROWID''')
+        self.connection.commit()
+
+    def lookup(self, keys):
+        """
+        Return {(blob_sha, language): (code, comments, blanks)} for the keys found in the cache.
+        """
+        keys = set(keys)
+        found = {}
+        blob_shas = list({blob_sha for blob_sha, _ in keys})
+        for start in range(0, len(blob_shas), LOOKUP_BATCH_SIZE):
+            batch = blob_shas[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.connection.execute(
+                f'SELECT blob_sha, language, code, comments, blanks FROM blob_loc WHERE blob_sha IN ({placeholders})', batch)
+            for blob_sha, language, code, comments, blanks in rows:
+                if (blob_sha, language) in keys:
+                    found[(blob_sha, language)] = (code, comments, blanks)
+        return found
+
+    def store(self, counts):
+        """
+        Store {(blob_sha, language): (code, comments, blanks)} entries.
+        """
+        rows = [(blob_sha, language, code, comments, blanks) for (blob_sha, language), (code, comments, blanks) in counts.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO blob_loc VALUES (?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.connection.close()
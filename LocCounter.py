@@ -0,0 +1,317 @@
+import os
+import subprocess
+
+from CloneProfiles import is_partial_clone, prefetch_blobs
+
+# Only files with these extensions are counted (same list as the scc --include-ext filter in DeveloperEffort)
+INCLUDE_EXT = ('c', 'cpp', 'h', 'hpp', 'py', 'java', 'js', 'rb', 'go', 'cs', 'php', 'swift', 'ts', 'rs', 'kt', 'scala', 'pl', 'sh', 'ps1')
+
+# Language of every counted extension
+LANGUAGES = {
+    'c': 'C', 'h': 'C Header', 'cpp': 'C++', 'hpp': 'C++ Header', 'py': 'Python', 'java': 'Java', 'js': 'JavaScript',
+    'rb': 'Ruby', 'go': 'Go', 'cs': 'C#', 'php': 'PHP', 'swift': 'Swift', 'ts': 'TypeScript', 'rs': 'Rust',
+    'kt': 'Kotlin', 'scala': 'Scala', 'pl': 'Perl', 'sh': 'Shell', 'ps1': 'PowerShell'
+}
+
+# Line comment markers and (start, end) block comment markers of each language
+C_STYLE_COMMENTS = ((b'//',), ((b'/*', b'*/'),))
+COMMENT_SYNTAX = {
+    'Python': ((b'#',), ()),
+    'Ruby': ((b'#',), ((b'=begin', b'=end'),)),
+    'Perl': ((b'#',), ((b'=pod', b'=cut'),)),
+    'Shell': ((b'#',), ()),
+    'PowerShell': ((b'#',), ((b'<#', b'#>'),)),
+    'PHP': ((b'//', b'#'), ((b'/*', b'*/'),))
+}
+
+TREE_MODE = b'40000'
+BLOB_MODES = (b'100644', b'100755') # symlinks and submodules are not counted, like scc does
+
+def file_extension(filename):
+    _, extension = os.path.splitext(filename)
+    return extension[1:].lower()
+
+def count_lines(data):
+    """
+    Count the physical lines of a file, including a last line without a newline (the Lines column of scc).
+    """
+    lines = data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        lines += 1
+    return lines
+
+def classify_lines(data, language):
+    """
+    Return the (code, comments, blanks) line counts of a file. Comment markers inside string literals
+    are not recognised, so the split is an approximation of what scc reports. The three counts always
+    add up to count_lines(data).
+    """
+    lines = data.split(b'\n')
+    if data.endswith(b'\n') or not data:
+        lines.pop() # nothing follows the last newline
+    line_comments, block_comments = COMMENT_SYNTAX.get(language, C_STYLE_COMMENTS)
+    code = comments = blanks = 0
+    block_end = None
+
+    for line in lines:
+        stripped = line.strip()
+        if block_end is not None:
+            comments += 1
+            if block_end in stripped:
+                block_end = None
+            continue
+        if not stripped:
+            blanks += 1
+            continue
+        if stripped.startswith(line_comments):
+            comments += 1
+            continue
+
+        is_comment = False
+        for start, end in block_comments:
+            if stripped.startswith(start):
+                is_comment = True
+                closing = stripped.find(end, len(start))
+                if closing == -1:
+                    block_end = end
+                elif stripped[closing + len(end):].strip():
+                    is_comment = False # code follows the comment on the same line
+                break
+        if is_comment:
+            comments += 1
+            continue
+
+        code += 1
+        for start, end in block_comments:
+            opening = stripped.find(start)
+            if opening != -1 and stripped.find(end, opening + len(start)) == -1:
+                block_end = end # a block comment starts after the code and continues on the next lines
+                break
+
+    return code, comments, blanks
+
+def parse_tree(data):
+    """
+    Parse a raw git tree object into (mode, name, sha) entries.
+    """
+    entries = []
+    position = 0
+    while position < len(data):
+        space = data.index(b' ', position)
+        null = data.index(b'\0', space)
+        mode = data[position:space]
+        name = data[space + 1:null].decode('utf-8', 'replace')
+        sha = data[null + 1:null + 21].hex()
+        entries.append((mode, name, sha))
+        position = null + 21
+    return entries
+
+def parse_commit(data):
+    """
+    Return the parent hashes and the author name of a raw git commit object.
+    """
+    parents = []
+    author = ''
+    for line in data.split(b'\n'):
+        if not line:
+            break # end of the header
+        if line.startswith(b'parent '):
+            parents.append(line[7:].decode('ascii'))
+        elif line.startswith(b'author '):
+            author = line[7:line.rfind(b'<')].decode('utf-8', 'replace').strip()
+    return parents, author
+
+def total_counts(languages):
+    """
+    Sum {language: (code, comments, blanks)} into a single (code, comments, blanks) tuple.
+    """
+    return tuple(sum(counts[index] for counts in languages.values()) for index in range(3))
+
+def loc_summary(languages):
+    """
+    Turn {language: (code, comments, blanks)} into the dictionary returned by measure_revisions.
+    """
+    summary = {'languages': {}}
+    for language, (code, comments, blanks) in sorted(languages.items()):
+        summary['languages'][language] = {'code': code, 'comments': comments, 'blanks': blanks, 'lines': code + comments + blanks}
+    code, comments, blanks = total_counts(languages)
+    summary.update({'code': code, 'comments': comments, 'blanks': blanks, 'lines': code + comments + blanks})
+    return summary
+
+class GitObjectReader:
+    """
+    Reads objects from a repository through a single long-running git cat-file --batch process.
+    """
+    def __init__(self, repo_path):
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, object_name):
+        """
+        Return (sha, type, data) of an object. Raises KeyError if the object does not exist.
+        """
+        self.process.stdin.write(object_name.encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline()
+        if not header or header.endswith(b' missing\n') or header.endswith(b' ambiguous\n'):
+            raise KeyError(object_name)
+        sha, object_type, size = header.split()
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1) # newline after the object content
+        return sha.decode('ascii'), object_type.decode('ascii'), data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class TreeLocCounter:
+    """
+    Counts the lines of code of any revision straight from the object store, without checking it out.
+
+    Line counts are cached per blob SHA and totals per tree SHA, so measuring a commit right after its
+    parent only reads the blobs and subtrees that the commit changed. With a LocCache, blob counts are
+    also kept between runs and shared between repositories.
+    """
+    def __init__(self, repo_path, cache=None, include_ext=INCLUDE_EXT):
+        self.reader = GitObjectReader(repo_path)
+        self.repo_path = repo_path
+        self.partial_clone = is_partial_clone(repo_path) # blobs are fetched from the origin when they are missing
+        self.cache = cache
+        self.include_ext = set(include_ext)
+        self.blob_locs = {}  # (blob sha, language) -> (code, comments, blanks)
+        self.tree_locs = {}  # tree sha -> {language: (code, comments, blanks)}
+
+    def read_trees(self, tree_sha, data, pending_trees):
+        """
+        Read every tree below tree_sha that has no total yet into pending_trees as {tree sha: [(mode, language, sha)]}.
+        """
+        stack = [(tree_sha, data)]
+        while stack:
+            sha, data = stack.pop()
+            if sha in pending_trees or sha in self.tree_locs:
+                continue
+            if data is None:
+                _, _, data = self.reader.read(sha)
+
+            entries = []
+            for mode, name, entry_sha in parse_tree(data):
+                if mode == TREE_MODE:
+                    entries.append((mode, None, entry_sha))
+                    stack.append((entry_sha, None))
+                elif mode in BLOB_MODES:
+                    extension = file_extension(name)
+                    if extension in self.include_ext:
+                        entries.append((mode, LANGUAGES.get(extension, extension), entry_sha))
+            pending_trees[sha] = entries
+
+    def load_blobs(self, keys, trees=()):
+        """
+        Make the counts of the given (blob sha, language) keys available, from the persistent cache
+        when possible and by reading and counting the blob otherwise. In a partial clone, the blobs
+        of the given trees that have to be read are downloaded together first.
+        """
+        missing = [key for key in keys if key not in self.blob_locs]
+        if self.cache and missing:
+            self.blob_locs.update(self.cache.lookup(missing))
+            missing = [key for key in missing if key not in self.blob_locs]
+        if self.partial_clone and trees:
+            prefetch_blobs(self.repo_path, trees, {blob_sha for blob_sha, _ in missing})
+
+        counted = {}
+        for blob_sha, language in missing:
+            _, _, data = self.reader.read(blob_sha)
+            counted[(blob_sha, language)] = classify_lines(data, language)
+        self.blob_locs.update(counted)
+        if self.cache and counted:
+            self.cache.store(counted)
+
+    def sum_tree(self, tree_sha, pending_trees):
+        if tree_sha in self.tree_locs:
+            return self.tree_locs[tree_sha]
+
+        languages = {}
+        for mode, language, sha in pending_trees[tree_sha]:
+            if mode == TREE_MODE:
+                counts_by_language = self.sum_tree(sha, pending_trees).items()
+            else:
+                counts_by_language = [(language, self.blob_locs[(sha, language)])]
+            for counted_language, (code, comments, blanks) in counts_by_language:
+                previous_code, previous_comments, previous_blanks = languages.get(counted_language, (0, 0, 0))
+                languages[counted_language] = (previous_code + code, previous_comments + comments, previous_blanks + blanks)
+        self.tree_locs[tree_sha] = languages
+        return languages
+
+    def measure_revisions(self, revisions):
+        """
+        Measure many revisions in one pass and return {revision: {language: (code, comments, blanks)}}.
+        All new trees are read first, so the blobs of the whole batch are resolved with a single bulk
+        cache lookup. Revisions that do not exist map to None.
+        """
+        tree_shas = {}
+        pending_trees = {}
+        for revision in revisions:
+            try:
+                tree_sha, _, data = self.reader.read(f'{revision}^{{tree}}')
+            except KeyError:
+                tree_shas[revision] = None
+                continue
+            tree_shas[revision] = tree_sha
+            self.read_trees(tree_sha, data, pending_trees)
+
+        self.load_blobs({(sha, language) for entries in pending_trees.values()
+                         for mode, language, sha in entries if mode != TREE_MODE}, list(pending_trees))
+        return {revision: self.sum_tree(tree_sha, pending_trees) if tree_sha else None
+                for revision, tree_sha in tree_shas.items()}
+
+    def revision_languages(self, revision):
+        """
+        Return {language: (code, comments, blanks)} of a commit-ish. Raises KeyError if the revision does not exist.
+        """
+        languages = self.measure_revisions([revision])[revision]
+        if languages is None:
+            raise KeyError(revision)
+        return languages
+
+    def revision_counts(self, revision):
+        """
+        Return the (code, comments, blanks) line counts of a commit-ish. Raises KeyError if the revision does not exist.
+        """
+        return total_counts(self.revision_languages(revision))
+
+    def revision_loc(self, revision):
+        """
+        Return the total lines (code, comments and blanks) of a commit-ish, the TLOC measure used by DeveloperEffort.
+        """
+        return sum(self.revision_counts(revision))
+
+    def commit_info(self, commit_hash):
+        """
+        Return the parent hashes and author name of a commit.
+        """
+        _, _, data = self.reader.read(commit_hash)
+        return parse_commit(data)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def measure_revisions(repo_path, revisions, cache=None, include_ext=INCLUDE_EXT):
+    """
+    Measure the lines of code of many revisions of a repository with a single git process.
+    Returns {revision: summary} where summary holds code, comments, blanks and lines totals and the
+    same counts per language under 'languages'. Revisions that do not exist map to None.
+    """
+    with TreeLocCounter(repo_path, cache, include_ext) as loc_counter:
+        measured = loc_counter.measure_revisions(revisions)
+    return {revision: loc_summary(languages) if languages is not None else None for revision, languages in measured.items()}
@@ -0,0 +1,278 @@
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from LoggerManager import get_logger
+
+try:
+    import resource # not available on Windows, peak memory is not recorded there
+except ImportError:
+    resource = None
+
+# Span records of every Runner batch, one JSON Lines file per batch, with a Prometheus text file next to it
+METRICS_OUTPUT_DIR = 'MetricsOutputs'
+METRIC_PREFIX = 'refactoring_analyzer'
+SUMMARY_TOP = 10 # repositories and stages listed in the summary report
+
+# Spans open in the current thread, outermost first. Counters and CPU time are added to these spans only,
+# so spans running at the same time in other threads, e.g. the issue fetch, do not see each other's work.
+# Threads started for a span run with bind_spans to count towards it.
+active_spans = contextvars.ContextVar('active_spans', default=())
+# Every open span of the process, to tell which spans ran alongside unrelated ones
+open_spans = set()
+counters_lock = threading.Lock()
+output_path = None
+output_lock = threading.Lock()
+audit_hook_installed = False
+
+def reset_locks_after_fork():
+    """
+    Give a forked child new locks. Process pools fork while other threads, e.g. the issue fetch, may hold one,
+    and the child would wait for it forever on its first counter update. The spans of those threads are
+    not open in the child.
+    """
+    global counters_lock, output_lock, open_spans
+    counters_lock = threading.Lock()
+    output_lock = threading.Lock()
+    open_spans = set()
+
+if hasattr(os, 'register_at_fork'): # not available on Windows, which does not fork
+    os.register_at_fork(after_in_child=reset_locks_after_fork)
+
+class SpanState:
+    """
+    What an open span has counted so far.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.cpu_seconds = 0.0 # of the threads bound to the span, its own thread is measured when it closes
+        self.concurrent = False # another span that is neither its ancestor nor its descendant was open at the same time
+
+def add(counter, value=1):
+    """
+    Add value to a counter of every span open in the current thread.
+    """
+    spans = active_spans.get()
+    if not spans:
+        return
+    with counters_lock:
+        for state in spans:
+            state.counters[counter] = state.counters.get(counter, 0) + value
+
+def bind_spans(function):
+    """
+    Return a function that runs function in the spans open here, for threads doing work of these spans.
+    The CPU time of the thread is added to them. The returned function can run in several threads at once.
+    """
+    context = contextvars.copy_context()
+    def run_in_spans(*args, **kwargs):
+        return context.copy().run(run_counting_cpu, function, args, kwargs)
+    return run_in_spans
+
+def run_counting_cpu(function, args, kwargs):
+    cpu_start = time.thread_time()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        cpu_seconds = time.thread_time() - cpu_start
+        with counters_lock:
+            for state in active_spans.get():
+                state.cpu_seconds += cpu_seconds
+
+def audit_hook(event, args):
+    if event in ('subprocess.Popen', 'os.system', 'os.posix_spawn'):
+        add('subprocesses')
+
+def install_audit_hook():
+    """
+    Count the subprocesses started by the process. Audit hooks cannot be removed, so it is installed once.
+    """
+    global audit_hook_installed
+    if not audit_hook_installed:
+        sys.addaudithook(audit_hook)
+        audit_hook_installed = True
+
+def configure(path):
+    """
+    Append the spans of this process to path. Spans are only logged when no path is configured.
+    """
+    global output_path
+    output_path = path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    install_audit_hook()
+
+def get_batch_metrics_path(output_dir=METRICS_OUTPUT_DIR):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(output_dir, f'metrics_{timestamp}.jsonl')
+
+@contextmanager
+def timer(name):
+    """
+    Add the wall time of the block to the <name>_seconds counter, for work done many times per stage
+    such as scc runs or HTTP requests.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(f'{name}_seconds', time.perf_counter() - start)
+
+def get_peak_rss_mb(who):
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+def get_children_cpu_time():
+    times = os.times()
+    return times.children_user + times.children_system
+
+@contextmanager
+def span(stage_name, repository=None):
+    """
+    Record the wall time, CPU time, CPU time of finished subprocesses, peak memory and counter growth of
+    the block as a span of a stage. Counters and CPU time are those of the current thread and of the threads
+    bound to the span with bind_spans, nested spans included.
+    The CPU time of finished subprocesses is only known for the whole process, so it is None when an
+    unrelated span was open at the same time, e.g. the issue fetch next to RefactoringMiner. Persistent
+    RefactoringMiner JVMs are not finished subprocesses, their work is in no span. Peak memory is the peak
+    of the process and of its largest finished subprocess so far, not of the block alone.
+    """
+    state = SpanState()
+    ancestors = active_spans.get()
+    with counters_lock:
+        for other in open_spans:
+            if other not in ancestors:
+                other.concurrent = state.concurrent = True
+        open_spans.add(state)
+    token = active_spans.set(ancestors + (state,))
+    start_time = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    children_cpu_start = get_children_cpu_time()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        cpu_seconds = time.thread_time() - cpu_start
+        children_cpu_seconds = get_children_cpu_time() - children_cpu_start
+        active_spans.reset(token)
+        with counters_lock:
+            open_spans.discard(state)
+            counter_deltas = dict(state.counters)
+            cpu_seconds += state.cpu_seconds
+            concurrent = state.concurrent
+        record = {
+            'repository': repository,
+            'stage': stage_name,
+            'start': start_time,
+            'wall_seconds': time.perf_counter() - wall_start,
+            'cpu_seconds': cpu_seconds,
+            'children_cpu_seconds': None if concurrent else children_cpu_seconds,
+            'peak_rss_mb': get_peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            'children_peak_rss_mb': get_peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            'counters': counter_deltas,
+            'pid': os.getpid(),
+            'succeeded': succeeded
+        }
+        write_span(record)
+
+def write_span(record):
+    get_logger("Metrics").info(
+        f"{record['repository'] or '-'} {record['stage']}: {record['wall_seconds']:.2f}s wall, "
+        f"{record['cpu_seconds'] + (record['children_cpu_seconds'] or 0):.2f}s CPU, {record['counters']}")
+    if output_path is None:
+        return
+    with output_lock, open(output_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n') # single appends, so worker processes can share the file
+
+def load_spans(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def write_prometheus(spans, path):
+    """
+    Write the spans as gauges in the Prometheus text format, e.g. for the node exporter textfile collector.
+    Spans with the same repository and stage, such as retries, are added up. Subprocess CPU time
+    unknown for a span, see span, is left out.
+    """
+    totals = {}
+    for record in spans:
+        values = totals.setdefault((record['repository'] or '', record['stage']), {})
+        for name in ('wall_seconds', 'cpu_seconds', 'children_cpu_seconds'):
+            if record[name] is not None:
+                values[name] = values.get(name, 0) + record[name]
+        for name in ('peak_rss_mb', 'children_peak_rss_mb'):
+            if record[name] is not None:
+                values[name] = max(values.get(name, 0), record[name])
+        for name, value in record['counters'].items():
+            values[name] = values.get(name, 0) + value
+
+    metric_names = sorted({name for values in totals.values() for name in values})
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        for name in metric_names:
+            metric = f'{METRIC_PREFIX}_stage_{name}'
+            file.write(f'# HELP {metric} {name.replace("_", " ")} of a pipeline stage, summed over its spans\n')
+            file.write(f'# TYPE {metric} gauge\n')
+            for (repository, stage_name), values in sorted(totals.items()):
+                if name in values:
+                    file.write(f'{metric}{{repository="{escape_label(repository)}",stage="{escape_label(stage_name)}"}} {values[name]}\n')
+    os.replace(temporary_path, path) # the collector never reads a half written file
+
+def summarize(spans, top=SUMMARY_TOP):
+    """
+    Return a report ranking the slowest repositories and the stages that took the most time overall.
+    """
+    repositories = {}
+    stages = {}
+    for record in spans:
+        if record['stage'] == 'repository':
+            repositories[record['repository']] = repositories.get(record['repository'], 0) + record['wall_seconds']
+            continue
+        totals = stages.setdefault(record['stage'], {'wall_seconds': 0, 'cpu_seconds': 0, 'spans': 0, 'counters': {}})
+        totals['wall_seconds'] += record['wall_seconds']
+        totals['cpu_seconds'] += record['cpu_seconds'] + (record['children_cpu_seconds'] or 0)
+        totals['spans'] += 1
+        for name, value in record['counters'].items():
+            totals['counters'][name] = totals['counters'].get(name, 0) + value
+
+    lines = [f'Slowest repositories ({len(repositories)} analysed):']
+    for repository, wall_seconds in sorted(repositories.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f'  {wall_seconds:10.2f}s  {repository}')
+    lines.append('Stages by total wall time:')
+    for stage_name, totals in sorted(stages.items(), key=lambda item: item[1]['wall_seconds'], reverse=True)[:top]:
+        counter_summary = ', '.join(f'{name} {value:.2f}' if isinstance(value, float) else f'{name} {value}'
+                                    for name, value in sorted(totals['counters'].items()))
+        lines.append(f"  {totals['wall_seconds']:10.2f}s wall {totals['cpu_seconds']:10.2f}s CPU  {stage_name} "
+                     f"({totals['spans']} spans{', ' + counter_summary if counter_summary else ''})")
+    return '\n'.join(lines)
+
+def report(path, logger=None):
+    """
+    Write the Prometheus file of a batch next to its spans and log the summary report.
+    """
+    if not os.path.exists(path):
+        return
+    spans = load_spans(path)
+    prometheus_path = os.path.splitext(path)[0] + '.prom'
+    write_prometheus(spans, prometheus_path)
+    (logger or get_logger("Metrics")).info(f"Metrics saved to {path} and {prometheus_path}\n{summarize(spans)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarise the stage metrics of a Runner batch.")
+    parser.add_argument("metrics_file", help="metrics_<timestamp>.jsonl file written by Runner.py")
+    parser.add_argument("--top", type=int, default=SUMMARY_TOP, help="Number of repositories and stages listed.")
+    args = parser.parse_args()
+    print(summarize(load_spans(args.metrics_file), args.top))
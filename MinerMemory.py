@@ -0,0 +1,159 @@
+import json
+import os
+import re
+import subprocess
+from datetime import datetime
+
+from Metrics import add
+
+# Heap given to a RefactoringMiner JVM, in MB. It grows with the size of the object store of the
+# repository and is doubled up to MAX_HEAP_MB when a run fails with an OutOfMemoryError.
+MIN_HEAP_MB = 512
+MAX_HEAP_MB = 16 * 1024
+BASE_HEAP_MB = 512
+HEAP_PER_REPOSITORY_MB = 4 # MB of heap per MB of packed repository
+HEAP_GRANULARITY_MB = 256
+JVM_OVERHEAD_MB = 256 # metaspace, code cache and thread stacks, reserved from the memory budget with the heap
+
+# Exit code of a JVM started with -XX:+ExitOnOutOfMemoryError
+OOM_EXIT_CODE = 3
+# Commit ranges a repository is split into when even MAX_HEAP_MB is not enough to mine it at once
+OOM_SHARD_COUNT = 4
+
+# Sizes in KB reported by the GitHub API, written by Helpers/GetRepoSizes.py. Used when a repository cannot be measured locally.
+REPO_SIZES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'RepoSizesOutput', 'RepoSizesOutput.json')
+GC_LOG_DIR = os.path.join('Logs', 'RefactoringMinerGcLogs')
+GC_PAUSE_WARNING = 0.2 # share of a run spent in GC pauses above which GC pressure is logged as a warning
+
+gc_event = re.compile(r'Pause (\w+).*?(\d+)M->(\d+)M\((\d+)M\) ([\d.]+)ms')
+
+class MinerOutOfMemoryError(RuntimeError):
+    """
+    RefactoringMiner ran out of heap.
+    """
+    def __init__(self, heap_mb):
+        super().__init__(f"RefactoringMiner ran out of memory with a {heap_mb} MB heap")
+        self.heap_mb = heap_mb
+
+def get_objects_dirs(repo_dir):
+    """
+    Return the object directory of a repository and those of its alternates, e.g. the mirror a clone shares objects with.
+    """
+    objects_path = subprocess.check_output(['git', 'rev-parse', '--git-path', 'objects'], cwd=repo_dir, universal_newlines=True).strip()
+    objects_dir = os.path.join(repo_dir, objects_path) # the path is relative to repo_dir unless it is absolute
+    objects_dirs = []
+    pending = [objects_dir]
+    while pending:
+        objects_dir = os.path.normpath(pending.pop())
+        if objects_dir in objects_dirs or not os.path.isdir(objects_dir):
+            continue
+        objects_dirs.append(objects_dir)
+        alternates_path = os.path.join(objects_dir, 'info', 'alternates')
+        if os.path.exists(alternates_path):
+            with open(alternates_path, 'r', encoding='utf-8') as file:
+                pending.extend(os.path.join(objects_dir, line.strip()) for line in file if line.strip() and not line.startswith('#'))
+    return objects_dirs
+
+def get_local_size_kb(repo_dir):
+    """
+    Return the size of the loose and packed objects of a repository and its alternates, from git count-objects.
+    """
+    size_kb = 0
+    for objects_dir in get_objects_dirs(repo_dir):
+        output = subprocess.check_output(['git', f'--git-dir={os.path.dirname(objects_dir)}', 'count-objects', '-v'], universal_newlines=True)
+        counts = dict(line.split(': ', 1) for line in output.splitlines() if ': ' in line)
+        size_kb += int(counts.get('size', 0)) + int(counts.get('size-pack', 0))
+    return size_kb
+
+def load_repository_sizes(path=REPO_SIZES_PATH):
+    """
+    Return {repository name: size in KB} from the output of Helpers/GetRepoSizes.py, empty if it was not run.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return {entry['RepositoryName']: entry['size'] for entry in json.load(file) if entry.get('size', -1) > 0}
+
+def get_origin_name(repo_dir):
+    origin = subprocess.run(['git', 'config', '--get', 'remote.origin.url'], cwd=repo_dir, stdout=subprocess.PIPE, universal_newlines=True)
+    name = origin.stdout.strip().rstrip('/').split('/')[-1]
+    return name[:-len('.git')] if name.endswith('.git') else name
+
+def get_repository_size_mb(repo_dir):
+    """
+    Return the size of a repository in MB, measured locally or, if that fails, as reported by GitHub.
+    """
+    size_kb = get_local_size_kb(repo_dir)
+    if size_kb == 0:
+        size_kb = load_repository_sizes().get(get_origin_name(repo_dir), 0)
+    return size_kb / 1024
+
+def get_max_heap_mb(memory_budget_mb=None):
+    if memory_budget_mb is None:
+        return MAX_HEAP_MB
+    return max(MIN_HEAP_MB, min(MAX_HEAP_MB, memory_budget_mb - JVM_OVERHEAD_MB))
+
+def get_heap_size_mb(repository_size_mb, max_heap_mb=MAX_HEAP_MB):
+    heap_mb = BASE_HEAP_MB + HEAP_PER_REPOSITORY_MB * repository_size_mb
+    heap_mb = -(-heap_mb // HEAP_GRANULARITY_MB) * HEAP_GRANULARITY_MB
+    return int(max(MIN_HEAP_MB, min(max_heap_mb, heap_mb)))
+
+def get_gc_log_path(name):
+    os.makedirs(GC_LOG_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.abspath(os.path.join(GC_LOG_DIR, f'{name}_{timestamp}_{os.getpid()}.log'))
+
+def get_jvm_options(heap_mb, gc_log_path):
+    """
+    Return the options of a RefactoringMiner JVM with the given heap. The JVM exits with OOM_EXIT_CODE on an
+    OutOfMemoryError instead of going on with a broken state, and logs its garbage collections to gc_log_path.
+    """
+    # -Xlog separates its arguments with colons, so a Windows path with a drive letter has to be quoted
+    quote = '"' if os.name == 'nt' else ''
+    return [f'-Xmx{heap_mb}m', '-XX:+ExitOnOutOfMemoryError', f'-Xlog:gc:file={quote}{gc_log_path}{quote}:uptime:filecount=0']
+
+class GcLog:
+    """
+    Reads the GC log of a JVM. A JVM that serves several jobs appends to the same log, so every read
+    only covers the collections logged since the previous one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def read(self):
+        """
+        Return {'pauses', 'full_collections', 'pause_seconds', 'peak_heap_mb'} of the collections logged since the last read.
+        """
+        stats = {'pauses': 0, 'full_collections': 0, 'pause_seconds': 0.0, 'peak_heap_mb': 0}
+        if not os.path.exists(self.path):
+            return stats
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as file:
+            file.seek(self.offset)
+            lines = file.read().splitlines()
+            self.offset = file.tell()
+        for line in lines:
+            match = gc_event.search(line)
+            if match:
+                kind, before_mb, _, _, pause_ms = match.groups()
+                stats['pauses'] += 1
+                if kind == 'Full':
+                    stats['full_collections'] += 1
+                stats['pause_seconds'] += float(pause_ms) / 1000
+                stats['peak_heap_mb'] = max(stats['peak_heap_mb'], int(before_mb))
+        return stats
+
+def log_gc_pressure(gc_log, heap_mb, wall_seconds, logger):
+    """
+    Log the GC pauses of a run and add them to the gc_pause_seconds and gc_full_collections metrics.
+    Runs that spent more than GC_PAUSE_WARNING of their time in GC pauses, or needed full collections, are warned about.
+    """
+    stats = gc_log.read()
+    add('gc_pause_seconds', stats['pause_seconds'])
+    add('gc_full_collections', stats['full_collections'])
+    message = (f"GC: {stats['pauses']} pauses, {stats['pause_seconds']:.2f} seconds, {stats['full_collections']} full collections, "
+               f"heap peak {stats['peak_heap_mb']} MB of {heap_mb} MB")
+    if stats['full_collections'] or (wall_seconds > 0 and stats['pause_seconds'] / wall_seconds > GC_PAUSE_WARNING):
+        logger.warning(f"High GC pressure, the heap may be too small. {message}")
+    else:
+        logger.info(message)
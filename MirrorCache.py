@@ -0,0 +1,203 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+from CloneProfiles import CLONE_PROFILES, DEFAULT_CLONE_PROFILE, complete_partial_clone, get_partial_clone_filter, set_partial_clone, set_sparse_checkout
+from LocCounter import INCLUDE_EXT
+
+# Bare mirrors are kept here between runs, one directory per repository URL
+MIRROR_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'Mirrors')
+MIRROR_CACHE_MAX_SIZE = 50 * 1024 ** 3 # in bytes. Least recently used mirrors are evicted above this.
+LAST_USED_FILE = 'last_used'
+CHECKOUTS_DIR = 'checkouts'
+# Held while a mirror is updated, cloned from or evicted. Kept next to the mirror, so it outlives an eviction.
+LOCK_SUFFIX = '.lock'
+
+def get_mirror_path(repository_url, cache_dir=MIRROR_CACHE_DIR):
+    """
+    Return the mirror location of a repository. The directory name is the SHA-1 of the URL.
+    """
+    key = hashlib.sha1(repository_url.rstrip('/').encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'{key}.git')
+
+@contextmanager
+def mirror_lock(mirror_path):
+    """
+    Hold the lock of a mirror, shared by every process using the cache. Lock files are never removed,
+    a process waiting on a removed file would hold a lock nobody else sees.
+    """
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+    with open(mirror_path + LOCK_SUFFIX, 'a+') as file:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass # LK_LOCK gives up after 10 seconds
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def touch_mirror(mirror_path):
+    with open(os.path.join(mirror_path, LAST_USED_FILE), 'w') as file:
+        file.write(str(time.time()))
+
+def last_used(mirror_path):
+    try:
+        return os.path.getmtime(os.path.join(mirror_path, LAST_USED_FILE))
+    except OSError:
+        return 0
+
+def update_mirror(repository_url, logger, cache_dir=MIRROR_CACHE_DIR, blob_filter=None):
+    """
+    Create the bare mirror of a repository, or bring an existing one up to date with an incremental fetch.
+    A new mirror is a partial clone without the objects blob_filter excludes. A complete mirror also
+    serves filtered profiles, and a partial one is completed when a profile needs every object.
+    """
+    mirror_path = get_mirror_path(repository_url, cache_dir)
+    start_time = time.time()
+
+    if os.path.isdir(mirror_path) and blob_filter is None and get_partial_clone_filter(mirror_path):
+        logger.info(f"Downloading the missing objects of {repository_url} into partial mirror {mirror_path}...")
+        complete_partial_clone(mirror_path)
+    elif os.path.isdir(mirror_path):
+        logger.info(f"Fetching updates for {repository_url} into mirror {mirror_path}...")
+        subprocess.check_call(['git', 'fetch', '--prune', '--tags', 'origin'], cwd=mirror_path)
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Clone next to the final location and rename, so an interrupted clone never looks like a valid mirror
+        partial_path = f'{mirror_path}.{os.getpid()}.partial'
+        shutil.rmtree(partial_path, ignore_errors=True)
+        logger.info(f"Creating mirror of {repository_url} at {mirror_path}...")
+        filter_args = [f'--filter={blob_filter}'] if blob_filter else []
+        subprocess.check_call(['git', 'clone', '--bare', *filter_args, repository_url, partial_path])
+        # Mirror branches and tags only. A plain --mirror would also pull every refs/pull/* ref from GitHub.
+        subprocess.check_call(['git', 'config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*'], cwd=partial_path)
+        try:
+            os.rename(partial_path, mirror_path)
+        except OSError:
+            # Another process finished the same mirror first
+            shutil.rmtree(partial_path, ignore_errors=True)
+
+    touch_mirror(mirror_path)
+    logger.info(f"Mirror of {repository_url} ready in {time.time() - start_time:.2f} seconds.")
+    return mirror_path
+
+def register_checkout(mirror_path, checkout_path):
+    checkouts_dir = os.path.join(mirror_path, CHECKOUTS_DIR)
+    os.makedirs(checkouts_dir, exist_ok=True)
+    marker = hashlib.sha1(os.path.abspath(checkout_path).encode('utf-8')).hexdigest()
+    with open(os.path.join(checkouts_dir, marker), 'w') as file:
+        file.write(os.path.abspath(checkout_path))
+
+def has_active_checkouts(mirror_path):
+    """
+    Check whether a clone that borrows objects from the mirror still exists. Markers of removed clones are cleaned up.
+    """
+    checkouts_dir = os.path.join(mirror_path, CHECKOUTS_DIR)
+    try:
+        markers = os.listdir(checkouts_dir)
+    except FileNotFoundError:
+        return False
+
+    active = False
+    for marker in markers:
+        marker_path = os.path.join(checkouts_dir, marker)
+        try:
+            with open(marker_path, 'r') as file:
+                checkout_path = file.read().strip()
+            if os.path.isdir(checkout_path):
+                active = True
+            else:
+                os.remove(marker_path)
+        except FileNotFoundError:
+            pass # cleaned up by another process
+    return active
+
+def checkout_from_mirror(repository_url, mirror_path, target_dir, logger, checkout='full'):
+    """
+    Make a working clone that shares the object store of the mirror instead of copying it.
+    checkout is one of the checkout modes of CloneProfiles.CLONE_PROFILES. The clone is registered
+    before it is made, so the mirror cannot be evicted while it is being cloned.
+    """
+    logger.info(f"Cloning mirror {mirror_path} to {target_dir}...")
+    register_checkout(mirror_path, target_dir)
+    checkout_args = [] if checkout == 'full' else ['--no-checkout']
+    subprocess.check_call(['git', 'clone', '--shared', *checkout_args, mirror_path, target_dir])
+    # Keep the original URL as origin, RefactoringMiner reports it in its output
+    subprocess.check_call(['git', 'remote', 'set-url', 'origin', repository_url], cwd=target_dir)
+
+    blob_filter = get_partial_clone_filter(mirror_path)
+    if blob_filter:
+        # Blobs the mirror does not have are downloaded from origin into the clone when they are read
+        set_partial_clone(target_dir, blob_filter)
+    if checkout == 'sparse':
+        set_sparse_checkout(target_dir, INCLUDE_EXT)
+        subprocess.check_call(['git', 'checkout', '--quiet', 'HEAD'], cwd=target_dir)
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def evict_mirrors(logger, max_size=MIRROR_CACHE_MAX_SIZE, cache_dir=MIRROR_CACHE_DIR):
+    """
+    Remove least recently used mirrors until the cache fits in max_size bytes.
+    Mirrors that still back a clone, or are being updated or cloned from, are never removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    mirrors = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.git')]
+    sizes = {mirror: directory_size(mirror) for mirror in mirrors}
+    total_size = sum(sizes.values())
+
+    for mirror in sorted(mirrors, key=last_used):
+        if total_size <= max_size:
+            break
+        with mirror_lock(mirror):
+            if not os.path.isdir(mirror): # evicted by another process
+                total_size -= sizes[mirror]
+                continue
+            if has_active_checkouts(mirror):
+                continue
+            logger.info(f"Evicting mirror {mirror} ({sizes[mirror] / 1024 ** 2:.1f} MB)")
+            shutil.rmtree(mirror, ignore_errors=True)
+        total_size -= sizes[mirror]
+
+def clone_repository(repository_url, target_dir, logger, cache_dir=MIRROR_CACHE_DIR, profile=DEFAULT_CLONE_PROFILE):
+    """
+    Clone a repository through the mirror cache with one of CloneProfiles.CLONE_PROFILES.
+    Only new objects are downloaded when the mirror already exists. Updating and cloning the mirror
+    hold its lock, so parallel runs of the same repository wait for each other and evictions wait for both.
+    """
+    start_time = time.time()
+    with mirror_lock(get_mirror_path(repository_url, cache_dir)):
+        mirror_path = update_mirror(repository_url, logger, cache_dir, CLONE_PROFILES[profile]['filter'])
+        checkout_from_mirror(repository_url, mirror_path, target_dir, logger, CLONE_PROFILES[profile]['checkout'])
+    logger.info(f"Repository cloned successfully with the {profile} profile in {time.time() - start_time:.2f} seconds.")
+    evict_mirrors(logger, cache_dir=cache_dir)
+    return target_dir
@@ -0,0 +1,109 @@
+import json
+import os
+import re
+
+# Characters read from the output file at a time
+CHUNK_SIZE = 64 * 1024
+
+decoder = json.JSONDecoder()
+commits_array_start = re.compile(r'"commits"\s*:\s*\[')
+
+def iter_commits(json_output_file, chunk_size=CHUNK_SIZE):
+    """
+    Yield the commit records of a RefactoringMiner JSON output one at a time.
+    Only the commit being decoded is held in memory, whatever the size of the file.
+    """
+    with open(json_output_file, 'r', encoding='utf-8') as json_file:
+        buffer = ''
+        position = 0
+        end_of_file = False
+
+        # Skip to the opening bracket of the commits array
+        while True:
+            match = commits_array_start.search(buffer)
+            if match:
+                position = match.end()
+                break
+            if end_of_file:
+                return # empty file or null document
+            chunk = json_file.read(chunk_size)
+            end_of_file = not chunk
+            buffer = buffer[-32:] + chunk # keep enough to match the key across chunk borders
+
+        read_size = chunk_size
+        while True:
+            # Skip separators between the commit objects
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ','):
+                position += 1
+
+            if position < len(buffer):
+                if buffer[position] == ']':
+                    return
+                try:
+                    commit, position = decoder.raw_decode(buffer, position)
+                    read_size = chunk_size
+                    yield commit
+                    continue
+                except json.JSONDecodeError:
+                    if end_of_file:
+                        raise
+
+            if end_of_file:
+                raise ValueError(f"Unexpected end of file in {json_output_file}")
+
+            # Drop what was already decoded and read more. The read size grows while a single
+            # commit does not fit, so a commit with many refactorings is not re-decoded per chunk.
+            buffer = buffer[position:]
+            position = 0
+            chunk = json_file.read(read_size)
+            end_of_file = not chunk
+            buffer += chunk
+            read_size *= 2
+
+def iter_refactoring_commit_shas(json_output_file):
+    """
+    Yield the SHA-1 of every commit that has at least one refactoring.
+    """
+    for commit in iter_commits(json_output_file):
+        if commit['refactorings']:
+            yield commit['sha1']
+
+def get_refactoring_commit_shas(json_output_file):
+    return list(iter_refactoring_commit_shas(json_output_file))
+
+def write_commits(commits, json_output_file):
+    """
+    Write an iterable of commits in the RefactoringMiner output format without materialising it.
+    The file is replaced atomically once all commits are written.
+    """
+    os.makedirs(os.path.dirname(json_output_file) or '.', exist_ok=True)
+    temporary_file = f'{json_output_file}.tmp'
+    commit_count = 0
+    with open(temporary_file, 'w', encoding='utf-8') as json_file:
+        json_file.write('{\n"commits": [\n')
+        for commit in commits:
+            if commit_count > 0:
+                json_file.write(',\n')
+            json_file.write(json.dumps(commit, indent='\t'))
+            commit_count += 1
+        json_file.write('\n]\n}')
+    os.replace(temporary_file, json_output_file)
+    return commit_count
+
+def iter_merged_commits(output_files):
+    """
+    Yield the commits of several outputs in order, skipping commits already seen in an earlier file.
+    """
+    seen_commits = set()
+    for output_file in output_files:
+        for commit in iter_commits(output_file):
+            if commit['sha1'] in seen_commits:
+                continue
+            seen_commits.add(commit['sha1'])
+            yield commit
+
+def merge_outputs(output_files, json_output_file):
+    """
+    Merge RefactoringMiner outputs into json_output_file. Earlier files win on duplicate commits.
+    """
+    return write_commits(iter_merged_commits(output_files), json_output_file)
@@ -0,0 +1,123 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from Metrics import bind_spans
+from RefactoringMinerOutput import merge_outputs
+from RefactoringMinerWorkers import run_refactoring_miner_job
+
+BASE_COMMIT_WEIGHT = 20 # fixed cost of a commit for RefactoringMiner, in changed lines
+shortstat_numbers = re.compile(r'(\d+) (insertion|deletion)')
+
+def get_commit_weights(repo_dir, start_commit=None, end_commit='HEAD'):
+    """
+    Return [(commit, weight)] for the first-parent history of end_commit, oldest first, optionally
+    stopping at start_commit. The weight is the number of changed lines plus a fixed cost per commit.
+    Merges are weighted with their diff against the first parent, which covers the merged branch.
+    """
+    revision_range = f'{start_commit}..{end_commit}' if start_commit else end_commit
+    output = subprocess.check_output(
+        ['git', 'log', '--first-parent', '--diff-merges=first-parent', '--shortstat', '--format=@%H', revision_range],
+        cwd=repo_dir, universal_newlines=True)
+
+    weights = []
+    for line in output.splitlines():
+        if line.startswith('@'):
+            weights.append([line[1:], BASE_COMMIT_WEIGHT])
+        elif line.strip() and weights:
+            weights[-1][1] += sum(int(count) for count, _ in shortstat_numbers.findall(line))
+    weights.reverse()
+    return [tuple(weight) for weight in weights]
+
+def split_into_shards(weights, shard_count):
+    """
+    Split an oldest-first [(commit, weight)] list into at most shard_count contiguous ranges of similar weight.
+    Returns [(start, end)] newest range first, where start is exclusive (None means the beginning of history).
+    """
+    total_weight = sum(weight for _, weight in weights)
+    shard_count = max(1, min(shard_count, len(weights)))
+
+    boundaries = []
+    accumulated = 0
+    for index, (commit, weight) in enumerate(weights[:-1]): # the newest commit always closes the last range
+        accumulated += weight
+        cuts_left = shard_count - len(boundaries) - 1
+        if cuts_left == 0:
+            break
+        commits_left = len(weights) - index - 1
+        if accumulated >= total_weight * (len(boundaries) + 1) / shard_count or commits_left == cuts_left:
+            boundaries.append(commit)
+    boundaries.append(weights[-1][0])
+
+    shards = []
+    start = None
+    for end in boundaries:
+        shards.append((start, end))
+        start = end
+    shards.reverse()
+    return shards
+
+def create_shard_clone(repo_dir, shard_dir):
+    """
+    Make a clone that shares the objects of repo_dir for one RefactoringMiner process. The origin URL is
+    copied so the output reports the same repository URL as a single run.
+    """
+    subprocess.check_call(['git', 'clone', '--quiet', '--shared', '--no-checkout', repo_dir, shard_dir])
+    origin = subprocess.run(['git', 'config', '--get', 'remote.origin.url'], cwd=repo_dir, stdout=subprocess.PIPE, universal_newlines=True)
+    if origin.returncode == 0:
+        subprocess.check_call(['git', 'remote', 'set-url', 'origin', origin.stdout.strip()], cwd=shard_dir)
+
+def run_shard(refactoringminer_path, shard_dir, start_commit, end_commit, json_output_file, logger):
+    shard_start = time.time()
+    run_refactoring_miner_job(refactoringminer_path, shard_dir, json_output_file, logger, start_commit, end_commit)
+    logger.info(f"Shard {start_commit[:10]}..{end_commit[:10]} completed in {time.time() - shard_start:.2f} seconds.")
+    return json_output_file
+
+def run_sharded_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, shard_count, start_commit=None, end_commit='HEAD', on_shard_output=None):
+    """
+    Run RefactoringMiner as shard_count parallel processes over commit ranges of similar size, then merge
+    their outputs newest range first into json_output_file, in the order of a single run.
+    on_shard_output(repo_dir, index, shard_output) is called as soon as each shard finishes, index 0 being
+    the newest range, so later stages can start on it while the other shards are mined. If it returns a
+    future, the shard output is kept until the future is done.
+    Returns False without running anything when the history is too short to shard.
+    """
+    weights = get_commit_weights(repo_dir, start_commit, end_commit)
+    if len(weights) < 2:
+        return False
+
+    # The oldest commit of the history has no parent range to start from, so it is used as the first start
+    if start_commit is None:
+        start_commit, _ = weights.pop(0)
+    shards = [(start or start_commit, end) for start, end in split_into_shards(weights, shard_count)]
+    logger.info(f"Running RefactoringMiner in {len(shards)} shards over {len(weights)} commits...")
+
+    shards_dir = tempfile.mkdtemp()
+    refactoringminer_start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = []
+            for index, (start, end) in enumerate(shards):
+                shard_dir = os.path.join(shards_dir, f'shard_{index}')
+                create_shard_clone(repo_dir, shard_dir)
+                shard_output = os.path.join(shards_dir, f'shard_{index}.json')
+                futures.append(executor.submit(bind_spans(run_shard), refactoringminer_path, shard_dir, start, end, shard_output, logger))
+
+            downstream = []
+            if on_shard_output:
+                for future in as_completed(futures):
+                    downstream.append(on_shard_output(repo_dir, futures.index(future), future.result()))
+            shard_outputs = [future.result() for future in futures]
+        wait([future for future in downstream if future is not None])
+
+        commit_count = merge_outputs(shard_outputs, json_output_file)
+    finally:
+        shutil.rmtree(shards_dir, ignore_errors=True)
+
+    logger.info(f"RefactoringMiner completed in {time.time() - refactoringminer_start:.2f} seconds.")
+    logger.info(f"Merged output with {commit_count} commits saved to {json_output_file}")
+    return True
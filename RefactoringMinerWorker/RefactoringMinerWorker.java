@@ -0,0 +1,179 @@
+import com.google.gson.Gson;
+import com.google.gson.JsonElement;
+import com.google.gson.JsonObject;
+import org.eclipse.jgit.lib.Repository;
+import org.refactoringminer.api.GitHistoryRefactoringMiner;
+import org.refactoringminer.api.GitService;
+import org.refactoringminer.api.Refactoring;
+import org.refactoringminer.api.RefactoringHandler;
+import org.refactoringminer.rm1.GitHistoryRefactoringMinerImpl;
+import org.refactoringminer.util.GitServiceImpl;
+
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.util.List;
+
+/**
+ * Long-lived RefactoringMiner process driven by RefactoringMinerWorkers.py, so many repositories are
+ * mined by one warm JVM. Runs in source-file mode with the RefactoringMiner jars on the classpath:
+ *
+ *   java -cp "RefactoringMiner-3.0.8/lib/*" RefactoringMinerWorker/RefactoringMinerWorker.java
+ *
+ * It reads one job per line on stdin:
+ *
+ *   {"repository": "<git directory>", "output": "<json file>", "start": "<commit>", "end": "<commit>"}
+ *
+ * and mines every commit of the repository, like -a, or the commits between start and end, like -bc,
+ * into the output file in the format of the -json option. Every job is answered with one line on stdout,
+ * {"ok": true, "commits": n, "seconds": s} or {"ok": false, "error": "...", "seconds": s}, after a first
+ * {"ready": true} line once the worker is up. The worker exits at the end of its input, and after an
+ * Error such as OutOfMemoryError, which may have left the JVM unusable.
+ */
+public class RefactoringMinerWorker {
+    public static void main(String[] args) throws IOException {
+        PrintStream replies = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        // RefactoringMiner and its libraries print progress, which must not mix with the replies
+        System.setOut(System.err);
+
+        Gson gson = new Gson();
+        GitService gitService = new GitServiceImpl();
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        replies.println("{\"ready\": true}");
+
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            if (line.trim().isEmpty()) {
+                continue;
+            }
+            JsonObject reply = new JsonObject();
+            long started = System.nanoTime();
+            boolean fatal = false;
+            try {
+                JsonObject job = gson.fromJson(line, JsonObject.class);
+                reply.addProperty("commits", mine(gitService, job));
+                reply.addProperty("ok", true);
+            } catch (Throwable e) {
+                e.printStackTrace();
+                reply.addProperty("ok", false);
+                reply.addProperty("error", e.toString());
+                fatal = e instanceof Error;
+            }
+            reply.addProperty("seconds", (System.nanoTime() - started) / 1e9);
+            replies.println(gson.toJson(reply));
+            if (fatal) {
+                System.exit(1);
+            }
+        }
+    }
+
+    private static String getString(JsonObject job, String name) {
+        JsonElement value = job.get(name);
+        return value == null || value.isJsonNull() ? null : value.getAsString();
+    }
+
+    /**
+     * Mine the commits of a job into its output file and return the number of commits written.
+     * The output is written to a temporary file first, so a failed job never leaves a partial output.
+     */
+    private static int mine(GitService gitService, JsonObject job) throws Exception {
+        String repositoryPath = getString(job, "repository");
+        Path output = Paths.get(getString(job, "output")).toAbsolutePath();
+        String startCommit = getString(job, "start");
+        String endCommit = getString(job, "end");
+        Files.createDirectories(output.getParent());
+        Path temporaryOutput = output.resolveSibling(output.getFileName() + ".tmp");
+
+        JsonOutputHandler handler;
+        try (Repository repository = gitService.openRepository(repositoryPath);
+             Writer writer = Files.newBufferedWriter(temporaryOutput, StandardCharsets.UTF_8)) {
+            handler = new JsonOutputHandler(writer, repository.getConfig().getString("remote", "origin", "url"));
+            writer.write("{\n\"commits\": [\n");
+            GitHistoryRefactoringMiner miner = new GitHistoryRefactoringMinerImpl();
+            if (startCommit != null) {
+                miner.detectBetweenCommits(repository, startCommit, endCommit, handler);
+            } else {
+                miner.detectAll(repository, null, handler);
+            }
+            writer.write("\n]\n}");
+        }
+        if (handler.writeError != null) {
+            throw handler.writeError;
+        }
+        Files.move(temporaryOutput, output, StandardCopyOption.REPLACE_EXISTING);
+        return handler.commitCount;
+    }
+
+    /**
+     * Writes the commits as they are mined, in the format of RefactoringMiner's -json option.
+     */
+    private static class JsonOutputHandler extends RefactoringHandler {
+        private final Writer writer;
+        private final String cloneUrl;
+        int commitCount = 0;
+        IOException writeError = null;
+
+        JsonOutputHandler(Writer writer, String cloneUrl) {
+            this.writer = writer;
+            this.cloneUrl = cloneUrl;
+        }
+
+        @Override
+        public void handle(String commitId, List<Refactoring> refactorings) {
+            if (writeError != null) {
+                return;
+            }
+            try {
+                StringBuilder commit = new StringBuilder();
+                if (commitCount > 0) {
+                    commit.append(",\n");
+                }
+                commit.append("{\n");
+                commit.append("\t\"repository\": \"").append(cloneUrl).append("\",\n");
+                commit.append("\t\"sha1\": \"").append(commitId).append("\",\n");
+                commit.append("\t\"url\": \"").append(getCommitUrl(commitId)).append("\",\n");
+                commit.append("\t\"refactorings\": [");
+                for (int index = 0; index < refactorings.size(); index++) {
+                    if (index > 0) {
+                        commit.append(",");
+                    }
+                    commit.append(refactorings.get(index).toJSON());
+                }
+                commit.append("]\n}");
+                writer.write(commit.toString());
+                commitCount++;
+            } catch (IOException e) {
+                writeError = e; // RefactoringMiner reports exceptions of the handler per commit and goes on
+            }
+        }
+
+        @Override
+        public void handleException(String commitId, Exception e) {
+            System.err.println("Error processing commit " + commitId);
+            e.printStackTrace(System.err);
+        }
+
+        private String getCommitUrl(String commitId) {
+            if (cloneUrl == null) {
+                return commitId;
+            }
+            String url = cloneUrl.endsWith(".git") ? cloneUrl.substring(0, cloneUrl.length() - 4) : cloneUrl.replaceAll("/$", "");
+            if (url.startsWith("https://bitbucket.org")) {
+                return url + "/commits/" + commitId;
+            }
+            if (url.startsWith("https://github.com") || url.startsWith("https://gitlab.com")) {
+                return url + "/commit/" + commitId;
+            }
+            return url + "/" + commitId;
+        }
+    }
+}
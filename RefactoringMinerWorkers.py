@@ -0,0 +1,246 @@
+import atexit
+import json
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+from Metrics import add
+from MinerMemory import (JVM_OVERHEAD_MB, OOM_EXIT_CODE, GcLog, MinerOutOfMemoryError, get_gc_log_path, get_heap_size_mb,
+                         get_jvm_options, get_max_heap_mb, get_repository_size_mb, log_gc_pressure)
+from Scheduler import acquire_memory, get_memory_budget_mb, is_memory_awaited, release_memory, reserve_memory, stage
+
+# Bundled driver that keeps RefactoringMiner loaded in a JVM and mines the repositories sent to it.
+# It runs in source-file mode (Java 11+), so nothing has to be built.
+REFACTORING_MINER_WORKER_SOURCE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'RefactoringMinerWorker', 'RefactoringMinerWorker.java')
+# Jobs served by a JVM before it is replaced, so memory RefactoringMiner keeps between jobs cannot build up
+WORKER_MAX_JOBS = 200
+WORKER_STOP_TIMEOUT = 30 # in seconds
+WORKER_IDLE_CHECK_INTERVAL = 1 # in seconds. How often idle JVMs check whether another run waits for their memory.
+# JVM options are read from the same variables as the RefactoringMiner launcher script
+JVM_OPTION_VARIABLES = ('JAVA_OPTS', 'REFACTORING_MINER_OPTS')
+
+def get_worker_command(refactoringminer_path, jvm_options=()):
+    """
+    Return the command starting a worker JVM with the jars of the distribution refactoringminer_path belongs to.
+    jvm_options come after the options of the environment, so they take precedence.
+    """
+    lib_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(refactoringminer_path))), 'lib')
+    environment_options = [option for variable in JVM_OPTION_VARIABLES for option in shlex.split(os.environ.get(variable, ''))]
+    return ['java', *environment_options, *jvm_options, '-cp', os.path.join(lib_dir, '*'), REFACTORING_MINER_WORKER_SOURCE]
+
+def get_launcher_command(refactoringminer_path, repo_dir, json_output_file, start_commit=None, end_commit=None):
+    if start_commit:
+        return [refactoringminer_path, '-bc', repo_dir, start_commit, end_commit, '-json', json_output_file]
+    return [refactoringminer_path, '-a', repo_dir, '-json', json_output_file]
+
+def get_job_name(json_output_file):
+    return os.path.splitext(os.path.basename(json_output_file))[0]
+
+class RefactoringMinerWorker:
+    """
+    One JVM running the bundled driver. It is started on the first job and restarted when it died,
+    served WORKER_MAX_JOBS jobs or a job needs a larger heap. The JVM holds its heap and overhead from
+    the memory budget from start to stop, idle or not. Not thread-safe, the pool hands each worker to
+    one thread at a time.
+    """
+    def __init__(self, refactoringminer_path):
+        self.refactoringminer_path = refactoringminer_path
+        self.process = None
+        self.jobs = 0
+        self.heap_mb = 0
+        self.reserved_mb = 0
+        self.gc_log = None
+
+    def start(self, heap_mb):
+        self.heap_mb = heap_mb
+        self.reserved_mb = acquire_memory(heap_mb + JVM_OVERHEAD_MB)
+        self.gc_log = GcLog(get_gc_log_path('worker'))
+        command = get_worker_command(self.refactoringminer_path, get_jvm_options(heap_mb, self.gc_log.path))
+        try:
+            # stderr is inherited, so RefactoringMiner's progress and errors show up like with the launcher
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            universal_newlines=True, encoding='utf-8', bufsize=1)
+        except OSError:
+            self.release_memory()
+            raise
+        self.jobs = 0
+        add('jvm_starts')
+        self.read_reply() # the ready line, once the driver is compiled and running
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_reply(self):
+        line = self.process.stdout.readline()
+        if not line:
+            returncode = self.process.wait()
+            self.process = None
+            self.release_memory()
+            if returncode == OOM_EXIT_CODE:
+                raise MinerOutOfMemoryError(self.heap_mb)
+            raise RuntimeError(f"RefactoringMiner worker exited with code {returncode}")
+        return json.loads(line)
+
+    def run(self, job, heap_mb):
+        """
+        Send a job to the JVM, restarted with heap_mb first if its heap is smaller, and return its reply.
+        Raises MinerOutOfMemoryError when the JVM ran out of heap and RuntimeError when the job failed otherwise.
+        """
+        if not self.is_alive() or self.jobs >= WORKER_MAX_JOBS or heap_mb > self.heap_mb:
+            self.stop()
+            self.start(max(heap_mb, self.heap_mb))
+        self.jobs += 1
+        try:
+            self.process.stdin.write(json.dumps(job) + '\n')
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.stop()
+            raise RuntimeError("RefactoringMiner worker exited before it received the job")
+        reply = self.read_reply()
+        if not reply.get('ok'):
+            if 'OutOfMemoryError' in reply.get('error', ''):
+                raise MinerOutOfMemoryError(self.heap_mb)
+            raise RuntimeError(f"RefactoringMiner failed on {job['repository']}: {reply.get('error')}")
+        return reply
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close() # the driver exits at the end of its input
+                self.process.wait(timeout=WORKER_STOP_TIMEOUT)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        self.release_memory()
+
+    def release_memory(self):
+        release_memory(self.reserved_mb)
+        self.reserved_mb = 0
+
+class RefactoringMinerWorkerPool:
+    """
+    Long-lived RefactoringMiner JVMs shared by the runs of a process. JVMs are started on first use and
+    stay warm between repositories, so JVM startup, class loading and JIT warm-up are paid once per JVM
+    instead of once per repository or shard. Up to size jobs run at once, e.g. the shards of a repository.
+    Running JVMs hold their memory from the budget while idle, so idle JVMs are stopped as soon as
+    another run, in this or another process, waits for memory.
+    """
+    def __init__(self, refactoringminer_path, size):
+        self.size = size
+        self.idle = queue.LifoQueue() # the most recently used JVM is the warmest
+        for _ in range(size):
+            self.idle.put(RefactoringMinerWorker(refactoringminer_path))
+        self.closed = threading.Event()
+        self.idle_monitor = threading.Thread(target=self.stop_idle_workers_when_memory_awaited, daemon=True)
+        self.idle_monitor.start()
+
+    def run(self, repo_dir, json_output_file, logger, heap_mb, start_commit=None, end_commit=None):
+        worker = self.idle.get()
+        try:
+            job = {'repository': os.path.abspath(repo_dir), 'output': os.path.abspath(json_output_file), 'start': start_commit, 'end': end_commit}
+            started = time.time()
+            try:
+                return worker.run(job, heap_mb)
+            finally:
+                if worker.gc_log:
+                    log_gc_pressure(worker.gc_log, worker.heap_mb, time.time() - started, logger)
+        finally:
+            if is_memory_awaited():
+                worker.stop()
+            self.idle.put(worker)
+
+    def stop_idle_workers_when_memory_awaited(self):
+        while not self.closed.wait(WORKER_IDLE_CHECK_INTERVAL):
+            if not is_memory_awaited():
+                continue
+            idle_workers = []
+            try:
+                while True:
+                    idle_workers.append(self.idle.get_nowait())
+            except queue.Empty:
+                pass
+            for worker in idle_workers:
+                worker.stop() # restarted with the same heap by its next job
+                self.idle.put(worker)
+
+    def close(self):
+        self.closed.set()
+        self.idle_monitor.join()
+        for _ in range(self.size):
+            self.idle.get().stop()
+
+# Process-wide pools by RefactoringMiner path, used once configure() set a size
+worker_count = 0
+pools = {}
+pools_lock = threading.Lock()
+
+def configure(size):
+    """
+    Mine with up to size warm JVMs per process from now on, or with one launcher process per run when size is 0.
+    """
+    global worker_count
+    with pools_lock:
+        if size == worker_count:
+            return
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
+        worker_count = size
+
+def get_pool(refactoringminer_path):
+    with pools_lock:
+        if refactoringminer_path not in pools:
+            pools[refactoringminer_path] = RefactoringMinerWorkerPool(refactoringminer_path, worker_count)
+        return pools[refactoringminer_path]
+
+def run_launcher(refactoringminer_path, repo_dir, json_output_file, logger, heap_mb, start_commit=None, end_commit=None):
+    """
+    Run the RefactoringMiner launcher script once with the given heap.
+    """
+    command = get_launcher_command(refactoringminer_path, repo_dir, json_output_file, start_commit, end_commit)
+    gc_log = GcLog(get_gc_log_path(get_job_name(json_output_file)))
+    # The launcher appends REFACTORING_MINER_OPTS to the JVM options, so the heap set here wins over JAVA_OPTS
+    environment = dict(os.environ)
+    environment['REFACTORING_MINER_OPTS'] = ' '.join([environment.get('REFACTORING_MINER_OPTS', ''), *get_jvm_options(heap_mb, gc_log.path)]).strip()
+    with reserve_memory(heap_mb + JVM_OVERHEAD_MB):
+        started = time.time()
+        try:
+            # The launcher is a batch file on Windows, which needs the shell to run
+            returncode = subprocess.call(command, shell=(os.name == 'nt'), env=environment)
+        finally:
+            log_gc_pressure(gc_log, heap_mb, time.time() - started, logger)
+    if returncode == OOM_EXIT_CODE:
+        raise MinerOutOfMemoryError(heap_mb)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+def run_refactoring_miner_job(refactoringminer_path, repo_dir, json_output_file, logger, start_commit=None, end_commit=None):
+    """
+    Mine every commit of repo_dir, or the commits between start_commit and end_commit, into json_output_file.
+    Runs on a warm worker JVM when configured, and with the RefactoringMiner launcher script otherwise.
+    The heap is sized from the repository and doubled up to the largest heap the memory budget allows
+    when RefactoringMiner runs out of memory. MinerOutOfMemoryError is raised when even that is not enough.
+    Every attempt holds a slot of the refactoring_miner stage, so each shard of a repository takes a slot.
+    """
+    max_heap_mb = get_max_heap_mb(get_memory_budget_mb())
+    heap_mb = get_heap_size_mb(get_repository_size_mb(repo_dir), max_heap_mb)
+    while True:
+        try:
+            with stage('refactoring_miner'):
+                if worker_count > 0:
+                    get_pool(refactoringminer_path).run(repo_dir, json_output_file, logger, heap_mb, start_commit, end_commit)
+                else:
+                    run_launcher(refactoringminer_path, repo_dir, json_output_file, logger, heap_mb, start_commit, end_commit)
+            return
+        except MinerOutOfMemoryError:
+            if heap_mb >= max_heap_mb:
+                raise
+            heap_mb = min(heap_mb * 2, max_heap_mb)
+            add('oom_retries')
+            logger.warning(f"RefactoringMiner ran out of memory on {repo_dir}, retrying with a {heap_mb} MB heap")
+
+atexit.register(configure, 0)
@@ -1,14 +1,29 @@
+import glob
 import os
+import re
 import subprocess
+import shutil
 import sys
 import tempfile
 import time
 from datetime import date
 
 from LoggerManager import get_logger
+from Metrics import span
+from MinerMemory import OOM_SHARD_COUNT, MinerOutOfMemoryError
+from CloneProfiles import DEFAULT_CLONE_PROFILE
+from MirrorCache import clone_repository
+from RefactoringMinerOutput import iter_commits, merge_outputs
+from RefactoringMinerShards import run_sharded_refactoring_miner
+from RefactoringMinerWorkers import run_refactoring_miner_job
+from Scheduler import stage
 
 script_ran_independently = False
 
+# The RefactoringMiner distribution shipped with the project. The directory name carries its version.
+REFACTORING_MINER_DIR = 'RefactoringMiner-3.0.8'
+REFACTORING_MINER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), REFACTORING_MINER_DIR, 'bin', 'RefactoringMiner')
+
 def check_executable_exists(executable, logger):
     from shutil import which
     if which(executable) is None:
@@ -17,14 +32,166 @@ def check_executable_exists(executable, logger):
     else:
         logger.info(f"{executable} is available.")
 
-def main(args, logger):
+def run_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, shard_count=1, on_shard_output=None):
+    """
+    Run RefactoringMiner on the whole history of repo_dir. Returns False if the output only covers the history of HEAD,
+    because it was mined in shards or the run ran out of memory and fell back to shards, and True otherwise.
+    """
+    # Shards are ranges of the first-parent history of HEAD, commits only on other branches are not mined
+    if shard_count > 1 and run_sharded_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, shard_count, on_shard_output=on_shard_output):
+        return False
+
+    logger.info("Running RefactoringMiner...")
+    refactoringminer_start = time.time()  # Start timer for RefactoringMiner
+
+    complete = True
+    try:
+        run_refactoring_miner_job(refactoringminer_path, repo_dir, json_output_file, logger)
+    except MinerOutOfMemoryError:
+        # Narrower commit ranges need less heap than the whole history at once
+        if shard_count > 1 or not run_sharded_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, OOM_SHARD_COUNT, on_shard_output=on_shard_output):
+            raise
+        logger.warning(f"RefactoringMiner ran out of memory on the whole history, mined the history of HEAD in {OOM_SHARD_COUNT} shards instead. "
+                       "Commits only on other branches were not mined.")
+        complete = False
+    refactoringminer_duration = time.time() - refactoringminer_start
+    logger.info(f"RefactoringMiner completed in {refactoringminer_duration:.2f} seconds.")
+    logger.info(f"Output saved to {json_output_file}")
+    return complete
+
+def run_refactoring_miner_between(refactoringminer_path, repo_dir, start_commit, end_commit, json_output_file, logger, shard_count=1):
+    """
+    Run RefactoringMiner on the commits reachable from end_commit but not from start_commit. Returns False if
+    the output only covers their first-parent history, because they were mined in shards, and True otherwise.
+    """
+    if shard_count > 1 and run_sharded_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, shard_count, start_commit, end_commit):
+        return False
+
+    logger.info(f"Running RefactoringMiner between {start_commit} and {end_commit}...")
+    refactoringminer_start = time.time()
+
+    complete = True
+    try:
+        run_refactoring_miner_job(refactoringminer_path, repo_dir, json_output_file, logger, start_commit, end_commit)
+    except MinerOutOfMemoryError:
+        if shard_count > 1 or not run_sharded_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, OOM_SHARD_COUNT, start_commit, end_commit):
+            raise
+        logger.warning(f"RefactoringMiner ran out of memory between {start_commit} and {end_commit}, mined the range in {OOM_SHARD_COUNT} shards instead.")
+        complete = False
+    refactoringminer_duration = time.time() - refactoringminer_start
+    logger.info(f"RefactoringMiner completed in {refactoringminer_duration:.2f} seconds.")
+    return complete
+
+def find_latest_output(github_repo_name, output_dir='RefactoringMinerOutputs'):
+    """
+    Return the newest <repo>_<date>.json output of a repository, or None if it has never been analysed.
+    """
+    name_pattern = re.compile(rf'{re.escape(github_repo_name)}_\d{{4}}-\d{{2}}-\d{{2}}\.json')
+    outputs = [path for path in glob.glob(os.path.join(output_dir, f'{glob.escape(github_repo_name)}_*.json'))
+               if name_pattern.fullmatch(os.path.basename(path))]
+    if not outputs:
+        return None
+    return max(outputs, key=os.path.basename) # ISO dates sort chronologically
+
+def find_last_processed_commit(repo_dir, processed_commits):
+    """
+    Walk the first-parent history of HEAD and return the newest commit that is already in processed_commits.
+    """
+    process = subprocess.Popen(['git', 'rev-list', '--first-parent', 'HEAD'], cwd=repo_dir, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        for line in process.stdout:
+            commit_hash = line.strip()
+            if commit_hash in processed_commits:
+                return commit_hash
+        return None
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+def has_unmined_commits_off_head(repo_dir, processed_commits):
+    """
+    Return whether a commit that is only on other branches than HEAD is missing from processed_commits.
+    Root commits and merges are left out, RefactoringMiner does not list them.
+    """
+    process = subprocess.Popen(['git', 'rev-list', '--all', '--min-parents=1', '--max-parents=1', '--not', 'HEAD'],
+                               cwd=repo_dir, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        return any(line.strip() not in processed_commits for line in process.stdout)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+def run_incremental_refactoring_miner(refactoringminer_path, repo_dir, previous_output_file, json_output_file, logger, shard_count=1):
+    """
+    Mine only the commits added since previous_output_file was produced and merge them into json_output_file.
+    Falls back to a full run when none of the previously mined commits is on the current history.
+    Only the new commits of HEAD are mined, so False is returned when other branches have commits missing
+    from the output, and when the new commits or the full run only covered the history of HEAD.
+    """
+    logger.info(f"Reading previously mined commits from {previous_output_file}")
+    processed_commits = {commit['sha1'] for commit in iter_commits(previous_output_file)}
+    last_processed_commit = find_last_processed_commit(repo_dir, processed_commits)
+
+    if last_processed_commit is None:
+        logger.info("No previously mined commit found on the current history, running a full analysis.")
+        return run_refactoring_miner(refactoringminer_path, repo_dir, json_output_file, logger, shard_count)
+
+    complete = not has_unmined_commits_off_head(repo_dir, processed_commits)
+    if not complete:
+        logger.warning("Other branches than HEAD have commits that were not mined, only the new commits of HEAD are mined.")
+
+    head_commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, universal_newlines=True).strip()
+    if head_commit == last_processed_commit:
+        logger.info(f"{previous_output_file} is up to date with {head_commit}.")
+        if os.path.abspath(previous_output_file) != os.path.abspath(json_output_file):
+            shutil.copyfile(previous_output_file, json_output_file)
+        return complete
+
+    new_output_file = f'{json_output_file}.new'
+    try:
+        range_complete = run_refactoring_miner_between(refactoringminer_path, repo_dir, last_processed_commit, head_commit, new_output_file, logger, shard_count)
+        commit_count = merge_outputs([new_output_file, previous_output_file], json_output_file)
+    finally:
+        if os.path.exists(new_output_file):
+            os.remove(new_output_file)
+    logger.info(f"Merged output with {commit_count} commits saved to {json_output_file}")
+    return complete and range_complete
+
+def clone_to_temporary_directory(github_repo_url, logger, profile=DEFAULT_CLONE_PROFILE):
+    """
+    Clone a repository into a new temporary directory with one of CloneProfiles.CLONE_PROFILES and return its path.
+    """
+    temporary_dir = tempfile.mkdtemp()
+    logger.info(f"Temporary directory created at {temporary_dir} for cloning.")
+    try:
+        with stage('clone'):
+            clone_repository(github_repo_url, temporary_dir, logger, profile=profile)
+    except BaseException:
+        remove_temporary_directory(temporary_dir)
+        raise
+    return temporary_dir
+
+def remove_temporary_directory(temporary_dir):
+    """
+    Remove a clone made by clone_to_temporary_directory. The mirror it shares objects with can be evicted again afterwards.
+    """
+    if temporary_dir:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+
+def main(args, logger, incremental=False, shard_count=1, clone_profile=DEFAULT_CLONE_PROFILE, on_shard_output=None):
+    """
+    Clone a repository and run RefactoringMiner on it. Returns the clone, the output and whether the output covers every
+    branch (see run_refactoring_miner), or (None, None, False) on errors.
+    """
     if script_ran_independently and len(sys.argv) < 2:
         logger.info("Usage: python RefactoringRunner.py <GitHub_Repo_URL>")
         sys.exit(1)
 
     github_repo_url = sys.argv[1] if script_ran_independently else args
     github_repo_name = github_repo_url.split('/')[-1]
-    refactoringminer_path = os.path.dirname(os.path.realpath(__file__)) + '/RefactoringMiner-3.0.8/bin/RefactoringMiner'
+    refactoringminer_path = REFACTORING_MINER_PATH
 
     logger.info(f"GitHub repo URL: {github_repo_url}")
     logger.info(f"Repo name extracted: {github_repo_name}")
@@ -42,41 +209,35 @@ def main(args, logger):
     else:
         logger.info(f"RefactoringMiner path: {refactoringminer_path}")
 
-    # Create a temporary directory to clone the repo
-    temporary_dir = tempfile.mkdtemp()
-    logger.info(f"Temporary directory created at {temporary_dir} for cloning.")
-
-    start_time = time.time() # Start timer for cloning
+    temporary_dir = None
     try:
-        # Clone the repository
-        logger.info(f"Cloning repository {github_repo_url} to {temporary_dir}...")
-        subprocess.check_call(['git', 'clone', github_repo_url, temporary_dir])
-        clone_duration = time.time() - start_time
-        logger.info(f"Repository cloned successfully in {clone_duration:.2f} seconds.")
-
-        # Run RefactoringMiner
-        logger.info("Running RefactoringMiner...")
-        json_output_file = f'RefactoringMinerOutputs/{github_repo_name}_{date.today()}.json'
-        refactoringminer_start = time.time()  # Start timer for RefactoringMiner
+        with span('clone', github_repo_url):
+            temporary_dir = clone_to_temporary_directory(github_repo_url, logger, clone_profile)
 
-        subprocess.check_call([refactoringminer_path, '-a', temporary_dir, '-json', json_output_file], shell=True)
-        refactoringminer_duration = time.time() - refactoringminer_start
-        logger.info(f"RefactoringMiner completed in {refactoringminer_duration:.2f} seconds.")
-        logger.info(f"Output saved to {json_output_file}")
+        json_output_file = f'RefactoringMinerOutputs/{github_repo_name}_{date.today()}.json'
+        previous_output_file = find_latest_output(github_repo_name) if incremental else None
+        # The refactoring_miner stage slots are taken by every RefactoringMiner run, one per shard, see run_refactoring_miner_job
+        with span('jvm', github_repo_url):
+            if previous_output_file:
+                complete = run_incremental_refactoring_miner(refactoringminer_path, temporary_dir, previous_output_file, json_output_file, logger, shard_count)
+            else:
+                # Shard outputs are streamed to on_shard_output in full runs only, an incremental run only mines the new commits
+                complete = run_refactoring_miner(refactoringminer_path, temporary_dir, json_output_file, logger, shard_count, on_shard_output)
 
         # Return the paths to the cloned repo and the JSON file for later use
-        return temporary_dir, json_output_file
+        logger.info(f"Repository cloned to {temporary_dir} is available for further analysis.")
+        return temporary_dir, json_output_file, complete
 
+    # The clone of a failed run is removed, a retry clones again
     except subprocess.CalledProcessError as ex:
         logger.error(f"Subprocess error occurred: {ex}", exc_info=True)
-        return None, None
+        remove_temporary_directory(temporary_dir)
+        return None, None, False
 
     except Exception as exception:
         logger.error(f"An unexpected error occurred: {exception}", exc_info=True)
-        return None, None
-
-    finally:
-        logger.info(f"Repository cloned to {temporary_dir} is available for further analysis.")
+        remove_temporary_directory(temporary_dir)
+        return None, None, False
 
 
 def onerror(func, path, exc_info):
@@ -101,6 +262,6 @@ def onerror(func, path, exc_info):
 if __name__ == '__main__':
     script_ran_independently = True
     refactoring_runner_logger = get_logger("RefactoringRunner")
-    temp_dir, json_output = main(sys.argv[1:], refactoring_runner_logger)
+    temp_dir, json_output, _ = main(sys.argv[1:], refactoring_runner_logger)
     print(f"Cloned repository path: {temp_dir}")
     print(f"RefactoringMiner JSON output: {json_output}")
\ No newline at end of file
@@ -2,7 +2,8 @@ import os
 import subprocess
 import sys
 import tempfile
-import time
+
+from MirrorCache import clone_repository
 
 script_ran_independently = False
 
@@ -32,13 +33,9 @@ def main(args, logger):
     temporary_dir = tempfile.mkdtemp()
     logger.info(f"Temporary directory created at {temporary_dir} for cloning.")
 
-    start_time = time.time() # Start timer for cloning
     try:
-        # Clone the repository
-        logger.info(f"Cloning repository {github_repo_url} to {temporary_dir}...")
-        subprocess.check_call(['git', 'clone', github_repo_url, temporary_dir])
-        clone_duration = time.time() - start_time
-        logger.info(f"Repository cloned successfully in {clone_duration:.2f} seconds.")
+        # Clone the repository through the local mirror cache
+        clone_repository(github_repo_url, temporary_dir, logger)
 
         # Return the paths to the cloned repo and the JSON file for later use
         return temporary_dir
@@ -4,13 +4,40 @@ import time
 import argparse
 import RefactoringRunner
 import sys
-from DeveloperEffort import collect_refactoring_developer_effort
+from concurrent.futures import ThreadPoolExecutor
+from CloneProfiles import CLONE_PROFILES
+from DeveloperEffort import TLOC_MODES, collect_refactoring_developer_effort
 from LoggerManager import get_logger
-from GetBugIssueData import main as issue_data
-from GetBugIssueDataJira import main as issue_data_jira
+from ColumnarExport import import_pyarrow, export_commit_diffs, export_developer_effort, export_github_issues, export_jira_issues, export_refactorings
+from GetBugIssueData import main as issue_data, get_output_file_path as get_issue_output_file_path
+from GetBugIssueDataJira import main as issue_data_jira, resolve_project_keys
 from ProduceUniqueRepos import main as get_unique_repos
-from GetGitDiff import get_commit_diff
+from GetGitDiff import DIFF_BACKENDS, get_commit_diff
+from DiffStore import DEFAULT_EXTENSION as DIFF_STORE_EXTENSION
 from RepositoryCloner import main as clone_repository
+from Scheduler import DEFAULT_STAGE_LIMITS, get_default_memory_budget_mb, run_repositories, stage
+from ShardPipeline import ShardPipeline
+from StageCache import StageCache, get_local_head, get_remote_head
+from JobLedger import JobLedger
+import HttpCache
+import Metrics
+import RefactoringMinerWorkers
+
+# Options of a Runner batch, passed on to analyse_repository
+DEFAULT_OPTIONS = {
+    'incremental': False,   # only mine commits newer than the last RefactoringMiner output and only fetch updated issues
+    'tloc_mode': 'trees',   # see DeveloperEffort.TLOC_MODES
+    'miner_shards': 1,      # parallel RefactoringMiner processes per repository
+    'jira_project_keys': {}, # {repository: JIRA project key}, resolved for the whole batch by main
+    'parquet': False,       # also export the outputs as Parquet datasets, see ColumnarExport
+    'diff_backend': 'git',  # see GetGitDiff.DIFF_BACKENDS
+    'diff_workers': 1,      # processes extracting the commit diffs of a repository
+    'stage_cache': True,    # skip stages whose inputs did not change since their last run, see StageCache
+    'stage_retries': 2,     # further attempts of a failed stage, with exponential backoff, see JobLedger
+    'clone_profile': 'auto', # 'auto' or one of CloneProfiles.CLONE_PROFILES, see select_clone_profile
+    'persistent_miner': False, # mine on warm RefactoringMiner JVMs kept by every worker process, see RefactoringMinerWorkers
+    'metrics_path': None    # stage spans are appended to this file, see Metrics. Set by main for every batch.
+}
 
 def get_unique_repos_list():
     repositoriesInfoFilePath = get_unique_repos() # step a)
@@ -26,14 +53,34 @@ def remove_cloned_repository(cloned_repo_path, refactoring_runner_logger):
     shutil.rmtree(cloned_repo_path, ignore_errors=True)
     refactoring_runner_logger.info(f"Repository at {cloned_repo_path} deleted.")
 
-def run_refactoring_miner(repository, refactoring_runner_logger):
+def select_clone_profile(stages, options):
+    """
+    Return the cheapest clone profile that serves the given stages, or None if none of them needs a clone.
+    """
+    if not stages:
+        return None
+    if options['clone_profile'] != 'auto':
+        return options['clone_profile']
+    if 'developer_effort' in stages and options['tloc_mode'] == 'checkout':
+        return 'sparse'       # scc runs on checkouts of every refactoring commit, only counted files are needed
+    if 'refactoring_miner' in stages:
+        return 'no_checkout'  # RefactoringMiner reads every commit through JGit, which cannot fetch missing blobs
+    return 'blobless'         # the diff and tree line counts only read the blobs of the refactoring commits
+
+def run_refactoring_miner(repository, refactoring_runner_logger, incremental=False, shard_count=1, clone_profile='full', shard_pipeline=None):
     start = time.time()
-    cloned_repo_path, refminer_output_path = RefactoringRunner.main(repository, refactoring_runner_logger)            # step b) and c)
+    on_shard_output = None
+    if shard_pipeline:
+        shard_pipeline.reset()
+        on_shard_output = shard_pipeline.on_shard_output
+    cloned_repo_path, refminer_output_path, complete = RefactoringRunner.main(repository, refactoring_runner_logger, incremental, shard_count, clone_profile, on_shard_output)  # step b) and c)
+    if not (cloned_repo_path and refminer_output_path):
+        raise RuntimeError("Failed to clone the repository or generate RefactoringMiner output.")
 
     end = time.time()
     refactoring_runner_logger.info(f'ran: {repository} elapsed: {end - start:.2f}')
     refactoring_runner_logger.info("RefactoringRunner finished")
-    return cloned_repo_path, refminer_output_path
+    return cloned_repo_path, refminer_output_path, complete
 
 def check_executable_exists(executable, logger):
     from shutil import which
@@ -43,70 +90,262 @@ def check_executable_exists(executable, logger):
     else:
         logger.info(f"{executable} is available.")
 
-def main(user, token, single_repository):
-    user = user
-    token = token
+def get_issue_output_paths(repo_name, project_key):
+    """
+    Return the paths of the GitHub and JIRA issue outputs of a repository, None for those that were not written.
+    """
+    github_issues_path = get_issue_output_file_path(f'{repo_name}.json')
+    jira_issues_path = get_issue_output_file_path(f'jira_{project_key.lower()}.json') if project_key else None
+    return (github_issues_path if os.path.exists(github_issues_path) else None,
+            jira_issues_path if jira_issues_path and os.path.exists(jira_issues_path) else None)
 
-    number_of_repositories_to_analyse = 1
+def fetch_issue_data(user, token, repository, project_key, incremental, logger):
+    """
+    Fetch the GitHub and JIRA issues of a repository. Raises RuntimeError if a fetch failed, so the stage is retried and not recorded as done.
+    """
+    with stage('api'):
+        logger.info("Proceeding to issue data analysis...")
+        if not issue_data(user, token, repository, incremental):
+            raise RuntimeError(f"Fetching the GitHub issues of {repository} failed, see run_results.txt")
 
-    # Loggers
+        if project_key:
+            logger.info(f"Proceeding to JIRA issue data analysis of project {project_key}...")
+            if not issue_data_jira(token, repository, incremental, project_key=project_key):               # step f)
+                raise RuntimeError(f"Fetching the JIRA issues of project {project_key} failed, see run_results.txt")
+        else:
+            logger.info("No matching JIRA project, skipping JIRA issue data analysis.")
+
+def export_columnar_outputs(repo_name, refminer_output_path, commit_diff_path, output_csv_path, project_key, logger):
+    """
+    Export the outputs of a repository into the Parquet datasets. Issue outputs are only exported if they were written.
+    """
+    logger.info(f"Exported {export_refactorings(repo_name, refminer_output_path)} refactorings to Parquet")
+    logger.info(f"Exported {export_commit_diffs(repo_name, commit_diff_path)} commit diff rows to Parquet")
+    logger.info(f"Exported {export_developer_effort(repo_name, output_csv_path)} developer effort rows to Parquet")
+
+    github_issues_path, jira_issues_path = get_issue_output_paths(repo_name, project_key)
+    if github_issues_path:
+        logger.info(f"Exported {export_github_issues(repo_name, github_issues_path)} GitHub issues to Parquet")
+    if jira_issues_path:
+        logger.info(f"Exported {export_jira_issues(repo_name, jira_issues_path)} JIRA issues to Parquet")
+
+def analyse_repository(repository, user, token, options):
+    """
+    Run every analysis step for a single repository. Returns True if the repository was analysed.
+    See DEFAULT_OPTIONS for the supported options. Stages whose inputs did not change since their
+    last run are skipped, see StageCache; the repository is only cloned if a stage needs it.
+    Every stage that runs is recorded in the JobLedger and retried when it fails.
+    """
+    if options['metrics_path']:
+        Metrics.configure(options['metrics_path']) # worker processes append to the file of the batch
+    # One JVM per shard, kept between the repositories the process analyses
+    RefactoringMinerWorkers.configure(max(1, options['miner_shards']) if options['persistent_miner'] else 0)
+    with Metrics.span('repository', repository):
+        return analyse_repository_stages(repository, user, token, options)
+
+def analyse_repository_stages(repository, user, token, options):
     refactoring_runner_logger = get_logger("RefactoringRunner")
+    refactoring_runner_logger.info(repository)
+    stage_cache = StageCache(enabled=options['stage_cache'])
+    ledger = JobLedger()
+    ledger.start(repository)
 
-    # Check if scc is available
-    check_executable_exists('scc', refactoring_runner_logger)
+    def run_stage(stage_name, function, *args):
+        with Metrics.span(stage_name, repository):
+            return ledger.run_stage(repository, stage_name, function, *args, retries=options['stage_retries'], logger=refactoring_runner_logger)
 
-    repos_list = get_unique_repos_list()                                                                                      # step a)
+    issue_executor = ThreadPoolExecutor(max_workers=1)
+    shard_pipeline = None
+    cloned_repo_path = None
+    try:
+        # Issues change independently of the repository and are always refreshed. They do not need the
+        # clone, so they are fetched while the other stages run. Unchanged pages are answered from the
+        # HTTP cache with 304 Not Modified.
+        project_key = options['jira_project_keys'].get(repository)
+        issue_future = issue_executor.submit(Metrics.bind_spans(run_stage), 'issues', fetch_issue_data, user, token, repository, project_key, options['incremental'], refactoring_runner_logger)
 
-    repositories_analysed = 0
+        repo_name = repository.split('/')[-1]
+        output_csv_path = os.path.join('DeveloperEffortOutputs', f'developer_effort_{repo_name}.csv')
+        commit_diff_path = f'CommitDifferencesOutput/{repo_name}{DIFF_STORE_EXTENSION}'
+        streamed = False
+        head_commit = get_remote_head(repository) if stage_cache.enabled else None
 
-    for repository in repos_list:
-        if(single_repository is not None and repository != single_repository):
-            continue
+        # The persistent JVMs write the output with their own driver, so their outputs are cached apart from the launcher's
+        refminer_params = {'persistent_miner': options['persistent_miner']}
+        refminer_key = stage_cache.get_key('refactoring_miner', repository, head_commit, refminer_params, tools=('refactoring_miner',))
+        cached_outputs = stage_cache.get_outputs(repository, 'refactoring_miner', refminer_key)
+        if cached_outputs:
+            refactoring_runner_logger.info(f"RefactoringMiner output of {head_commit} is up to date, skipping RefactoringMiner.")
+            refminer_output_path = cached_outputs[0]
+        else:
+            # The diff and effort stages almost always rerun after RefactoringMiner and share its clone
+            clone_profile = select_clone_profile(('refactoring_miner', 'commit_diff', 'developer_effort'), options)
+            # With several shards, the diff and effort stages start on each shard as soon as it is mined
+            if options['miner_shards'] > 1:
+                shard_pipeline = ShardPipeline(commit_diff_path, output_csv_path, options['diff_backend'], options['diff_workers'], options['tloc_mode'], repository)
+            cloned_repo_path, refminer_output_path, complete = run_stage('refactoring_miner', run_refactoring_miner, repository, refactoring_runner_logger, options['incremental'], options['miner_shards'], clone_profile, shard_pipeline) # step b) and c)
+            head_commit = get_local_head(cloned_repo_path)
+            refminer_key = stage_cache.get_key('refactoring_miner', repository, head_commit, refminer_params, tools=('refactoring_miner',))
+            # An output that misses other branches than HEAD is not cached, so the next run mines the whole history again
+            if complete:
+                stage_cache.store(repository, 'refactoring_miner', refminer_key, [refminer_output_path])
 
-        refactoring_runner_logger.info(repository)
+            if shard_pipeline:
+                try:
+                    with Metrics.span('shard_analysis', repository):
+                        streamed = ledger.run_stage(repository, 'shard_analysis', shard_pipeline.assemble)
+                except Exception as e:
+                    refactoring_runner_logger.warning(f"Analysis of the RefactoringMiner shards failed, analysing the merged output instead: {e}")
+                shard_pipeline.close()
 
-        try:
-            cloned_repo_path, refminer_output_path = run_refactoring_miner(repository, refactoring_runner_logger)            # step b) and c)
+        # The diff and effort stages read the RefactoringMiner output, so they rerun whenever it changes
+        diff_key = stage_cache.get_key('commit_diff', repository, head_commit, {'format': DIFF_STORE_EXTENSION}, [refminer_output_path], ('git',))
+        effort_tool = 'scc' if options['tloc_mode'] == 'checkout' else 'git'
+        effort_key = stage_cache.get_key('developer_effort', repository, head_commit, {'tloc_mode': options['tloc_mode']}, [refminer_output_path], (effort_tool,))
+        if streamed:
+            refactoring_runner_logger.info("Commit differences and developer effort were analysed from the RefactoringMiner shards.")
+            stage_cache.store(repository, 'commit_diff', diff_key, [commit_diff_path])
+            stage_cache.store(repository, 'developer_effort', effort_key, [output_csv_path])
+        run_diff = not stage_cache.get_outputs(repository, 'commit_diff', diff_key)
+        run_effort = not stage_cache.get_outputs(repository, 'developer_effort', effort_key)
+        clone_profile = select_clone_profile([stage_name for stage_name, run in (('commit_diff', run_diff), ('developer_effort', run_effort)) if run], options)
+        if clone_profile and cloned_repo_path is None:
+            cloned_repo_path = run_stage('clone', RefactoringRunner.clone_to_temporary_directory, repository, refactoring_runner_logger, clone_profile)
 
-            repositories_analysed += 1
+        if run_diff:
+            refactoring_runner_logger.info("Proceeding to commit difference analysis...")
+            run_stage('commit_diff', get_commit_diff, cloned_repo_path, commit_diff_path, refminer_output_path, options['diff_backend'], options['diff_workers']) # step d)
+            stage_cache.store(repository, 'commit_diff', diff_key, [commit_diff_path])
+        else:
+            refactoring_runner_logger.info("Commit differences are up to date, skipping commit difference analysis.")
+
+        if run_effort:
+            refactoring_runner_logger.info("Proceeding to developer effort analysis...")
+            run_stage('developer_effort', collect_refactoring_developer_effort, cloned_repo_path, refminer_output_path, output_csv_path, options['tloc_mode']) # step e)
+            stage_cache.store(repository, 'developer_effort', effort_key, [output_csv_path])
+        else:
+            refactoring_runner_logger.info("Developer effort is up to date, skipping developer effort analysis.")
+
+        issue_future.result()
 
-            # If both the repo and refactoring output are available, run DeveloperEffort analysis
-            if cloned_repo_path and refminer_output_path:
-
-                repo_name = repository.split('/')[-1]
-                output_csv_path = os.path.join('DeveloperEffortOutputs', f'developer_effort_{repo_name}.csv')
-
-                refactoring_runner_logger.info("Proceeding to commit difference analysis...")
-                get_commit_diff(cloned_repo_path, f'CommitDifferencesOutput/{repo_name}.json', refminer_output_path)          # step d)      
-                
-                refactoring_runner_logger.info("Proceeding to developer effort analysis...")
-                collect_refactoring_developer_effort(cloned_repo_path, refminer_output_path, output_csv_path)                 # step e)
-                
-                refactoring_runner_logger.info("Proceeding to issue data analysis...")
-                issue_data(user, token, repository)
-                
-                project_key = repo_name.lower() 
-                refactoring_runner_logger.info("Proceeding to JIRA issue data analysis...")
-                issue_data_jira(token, project_key)                                                                           # step f)
-
-                remove_cloned_repository(cloned_repo_path, refactoring_runner_logger)
+        if options['parquet']:
+            export_inputs = [refminer_output_path, commit_diff_path, output_csv_path, *filter(None, get_issue_output_paths(repo_name, project_key))]
+            export_key = stage_cache.get_key('parquet', repository, head_commit, input_paths=export_inputs)
+            if stage_cache.get_outputs(repository, 'parquet', export_key) is None:
+                refactoring_runner_logger.info("Proceeding to Parquet export...")
+                run_stage('parquet', export_columnar_outputs, repo_name, refminer_output_path, commit_diff_path, output_csv_path, project_key, refactoring_runner_logger)
+                stage_cache.store(repository, 'parquet', export_key, [])
             else:
-                refactoring_runner_logger.error("Failed to clone the repository or generate RefactoringMiner output.")
-            print(f'{repositories_analysed} / {len(repos_list)}')
+                refactoring_runner_logger.info("Parquet export is up to date, skipping Parquet export.")
 
-        except Exception as e:
-            refactoring_runner_logger.error(f"An error occurred while processing {repository}: {e}", exc_info=True)
+        ledger.finish(repository)
+        return True
 
-        if repositories_analysed >= number_of_repositories_to_analyse:
-            break
+    except Exception as e:
+        refactoring_runner_logger.error(f"An error occurred while processing {repository}: {e}", exc_info=True)
+        ledger.finish(repository, error=str(e) or type(e).__name__)
+
+    finally:
+        issue_executor.shutdown(wait=True)
+        if shard_pipeline:
+            shard_pipeline.close()
+        # Also after a failure, a leftover clone would keep its mirror from being evicted
+        if cloned_repo_path:
+            remove_cloned_repository(cloned_repo_path, refactoring_runner_logger)
+        stage_cache.close()
+        ledger.close()
+
+    return False
+
+def main(user, token, single_repository, workers=1, limit=None, stage_limits=None, options=None, resume=False, pipeline=False, memory_budget=None):
+    user = user
+    token = token
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+
+    # Loggers
+    refactoring_runner_logger = get_logger("RefactoringRunner")
+
+    # Check if scc is available. It is only needed when TLOC is measured on checkouts.
+    if options['tloc_mode'] == 'checkout':
+        check_executable_exists('scc', refactoring_runner_logger)
+
+    # Spans of every stage of the batch, summarised when the batch ends
+    options['metrics_path'] = options['metrics_path'] or Metrics.get_batch_metrics_path()
+    Metrics.configure(options['metrics_path'])
+
+    # Fail before any analysis if the Parquet export was requested without pyarrow
+    if options['parquet']:
+        import_pyarrow()
+
+    repos_list = get_unique_repos_list()                                                                                      # step a)
+    if single_repository is not None:
+        repos_list = [repository for repository in repos_list if repository == single_repository]
+    if limit is not None:
+        repos_list = repos_list[:limit]
+
+    # Resolve the JIRA projects of all repositories at once from the cached project index
+    try:
+        options['jira_project_keys'] = resolve_project_keys(token, repos_list)
+    except Exception as e:
+        refactoring_runner_logger.error(f"Failed to load the JIRA project index, JIRA issue data is skipped: {e}")
+    # The worker processes are forked from here and must not share the cache connection the index lookup opened
+    HttpCache.close_connection()
+
+    # With resume, the repositories the ledger records as done in an earlier run of the batch are skipped
+    ledger = JobLedger()
+    batch = repos_list
+    if resume:
+        repos_list = ledger.resume(batch)
+        refactoring_runner_logger.info(f"Resuming the batch, {len(batch) - len(repos_list)} of {len(batch)} repositories are already done.")
+    else:
+        ledger.reset(batch)
+
+    # One more repository than RefactoringMiner runs is in flight, so the next repository is cloned
+    # and mined while the previous one is analysed
+    if pipeline:
+        stage_limits = dict(stage_limits or {})
+        stage_limits['refactoring_miner'] = min(stage_limits.get('refactoring_miner', DEFAULT_STAGE_LIMITS['refactoring_miner']), workers)
+        workers += 1
+
+    repositories_processed = 0
+    repositories_analysed = 0
+
+    for repository, analysed in run_repositories(repos_list, analyse_repository, (user, token, options), workers, stage_limits, refactoring_runner_logger, memory_budget):
+        repositories_processed += 1
+        if analysed:
+            repositories_analysed += 1
+        print(f'{repositories_processed} / {len(repos_list)}')
 
     refactoring_runner_logger.info(f"Runner finished. Total repositories analyzed: {repositories_analysed}")
+    refactoring_runner_logger.info(f"Repositories of the batch by state: {ledger.get_state_counts(batch)}")
+    ledger.close()
+    Metrics.report(options['metrics_path'], refactoring_runner_logger)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetch GitHub repository information.")
     parser.add_argument("--user", required=True, help="GitHub username")
     parser.add_argument("--token", required=True, help="GitHub access token")
     parser.add_argument("--repo_url", required=False, help="If this parameter is supplied, only that repository is analyzed.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of repositories analysed in parallel.")
+    parser.add_argument("--limit", type=int, required=False, help="Maximum number of repositories to analyse.")
+    parser.add_argument("--clone_jobs", type=int, default=DEFAULT_STAGE_LIMITS['clone'], help="Maximum number of concurrent clones.")
+    parser.add_argument("--miner_jobs", type=int, default=DEFAULT_STAGE_LIMITS['refactoring_miner'], help="Maximum number of concurrent RefactoringMiner runs.")
+    parser.add_argument("--api_jobs", type=int, default=DEFAULT_STAGE_LIMITS['api'], help="Maximum number of repositories fetching issue data concurrently.")
+    parser.add_argument("--incremental", action="store_true", help="Only mine the commits added since the newest RefactoringMiner output of each repository and only fetch the issues updated since the previous issue outputs.")
+    parser.add_argument("--tloc_mode", choices=TLOC_MODES, default=DEFAULT_OPTIONS['tloc_mode'], help="Measure TLOC from the git object store (trees) or by checking out each commit and running scc (checkout).")
+    parser.add_argument("--miner_shards", type=int, default=DEFAULT_OPTIONS['miner_shards'], help="Split the history of each repository into this many commit ranges mined in parallel.")
+    parser.add_argument("--parquet", action="store_true", help="Also export all outputs as Parquet datasets partitioned by repository into ParquetOutputs. Requires pyarrow.")
+    parser.add_argument("--diff_backend", choices=DIFF_BACKENDS, default=DEFAULT_OPTIONS['diff_backend'], help="Extract commit diffs by parsing batched git output (git) or with PyDriller (pydriller).")
+    parser.add_argument("--diff_workers", type=int, default=DEFAULT_OPTIONS['diff_workers'], help="Number of processes extracting the commit diffs of each repository.")
+    parser.add_argument("--no_stage_cache", action="store_true", help="Rerun every stage even if its inputs did not change since the last run.")
+    parser.add_argument("--stage_retries", type=int, default=DEFAULT_OPTIONS['stage_retries'], help="Number of times a failed stage is retried, with exponential backoff.")
+    parser.add_argument("--clone_profile", choices=('auto', *CLONE_PROFILES), default=DEFAULT_OPTIONS['clone_profile'], help="How repositories are cloned. 'auto' picks the cheapest profile that serves the stages that run.")
+    parser.add_argument("--persistent_miner", action="store_true", help="Keep RefactoringMiner JVMs running between repositories instead of starting RefactoringMiner for every repository. Requires Java 11 or newer.")
+    parser.add_argument("--memory_budget", type=int, default=get_default_memory_budget_mb(), help="Memory in MB the RefactoringMiner JVMs of all workers may use at once, 0 for no limit. Defaults to 75%% of the physical memory.")
+    parser.add_argument("--pipeline", action="store_true", help="Run one more repository than --workers, with at most --workers RefactoringMiner runs, so the next repository is cloned and mined while the previous one is analysed.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted batch, skipping the repositories the job ledger records as done.")
     args = parser.parse_args()
 
-    main(args.user, args.token, args.repo_url)
\ No newline at end of file
+    stage_limits = {'clone': args.clone_jobs, 'refactoring_miner': args.miner_jobs, 'api': args.api_jobs}
+    options = {'incremental': args.incremental, 'tloc_mode': args.tloc_mode, 'miner_shards': args.miner_shards, 'parquet': args.parquet, 'diff_backend': args.diff_backend, 'diff_workers': args.diff_workers, 'stage_cache': not args.no_stage_cache, 'stage_retries': args.stage_retries, 'clone_profile': args.clone_profile, 'persistent_miner': args.persistent_miner}
+    main(args.user, args.token, args.repo_url, args.workers, args.limit, stage_limits, options, args.resume, args.pipeline, args.memory_budget or None)
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+# Default number of repositories allowed in each shared stage at the same time. RefactoringMiner is
+# limited by runs instead, a repository mined in shards holds a slot per shard.
+DEFAULT_STAGE_LIMITS = {
+    'clone': 4,                                         # network bound
+    'refactoring_miner': max(1, (os.cpu_count() or 2) // 2),  # CPU / JVM bound
+    'api': 2                                            # rate limited GitHub and JIRA fetchers
+}
+
+# Share of the physical memory the RefactoringMiner JVMs of a batch may reserve at once by default
+DEFAULT_MEMORY_BUDGET_SHARE = 0.75
+
+# Semaphores of the current process, one per stage. Empty when not running under the scheduler.
+stage_semaphores = {}
+# Memory shared by the RefactoringMiner JVMs of all workers, see reserve_memory. None when not limited.
+memory_budget = None
+
+def create_stage_limits(limits):
+    """
+    Create one process-shared semaphore per stage from a {stage: limit} dictionary.
+    """
+    return {stage_name: multiprocessing.BoundedSemaphore(limit) for stage_name, limit in limits.items()}
+
+def get_default_memory_budget_mb():
+    """
+    Return DEFAULT_MEMORY_BUDGET_SHARE of the physical memory in MB, or None where it cannot be read.
+    """
+    try:
+        physical_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError): # not available on Windows
+        return None
+    return int(physical_memory * DEFAULT_MEMORY_BUDGET_SHARE / 1024 ** 2)
+
+def create_memory_budget(budget_mb):
+    """
+    Create a process-shared budget of budget_mb MB, or None for no limit.
+    """
+    if budget_mb is None:
+        return None
+    return {'total': budget_mb, 'available': multiprocessing.Value('i', budget_mb, lock=False),
+            'waiting': multiprocessing.Value('i', 0, lock=False), 'condition': multiprocessing.Condition()}
+
+def init_stage_limits(semaphores, budget=None):
+    """
+    Process pool initializer that installs the shared stage semaphores and memory budget in a worker process.
+    """
+    global stage_semaphores, memory_budget
+    stage_semaphores = semaphores
+    memory_budget = budget
+
+@contextmanager
+def stage(stage_name):
+    """
+    Hold a slot of the given stage for the duration of the block.
+    Stages without a configured limit are not restricted.
+    """
+    semaphore = stage_semaphores.get(stage_name)
+    if semaphore is None:
+        yield
+        return
+    with semaphore:
+        yield
+
+def get_memory_budget_mb():
+    return memory_budget['total'] if memory_budget else None
+
+def acquire_memory(megabytes):
+    """
+    Reserve megabytes of the memory budget, waiting until enough is free, and return the megabytes to pass to release_memory.
+    A reservation larger than the whole budget waits until nothing else is reserved and takes all of it.
+    Nothing is reserved when no budget is configured.
+    """
+    if memory_budget is None:
+        return 0
+    megabytes = min(megabytes, memory_budget['total'])
+    available = memory_budget['available']
+    waiting = memory_budget['waiting']
+    with memory_budget['condition']:
+        if available.value < megabytes:
+            waiting.value += 1 # lets holders of idle reservations give them up, see is_memory_awaited
+            try:
+                memory_budget['condition'].wait_for(lambda: available.value >= megabytes)
+            finally:
+                waiting.value -= 1
+        available.value -= megabytes
+    return megabytes
+
+def release_memory(megabytes):
+    if memory_budget is None or not megabytes:
+        return
+    with memory_budget['condition']:
+        memory_budget['available'].value += megabytes
+        memory_budget['condition'].notify_all()
+
+def is_memory_awaited():
+    """
+    Return True while a process waits for memory of the budget.
+    """
+    return memory_budget is not None and memory_budget['waiting'].value > 0
+
+@contextmanager
+def reserve_memory(megabytes):
+    """
+    Hold megabytes of the memory budget for the duration of the block, see acquire_memory.
+    """
+    megabytes = acquire_memory(megabytes)
+    try:
+        yield
+    finally:
+        release_memory(megabytes)
+
+def run_repositories(repositories, worker, worker_args=(), workers=1, stage_limits=None, logger=None, memory_budget_mb=None):
+    """
+    Run worker(repository, *worker_args) for every repository, at most `workers` at once,
+    and yield (repository, result) pairs in completion order. The RefactoringMiner JVMs of all
+    workers reserve their memory from a budget of memory_budget_mb MB, see reserve_memory.
+    """
+    budget = create_memory_budget(memory_budget_mb)
+    if workers <= 1:
+        init_stage_limits({}, budget) # the shards of a repository still share the budget
+        for repository in repositories:
+            yield repository, worker(repository, *worker_args)
+        return
+
+    limits = dict(DEFAULT_STAGE_LIMITS)
+    limits.update(stage_limits or {})
+    semaphores = create_stage_limits(limits)
+    if logger:
+        logger.info(f"Scheduling {len(repositories)} repositories on {workers} workers with stage limits {limits} and a memory budget of {memory_budget_mb} MB")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_stage_limits, initargs=(semaphores, budget)) as executor:
+        futures = {executor.submit(worker, repository, *worker_args): repository for repository in repositories}
+        for future in as_completed(futures):
+            repository = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                if logger:
+                    logger.error(f"Worker for {repository} failed: {e}", exc_info=True)
+                result = None
+            yield repository, result
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from DeveloperEffort import collect_refactoring_developer_effort, merge_developer_effort
+from GetGitDiff import get_commit_diff, merge_commit_diffs
+from Metrics import bind_spans, span
+
+class ShardPipeline:
+    """
+    Runs the commit diff and developer effort stages on the output of every RefactoringMiner shard as soon
+    as the shard finishes, while the remaining shards are still being mined. Each shard produces part
+    files, which assemble() combines into the same outputs the stages would write from the merged output.
+    Pass on_shard_output to RefactoringRunner.main. Each shard is analysed in a shard_analysis span of
+    repository, inside the spans open when the pipeline was created.
+    """
+    def __init__(self, commit_diff_path, output_csv_path, diff_backend='git', diff_workers=1, tloc_mode='trees', repository=None):
+        self.commit_diff_path = commit_diff_path
+        self.output_csv_path = output_csv_path
+        self.diff_backend = diff_backend
+        self.diff_workers = diff_workers
+        self.tloc_mode = tloc_mode
+        self.repository = repository
+        self.analyse_shard_in_spans = bind_spans(self.analyse_shard)
+        self.parts_dir = tempfile.mkdtemp()
+        self.executor = ThreadPoolExecutor(max_workers=1) # shards are analysed one at a time, the JVMs use the other cores
+        self.futures = []
+        self.parts = {} # shard index -> (commit diff part, developer effort part)
+        self.repo_dir = None
+
+    def reset(self):
+        """
+        Forget the parts of a previous attempt, so a retried RefactoringMiner run starts from scratch.
+        """
+        for future in self.futures:
+            future.exception() # waits without raising
+        self.futures = []
+        self.parts = {}
+
+    def on_shard_output(self, repo_dir, index, shard_output):
+        self.repo_dir = repo_dir
+        future = self.executor.submit(self.analyse_shard_in_spans, repo_dir, index, shard_output)
+        self.futures.append(future)
+        return future
+
+    def analyse_shard(self, repo_dir, index, shard_output):
+        commit_diff_part = os.path.join(self.parts_dir, f'shard_{index}.jsonl')
+        output_csv_part = os.path.join(self.parts_dir, f'shard_{index}.csv')
+        with span('shard_analysis', self.repository):
+            get_commit_diff(repo_dir, commit_diff_part, shard_output, self.diff_backend, self.diff_workers)
+            collect_refactoring_developer_effort(repo_dir, shard_output, output_csv_part, self.tloc_mode)
+        self.parts[index] = (commit_diff_part, output_csv_part)
+
+    def assemble(self):
+        """
+        Wait for the analysis of every shard and write the outputs. Returns False when no shard was
+        streamed, for example when the history was too short to shard, and the stages have to run as usual.
+        """
+        for future in self.futures:
+            future.result()
+        if not self.parts:
+            return False
+        parts = [self.parts[index] for index in sorted(self.parts)] # newest range first, like the merged output
+        merge_commit_diffs(self.repo_dir, [commit_diff_part for commit_diff_part, _ in parts], self.commit_diff_path)
+        merge_developer_effort([output_csv_part for _, output_csv_part in parts], self.output_csv_path)
+        return True
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
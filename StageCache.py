@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+from RefactoringRunner import REFACTORING_MINER_DIR
+
+# Manifest of the outputs of every completed stage, shared by all Runner batches on this machine
+STAGE_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Cache', 'stage_cache.sqlite')
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Scripts whose source is part of the key of each stage, so changing a script reruns its stage
+STAGE_SCRIPTS = {
+    'refactoring_miner': ('RefactoringRunner.py', 'RefactoringMinerShards.py', 'RefactoringMinerOutput.py', 'RefactoringMinerWorkers.py',
+                          os.path.join('RefactoringMinerWorker', 'RefactoringMinerWorker.java'), 'MinerMemory.py'),
+    'commit_diff': ('GetGitDiff.py', 'DiffStore.py'),
+    'developer_effort': ('DeveloperEffort.py', 'LocCounter.py'),
+    'parquet': ('ColumnarExport.py', 'DiffStore.py')
+}
+
+# Commands printing the version of the external tools a stage can depend on
+TOOL_VERSION_COMMANDS = {
+    'git': ['git', '--version'],
+    'scc': ['scc', '--version']
+}
+
+script_hashes = {}
+tool_versions = {}
+
+def get_remote_head(repository_url):
+    """
+    Return the commit HEAD points to in a remote repository without cloning it, or None if it cannot be read.
+    """
+    try:
+        output = subprocess.check_output(['git', 'ls-remote', repository_url, 'HEAD'], universal_newlines=True, timeout=120)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    return output.split()[0] if output.strip() else None
+
+def get_local_head(repo_path):
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_path, universal_newlines=True).strip()
+
+def get_script_hash(stage_name):
+    if stage_name not in script_hashes:
+        digest = hashlib.sha256()
+        for script in STAGE_SCRIPTS.get(stage_name, ()):
+            with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), script), 'rb') as file:
+                digest.update(file.read())
+        script_hashes[stage_name] = digest.hexdigest()
+    return script_hashes[stage_name]
+
+def get_tool_version(tool):
+    if tool == 'refactoring_miner':
+        return REFACTORING_MINER_DIR
+    if tool not in tool_versions:
+        try:
+            tool_versions[tool] = subprocess.check_output(TOOL_VERSION_COMMANDS[tool], universal_newlines=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            tool_versions[tool] = None # the tool is not installed
+    return tool_versions[tool]
+
+def get_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class StageCache:
+    """
+    Records the outputs of completed stages under a key built from the repository URL, its HEAD commit,
+    the stage parameters, the version of the stage's tool and scripts, and the checksums of the stage's
+    input files. A stage whose key matches a record with unchanged outputs does not need to run again.
+    Stages that read the outputs of another stage take their checksums as inputs, so rerunning a stage
+    with different results invalidates everything downstream of it.
+    """
+    def __init__(self, path=STAGE_CACHE_PATH, enabled=True):
+        self.enabled = enabled
+        self.checksums = {} # path -> (size, mtime, checksum) of files checksummed by this process
+        if not enabled:
+            return # every stage runs and nothing is recorded
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL') # parallel Runner workers share the file
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS stage_results (
+                repository TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (repository, stage)
+            )''')
+        self.connection.commit()
+
+    def get_file_checksum(self, path):
+        """
+        Return the checksum of a file, reusing the last one computed for it while its size and mtime are unchanged.
+        """
+        status = os.stat(path)
+        cached = self.checksums.get(path)
+        if cached and cached[:2] == (status.st_size, status.st_mtime_ns):
+            return cached[2]
+        checksum = get_checksum(path)
+        self.checksums[path] = (status.st_size, status.st_mtime_ns, checksum)
+        return checksum
+
+    def get_key(self, stage_name, repository, head_commit, params=None, input_paths=(), tools=()):
+        """
+        Return the key of a stage run, or None when the HEAD commit or the version of one of the tools is unknown.
+        tools are 'refactoring_miner' or names from TOOL_VERSION_COMMANDS.
+        """
+        if not self.enabled:
+            return None
+        versions = {tool: get_tool_version(tool) for tool in tools}
+        if head_commit is None or None in versions.values():
+            return None
+        key = {
+            'stage': stage_name,
+            'repository': repository,
+            'head': head_commit,
+            'tools': versions,
+            'scripts': get_script_hash(stage_name),
+            'params': params or {},
+            'inputs': [self.get_file_checksum(path) for path in input_paths] # by content, dated file names do not matter
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_outputs(self, repository, stage_name, key):
+        """
+        Return the output paths recorded for key, or None when the stage has to run: it was never
+        recorded with this key, or one of its outputs was deleted or modified since.
+        """
+        if key is None:
+            return None
+        row = self.connection.execute(
+            'SELECT key, outputs FROM stage_results WHERE repository = ? AND stage = ?', (repository, stage_name)).fetchone()
+        if row is None or row[0] != key:
+            return None
+        outputs = json.loads(row[1])
+        for path, recorded in outputs.items():
+            if not os.path.exists(path):
+                return None
+            status = os.stat(path)
+            # The recorded size and mtime spare re-reading large outputs that were not touched
+            if [status.st_size, status.st_mtime_ns] != recorded[:2] and self.get_file_checksum(path) != recorded[2]:
+                return None
+        return list(outputs)
+
+    def store(self, repository, stage_name, key, output_paths):
+        """
+        Record the outputs of a completed stage run.
+        """
+        if key is None:
+            return
+        outputs = {}
+        for path in output_paths:
+            status = os.stat(path)
+            outputs[path] = [status.st_size, status.st_mtime_ns, self.get_file_checksum(path)]
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO stage_results VALUES (?, ?, ?, ?, ?)',
+                                    (repository, stage_name, key, json.dumps(outputs), time.time()))
+
+    def invalidate(self, repository, stage_name=None):
+        """
+        Forget the recorded outputs of one stage, or of all stages of a repository.
+        """
+        if not self.enabled:
+            return
+        with self.connection:
+            if stage_name is None:
+                self.connection.execute('DELETE FROM stage_results WHERE repository = ?', (repository,))
+            else:
+                self.connection.execute('DELETE FROM stage_results WHERE repository = ? AND stage = ?', (repository, stage_name))
+
+    def close(self):
+        if self.enabled:
+            self.connection.close()
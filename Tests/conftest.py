@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, REPOSITORY_ROOT)
+sys.path.insert(0, os.path.join(REPOSITORY_ROOT, 'Benchmarks'))
+
+from RefactoringMinerOutput import iter_commits, write_commits
+from SyntheticRepository import REPOSITORY_PRESETS, ensure_synthetic_repository
+
+# Small enough to generate in a second, with renames and moves so the diff backends see more than modifications
+TEST_REPOSITORY_PARAMETERS = {**REPOSITORY_PRESETS['small'], 'commits': 60, 'files': 30, 'rename_rate': 0.1}
+
+@pytest.fixture(scope='session')
+def synthetic_repository(tmp_path_factory):
+    """
+    (repository path, RefactoringMiner output path) of a synthetic repository shared by the tests of a run.
+    Tests must not modify it.
+    """
+    return ensure_synthetic_repository(TEST_REPOSITORY_PARAMETERS, output_dir=str(tmp_path_factory.mktemp('repositories')))
+
+class FakeRefactoringMiner:
+    """
+    Stands in for the RefactoringMiner runs of RefactoringRunner. Like RefactoringMiner, it lists every non-merge
+    commit but the root commit, newest first, with the refactorings of the synthetic output. Runs are recorded
+    in calls as ('all', None, None), ('range', start, end) or ('shards', start, end).
+    """
+    def __init__(self, refactorings_by_commit):
+        self.refactorings_by_commit = refactorings_by_commit
+        self.calls = []
+
+    def write_output(self, repo_dir, revisions, json_output_file):
+        output = subprocess.check_output(['git', 'rev-list', '--no-merges', '--parents', *revisions], cwd=repo_dir, universal_newlines=True)
+        commits = [line.split()[0] for line in output.splitlines() if len(line.split()) > 1]
+        write_commits(({'repository': 'https://github.com/test/test.git', 'sha1': commit, 'url': f'https://github.com/test/test/commit/{commit}',
+                        'refactorings': self.refactorings_by_commit.get(commit, [])} for commit in commits), json_output_file)
+
+    def run_job(self, refactoringminer_path, repo_dir, json_output_file, logger, start_commit=None, end_commit=None):
+        if start_commit:
+            self.calls.append(('range', start_commit, end_commit))
+            self.write_output(repo_dir, [f'{start_commit}..{end_commit}'], json_output_file)
+        else:
+            self.calls.append(('all', None, None))
+            self.write_output(repo_dir, ['--all'], json_output_file)
+
+    def run_shards(self, refactoringminer_path, repo_dir, json_output_file, logger, shard_count, start_commit=None, end_commit='HEAD', on_shard_output=None):
+        self.calls.append(('shards', start_commit, end_commit))
+        self.write_output(repo_dir, ['--first-parent', f'{start_commit}..{end_commit}' if start_commit else end_commit], json_output_file)
+        return True
+
+@pytest.fixture
+def fake_refactoring_miner(monkeypatch, synthetic_repository):
+    import RefactoringRunner
+    _, output_path = synthetic_repository
+    fake = FakeRefactoringMiner({commit['sha1']: commit['refactorings'] for commit in iter_commits(output_path)})
+    monkeypatch.setattr(RefactoringRunner, 'run_refactoring_miner_job', fake.run_job)
+    monkeypatch.setattr(RefactoringRunner, 'run_sharded_refactoring_miner', fake.run_shards)
+    return fake
+
+@pytest.fixture
+def repository_clone(tmp_path, synthetic_repository):
+    """
+    A clone of the synthetic repository that tests may add commits and branches to.
+    """
+    repo_path, _ = synthetic_repository
+    clone_path = str(tmp_path / 'clone')
+    subprocess.check_call(['git', 'clone', '--quiet', '--shared', repo_path, clone_path])
+    return clone_path
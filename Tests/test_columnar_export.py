@@ -0,0 +1,35 @@
+import pytest
+
+from ColumnarExport import REFACTORINGS, export_refactorings, read_dataset
+from RefactoringMinerOutput import iter_commits, write_commits
+
+pytest.importorskip('pyarrow')
+
+def count_rows(output_dir, repository):
+    return read_dataset(REFACTORINGS, columns=['repository'], filters=[('repository', '=', repository)], output_dir=output_dir).num_rows
+
+@pytest.fixture
+def refactoring_count(synthetic_repository):
+    _, output_path = synthetic_repository
+    return sum(len(commit['refactorings']) for commit in iter_commits(output_path))
+
+def test_a_re_export_replaces_the_partition(tmp_path, synthetic_repository, refactoring_count):
+    _, output_path = synthetic_repository
+    output_dir = str(tmp_path / 'parquet')
+    assert export_refactorings('synthetic', output_path, output_dir) == refactoring_count
+    assert export_refactorings('synthetic', output_path, output_dir) == refactoring_count
+
+    assert count_rows(output_dir, 'synthetic') == refactoring_count
+
+@pytest.mark.parametrize('repository', ['synthetic', 'synthetic repository/with%special'])
+def test_an_empty_re_export_removes_the_stale_partition(tmp_path, synthetic_repository, refactoring_count, repository):
+    _, output_path = synthetic_repository
+    output_dir = str(tmp_path / 'parquet')
+    empty_output_path = str(tmp_path / 'empty.json')
+    write_commits([], empty_output_path)
+    export_refactorings(repository, output_path, output_dir)
+    export_refactorings('other', output_path, output_dir)
+
+    assert export_refactorings(repository, empty_output_path, output_dir) == 0
+    assert count_rows(output_dir, repository) == 0
+    assert count_rows(output_dir, 'other') == refactoring_count
@@ -0,0 +1,53 @@
+import subprocess
+
+import pytest
+
+from DiffStore import iter_commit_diffs
+from GetGitDiff import (get_commit_diff, get_refactorings, iter_git_commit_diffs, iter_parallel_commit_diffs,
+                        iter_pydriller_commit_diffs)
+
+pytest.importorskip('pydriller')
+
+def read_diff_store(path, expand=False):
+    return list(iter_commit_diffs(path, expand))
+
+def test_git_and_pydriller_backends_yield_the_same_records(synthetic_repository):
+    repo_path, output_path = synthetic_repository
+    commit_hashes = get_refactorings(output_path)
+
+    git_diffs = list(iter_git_commit_diffs(repo_path, commit_hashes))
+    assert git_diffs
+    assert git_diffs == list(iter_pydriller_commit_diffs(repo_path, commit_hashes))
+
+@pytest.mark.parametrize('extension', ['.json', '.jsonl', '.jsonl.gz'])
+def test_git_and_pydriller_backends_write_the_same_diff_store(tmp_path, synthetic_repository, extension):
+    repo_path, output_path = synthetic_repository
+    get_commit_diff(repo_path, str(tmp_path / f'git{extension}'), output_path, backend='git')
+    get_commit_diff(repo_path, str(tmp_path / f'pydriller{extension}'), output_path, backend='pydriller')
+
+    assert read_diff_store(str(tmp_path / f'git{extension}'), expand=True) == read_diff_store(str(tmp_path / f'pydriller{extension}'), expand=True)
+
+@pytest.mark.parametrize('iter_commit_diffs_of_backend', [iter_git_commit_diffs, iter_pydriller_commit_diffs])
+def test_backends_skip_the_root_commit(synthetic_repository, iter_commit_diffs_of_backend):
+    repo_path, _ = synthetic_repository
+    commits = subprocess.check_output(['git', 'rev-list', '--reverse', 'HEAD'], cwd=repo_path, universal_newlines=True).split()
+
+    commit_diffs = list(iter_commit_diffs_of_backend(repo_path, commits[:3]))
+    assert [commit_diff['commit_hash'] for commit_diff in commit_diffs] == commits[1:3]
+
+@pytest.mark.parametrize('backend', ['git', 'pydriller'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_parallel_extraction_yields_the_sequential_records_in_order(synthetic_repository, backend, chunk_size):
+    repo_path, output_path = synthetic_repository
+    commit_hashes = get_refactorings(output_path)
+
+    sequential_diffs = list(iter_git_commit_diffs(repo_path, commit_hashes))
+    assert list(iter_parallel_commit_diffs(repo_path, commit_hashes, backend, workers=2, chunk_size=chunk_size)) == sequential_diffs
+
+@pytest.mark.parametrize('backend', ['git', 'pydriller'])
+def test_parallel_extraction_writes_the_sequential_diff_store(tmp_path, synthetic_repository, backend):
+    repo_path, output_path = synthetic_repository
+    get_commit_diff(repo_path, str(tmp_path / 'sequential.jsonl'), output_path, backend=backend)
+    get_commit_diff(repo_path, str(tmp_path / 'parallel.jsonl'), output_path, backend=backend, workers=3)
+
+    assert (tmp_path / 'sequential.jsonl').read_bytes() == (tmp_path / 'parallel.jsonl').read_bytes()
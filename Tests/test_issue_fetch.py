@@ -0,0 +1,70 @@
+import json
+import logging
+
+import pytest
+
+import GetBugIssueData
+import GetBugIssueDataJira
+import HttpCache
+from MockIssueServer import MockIssueServer, generate_github_issues, generate_jira_issues
+from Runner import fetch_issue_data
+from SyntheticRepository import SYNTHETIC_REPOSITORY_URL
+
+JIRA_PROJECT_KEY = 'SYNTHETIC'
+GITHUB_ISSUE_COUNT = 250 # several pages of the GitHub API
+JIRA_ISSUE_COUNT = 120
+
+@pytest.fixture
+def issue_server(tmp_path, monkeypatch):
+    """
+    A mock issue server the fetchers are pointed at, with the outputs and the HTTP cache kept in tmp_path.
+    """
+    monkeypatch.setattr(HttpCache, 'HTTP_CACHE_PATH', str(tmp_path / 'http_cache.sqlite'))
+    monkeypatch.setattr(GetBugIssueData, 'ISSUE_OUTPUT_DIR', str(tmp_path))
+    HttpCache.close_connection()
+    with MockIssueServer(generate_github_issues(GITHUB_ISSUE_COUNT), generate_jira_issues(JIRA_ISSUE_COUNT, JIRA_PROJECT_KEY), JIRA_PROJECT_KEY) as server:
+        monkeypatch.setattr(GetBugIssueData, 'GITHUB_API_URL', server.github_api_url)
+        monkeypatch.setattr(GetBugIssueDataJira, 'SEARCH_URL', f'{server.jira_base_url}search')
+        monkeypatch.setattr(GetBugIssueDataJira, 'PROJECT_URL', f'{server.jira_base_url}project')
+        yield server
+    HttpCache.close_connection()
+
+def load_issues(file_name):
+    with open(GetBugIssueData.get_output_file_path(file_name), 'r') as file:
+        return json.load(file)
+
+def test_github_fetch_writes_every_issue(issue_server):
+    # the issues endpoint lists pull requests too, which are left out
+    issue_count = sum(1 for issue in issue_server.github_issues if 'pull_request' not in issue)
+    assert GetBugIssueData.main('user', 'token', SYNTHETIC_REPOSITORY_URL)
+    assert len(load_issues('synthetic.json')) == issue_count
+
+    # An incremental run merges the updates into the same issues
+    assert GetBugIssueData.main('user', 'token', SYNTHETIC_REPOSITORY_URL, incremental=True)
+    assert len(load_issues('synthetic.json')) == issue_count
+
+def test_jira_fetch_writes_every_issue(issue_server):
+    assert GetBugIssueDataJira.main('token', SYNTHETIC_REPOSITORY_URL, project_key=JIRA_PROJECT_KEY)
+    assert len(load_issues(f'jira_{JIRA_PROJECT_KEY.lower()}.json')) == JIRA_ISSUE_COUNT
+
+def test_a_failed_github_fetch_returns_false(issue_server, monkeypatch):
+    monkeypatch.setattr(GetBugIssueData, 'GITHUB_API_URL', f'{issue_server.url}/missing/')
+
+    assert not GetBugIssueData.main('user', 'token', SYNTHETIC_REPOSITORY_URL)
+
+def test_a_failed_jira_fetch_returns_false(issue_server, monkeypatch):
+    monkeypatch.setattr(GetBugIssueDataJira, 'SEARCH_URL', f'{issue_server.url}/missing/search')
+
+    assert not GetBugIssueDataJira.main('token', SYNTHETIC_REPOSITORY_URL, project_key=JIRA_PROJECT_KEY)
+
+def test_the_issues_stage_fails_when_a_fetch_fails(issue_server, monkeypatch):
+    logger = logging.getLogger('test_issue_fetch')
+    fetch_issue_data('user', 'token', SYNTHETIC_REPOSITORY_URL, JIRA_PROJECT_KEY, False, logger)
+
+    monkeypatch.setattr(GetBugIssueDataJira, 'SEARCH_URL', f'{issue_server.url}/missing/search')
+    with pytest.raises(RuntimeError, match=JIRA_PROJECT_KEY):
+        fetch_issue_data('user', 'token', SYNTHETIC_REPOSITORY_URL, JIRA_PROJECT_KEY, False, logger)
+
+    monkeypatch.setattr(GetBugIssueData, 'GITHUB_API_URL', f'{issue_server.url}/missing/')
+    with pytest.raises(RuntimeError, match='GitHub'):
+        fetch_issue_data('user', 'token', SYNTHETIC_REPOSITORY_URL, None, False, logger)
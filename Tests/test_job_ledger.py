@@ -0,0 +1,100 @@
+import pytest
+
+import JobLedger
+from JobLedger import DONE, FAILED, PENDING, REPOSITORY_STAGE, RUNNING
+
+REPOSITORIES = ['https://github.com/test/first.git', 'https://github.com/test/second.git', 'https://github.com/test/third.git']
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(JobLedger, 'RETRY_BACKOFF', 0)
+    ledger = JobLedger.JobLedger(str(tmp_path / 'job_ledger.sqlite'))
+    yield ledger
+    ledger.close()
+
+def get_row(ledger, repository, stage_name):
+    return ledger.connection.execute('SELECT state, attempts, error FROM jobs WHERE repository = ? AND stage = ?', (repository, stage_name)).fetchone()
+
+def test_resume_skips_done_repositories_and_retries_interrupted_ones(ledger):
+    ledger.reset(REPOSITORIES)
+    ledger.start(REPOSITORIES[0])
+    ledger.finish(REPOSITORIES[0])
+    ledger.start(REPOSITORIES[1]) # interrupted while running
+
+    assert ledger.resume(REPOSITORIES) == REPOSITORIES[1:]
+    assert get_row(ledger, REPOSITORIES[1], REPOSITORY_STAGE) == (FAILED, 1, 'interrupted')
+    assert ledger.get_state_counts(REPOSITORIES) == {DONE: 1, FAILED: 1, PENDING: 1}
+
+def test_resume_adds_repositories_missing_from_the_ledger(ledger):
+    ledger.reset(REPOSITORIES[:1])
+    new_repository = 'https://github.com/test/new.git'
+
+    assert ledger.resume([*REPOSITORIES[:1], new_repository]) == [REPOSITORIES[0], new_repository]
+    assert get_row(ledger, new_repository, REPOSITORY_STAGE) == (PENDING, 0, None)
+
+def test_resume_survives_a_new_ledger_instance(tmp_path):
+    path = str(tmp_path / 'job_ledger.sqlite')
+    ledger = JobLedger.JobLedger(path)
+    ledger.reset(REPOSITORIES)
+    ledger.start(REPOSITORIES[0])
+    ledger.finish(REPOSITORIES[0])
+    ledger.start(REPOSITORIES[1], 'commit_diff')
+    ledger.close()
+
+    ledger = JobLedger.JobLedger(path)
+    assert ledger.resume(REPOSITORIES) == REPOSITORIES[1:]
+    assert get_row(ledger, REPOSITORIES[1], 'commit_diff')[0] == FAILED
+    ledger.close()
+
+def test_run_stage_returns_the_result_of_the_function(ledger):
+    assert ledger.run_stage(REPOSITORIES[0], 'commit_diff', lambda value: value * 2, 21) == 42
+    assert get_row(ledger, REPOSITORIES[0], 'commit_diff') == (DONE, 1, None)
+
+def test_run_stage_retries_until_the_function_succeeds(ledger):
+    calls = []
+    def flaky_stage():
+        calls.append(len(calls))
+        if len(calls) < 3:
+            raise OSError('connection reset')
+        return 'output.json'
+
+    assert ledger.run_stage(REPOSITORIES[0], 'refactoring_miner', flaky_stage, retries=2) == 'output.json'
+    assert len(calls) == 3
+    assert get_row(ledger, REPOSITORIES[0], 'refactoring_miner') == (DONE, 3, None)
+
+def test_run_stage_raises_the_exception_of_the_last_attempt(ledger):
+    calls = []
+    def failing_stage():
+        calls.append(len(calls))
+        raise RuntimeError(f'attempt {len(calls)}')
+
+    with pytest.raises(RuntimeError, match='attempt 2'):
+        ledger.run_stage(REPOSITORIES[0], 'developer_effort', failing_stage, retries=1)
+    assert len(calls) == 2
+    assert get_row(ledger, REPOSITORIES[0], 'developer_effort') == (FAILED, 2, 'attempt 2')
+
+def test_run_stage_does_not_retry_without_retries(ledger):
+    def failing_stage():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        ledger.run_stage(REPOSITORIES[0], 'parquet', failing_stage)
+    assert get_row(ledger, REPOSITORIES[0], 'parquet') == (FAILED, 1, 'ValueError')
+
+def test_running_stages_are_not_counted_as_done(ledger):
+    ledger.reset(REPOSITORIES)
+    ledger.start(REPOSITORIES[0])
+
+    assert ledger.get_state_counts(REPOSITORIES) == {RUNNING: 1, PENDING: 2}
+
+def test_resume_leaves_running_rows_of_other_batches_alone(ledger):
+    other_batch = ['https://github.com/test/other.git']
+    ledger.reset(REPOSITORIES + other_batch)
+    ledger.start(REPOSITORIES[0])
+    ledger.start(other_batch[0])
+    ledger.start(other_batch[0], 'commit_diff')
+
+    assert ledger.resume(REPOSITORIES) == REPOSITORIES
+    assert get_row(ledger, REPOSITORIES[0], REPOSITORY_STAGE)[0] == FAILED
+    assert get_row(ledger, other_batch[0], REPOSITORY_STAGE) == (RUNNING, 1, None)
+    assert get_row(ledger, other_batch[0], 'commit_diff') == (RUNNING, 1, None)
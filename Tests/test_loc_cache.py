@@ -0,0 +1,48 @@
+from LocCache import LocCache
+from LocCounter import TreeLocCounter
+
+def test_lookup_returns_stored_counts_by_blob_and_language(tmp_path):
+    cache = LocCache(str(tmp_path / 'loc_cache.sqlite'))
+    cache.store({('a' * 40, 'Java'): (10, 2, 3), ('b' * 40, 'Python'): (5, 0, 1)})
+
+    assert cache.lookup([('a' * 40, 'Java'), ('b' * 40, 'Python')]) == {('a' * 40, 'Java'): (10, 2, 3), ('b' * 40, 'Python'): (5, 0, 1)}
+    # the same blob counted as another language is another entry
+    assert cache.lookup([('a' * 40, 'Python'), ('c' * 40, 'Java')]) == {}
+    cache.close()
+
+def test_store_keeps_the_first_counts_of_a_blob(tmp_path):
+    cache = LocCache(str(tmp_path / 'loc_cache.sqlite'))
+    cache.store({('a' * 40, 'Java'): (10, 2, 3)})
+    cache.store({('a' * 40, 'Java'): (99, 99, 99)})
+
+    assert cache.lookup([('a' * 40, 'Java')]) == {('a' * 40, 'Java'): (10, 2, 3)}
+    cache.close()
+
+def test_counts_persist_between_instances(tmp_path):
+    path = str(tmp_path / 'loc_cache.sqlite')
+    cache = LocCache(path)
+    cache.store({(f'{index:040x}', 'Java'): (index, 0, 0) for index in range(1200)}) # more than one lookup batch
+    cache.close()
+
+    cache = LocCache(path)
+    keys = [(f'{index:040x}', 'Java') for index in range(1200)]
+    assert cache.lookup(keys) == {key: (int(key[0], 16), 0, 0) for key in keys}
+    cache.close()
+
+def test_tree_loc_counter_uses_cached_blob_counts(tmp_path, synthetic_repository):
+    repo_path, _ = synthetic_repository
+    counted_cache = LocCache(str(tmp_path / 'counted.sqlite'))
+    counter = TreeLocCounter(repo_path, counted_cache)
+    counts = counter.revision_counts('HEAD')
+    counter.close()
+    rows = counted_cache.connection.execute('SELECT blob_sha, language, code, comments, blanks FROM blob_loc').fetchall()
+    assert rows
+
+    # A cache holding doubled counts shows whether the counter read the blobs or the cache
+    doubled_cache = LocCache(str(tmp_path / 'doubled.sqlite'))
+    doubled_cache.store({(blob_sha, language): (code * 2, comments * 2, blanks * 2) for blob_sha, language, code, comments, blanks in rows})
+    counter = TreeLocCounter(repo_path, doubled_cache)
+    assert counter.revision_counts('HEAD') == tuple(count * 2 for count in counts)
+    counter.close()
+    counted_cache.close()
+    doubled_cache.close()
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import Metrics
+
+@pytest.fixture
+def records(monkeypatch):
+    """
+    The spans written by the test, by stage name.
+    """
+    written = {}
+    monkeypatch.setattr(Metrics, 'write_span', lambda record: written.setdefault(record['stage'], record))
+    return written
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+def test_nested_spans_count_the_work_of_the_inner_span(records):
+    with Metrics.span('repository'):
+        Metrics.add('http_requests')
+        with Metrics.span('issues'):
+            Metrics.add('http_requests', 2)
+
+    assert records['repository']['counters'] == {'http_requests': 3}
+    assert records['issues']['counters'] == {'http_requests': 2}
+
+def test_spans_of_other_threads_do_not_see_each_others_work(records):
+    jvm_started = threading.Event()
+    issues_done = threading.Event()
+    def fetch_issues():
+        jvm_started.wait()
+        with Metrics.span('issues'):
+            Metrics.add('http_requests', 5)
+            busy(0.2)
+        issues_done.set()
+
+    thread = threading.Thread(target=fetch_issues)
+    thread.start()
+    with Metrics.span('jvm'):
+        jvm_started.set()
+        issues_done.wait()
+        Metrics.add('jvm_starts')
+    thread.join()
+
+    assert records['jvm']['counters'] == {'jvm_starts': 1}
+    assert records['jvm']['cpu_seconds'] < 0.1
+    assert records['issues']['counters'] == {'http_requests': 5}
+    assert records['issues']['cpu_seconds'] >= 0.2
+
+def test_threads_bound_to_a_span_count_towards_it(records):
+    def fetch_page(page):
+        Metrics.add('http_requests')
+        busy(0.05)
+        return page
+
+    with Metrics.span('issues'):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            assert list(executor.map(Metrics.bind_spans(fetch_page), range(8))) == list(range(8))
+    Metrics.add('http_requests') # outside of every span
+
+    assert records['issues']['counters'] == {'http_requests': 8}
+    assert records['issues']['cpu_seconds'] >= 0.4
+
+def test_subprocess_cpu_time_is_unknown_for_spans_next_to_unrelated_spans(records):
+    jvm_started = threading.Event()
+    def fetch_issues():
+        jvm_started.wait()
+        with Metrics.span('issues'):
+            pass
+
+    with Metrics.span('repository'):
+        with Metrics.span('clone'):
+            pass
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            issues = executor.submit(Metrics.bind_spans(fetch_issues)) # like Runner, next to the RefactoringMiner stage
+            with Metrics.span('jvm'):
+                jvm_started.set()
+                issues.result()
+
+    assert records['clone']['children_cpu_seconds'] is not None
+    assert records['repository']['children_cpu_seconds'] is not None
+    assert records['jvm']['children_cpu_seconds'] is None
+    assert records['issues']['children_cpu_seconds'] is None
+
+def test_reports_leave_unknown_subprocess_cpu_time_out(tmp_path):
+    spans = [{'repository': 'r', 'stage': 'jvm', 'wall_seconds': 2.0, 'cpu_seconds': 1.0, 'children_cpu_seconds': None,
+              'peak_rss_mb': None, 'children_peak_rss_mb': None, 'counters': {}},
+             {'repository': 'r', 'stage': 'jvm', 'wall_seconds': 3.0, 'cpu_seconds': 1.0, 'children_cpu_seconds': 4.0,
+              'peak_rss_mb': None, 'children_peak_rss_mb': None, 'counters': {}}]
+    Metrics.write_prometheus(spans, str(tmp_path / 'metrics.prom'))
+
+    assert 'refactoring_analyzer_stage_children_cpu_seconds{repository="r",stage="jvm"} 4.0' in (tmp_path / 'metrics.prom').read_text()
+    assert '5.00s wall       6.00s CPU  jvm' in Metrics.summarize(spans)
@@ -0,0 +1,65 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from MirrorCache import clone_repository, evict_mirrors, get_mirror_path, has_active_checkouts, mirror_lock
+
+logger = logging.getLogger('test_mirror_cache')
+
+def count_commits(repo_path):
+    return int(subprocess.check_output(['git', 'rev-list', '--count', 'HEAD'], cwd=repo_path, universal_newlines=True))
+
+def test_a_mirror_is_kept_while_a_clone_uses_it(tmp_path, synthetic_repository):
+    repo_path, _ = synthetic_repository
+    cache_dir = str(tmp_path / 'mirrors')
+    target_dir = str(tmp_path / 'clone')
+    clone_repository(repo_path, target_dir, logger, cache_dir, profile='full')
+    mirror_path = get_mirror_path(repo_path, cache_dir)
+
+    evict_mirrors(logger, 0, cache_dir)
+    assert os.path.isdir(mirror_path)
+    assert count_commits(target_dir) == count_commits(repo_path)
+
+    shutil.rmtree(target_dir)
+    evict_mirrors(logger, 0, cache_dir)
+    assert not os.path.exists(mirror_path)
+
+def test_eviction_waits_for_the_mirror_lock(tmp_path, synthetic_repository):
+    repo_path, _ = synthetic_repository
+    cache_dir = str(tmp_path / 'mirrors')
+    target_dir = str(tmp_path / 'clone')
+    clone_repository(repo_path, target_dir, logger, cache_dir, profile='full')
+    shutil.rmtree(target_dir)
+    mirror_path = get_mirror_path(repo_path, cache_dir)
+
+    with mirror_lock(mirror_path):
+        evictor = threading.Thread(target=evict_mirrors, args=(logger, 0, cache_dir))
+        evictor.start()
+        evictor.join(0.5)
+        assert evictor.is_alive()
+        assert os.path.isdir(mirror_path)
+    evictor.join()
+    assert not os.path.exists(mirror_path)
+
+def test_checkouts_of_a_removed_mirror_are_not_active(tmp_path):
+    assert not has_active_checkouts(str(tmp_path / 'missing.git'))
+
+def test_parallel_clones_and_evictions_leave_every_clone_usable(tmp_path, synthetic_repository):
+    repo_path, _ = synthetic_repository
+    cache_dir = str(tmp_path / 'mirrors')
+    commit_count = count_commits(repo_path)
+
+    def clone_and_evict(index):
+        target_dir = str(tmp_path / f'clone_{index}')
+        clone_repository(repo_path, target_dir, logger, cache_dir, profile='full')
+        try:
+            return count_commits(target_dir)
+        finally:
+            shutil.rmtree(target_dir)
+            evict_mirrors(logger, 0, cache_dir)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(clone_and_evict, range(16))) == [commit_count] * 16
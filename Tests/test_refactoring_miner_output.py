@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from RefactoringMinerOutput import iter_commits, write_commits
+
+def make_commits(count, refactorings=1):
+    return [{'repository': 'https://github.com/test/test.git', 'sha1': f'{index:040x}', 'url': f'https://github.com/test/test/commit/{index:040x}',
+             'refactorings': [{'type': 'Extract Method', 'description': f'extract {index} {position} ' + 'x' * 50} for position in range(refactorings)]}
+            for index in range(count)]
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1024, 64 * 1024])
+def test_iter_commits_matches_json_load_for_every_chunk_size(tmp_path, synthetic_repository, chunk_size):
+    _, output_path = synthetic_repository
+    with open(output_path, 'r', encoding='utf-8') as file:
+        expected = json.load(file)['commits']
+
+    assert list(iter_commits(output_path, chunk_size=chunk_size)) == expected
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 100])
+def test_iter_commits_reads_commits_larger_than_a_chunk(tmp_path, chunk_size):
+    commits = make_commits(5, refactorings=20)
+    output_path = str(tmp_path / 'large_commits.json')
+    write_commits(commits, output_path)
+
+    assert list(iter_commits(output_path, chunk_size=chunk_size)) == commits
+
+def test_iter_commits_handles_the_compact_format_of_refactoring_miner(tmp_path):
+    # RefactoringMiner writes the key and the brackets without whitespace in some versions
+    commits = make_commits(3)
+    output_path = tmp_path / 'compact.json'
+    output_path.write_text(json.dumps({'commits': commits}, separators=(',', ':')), encoding='utf-8')
+
+    for chunk_size in (1, 5, 1024):
+        assert list(iter_commits(str(output_path), chunk_size=chunk_size)) == commits
+
+@pytest.mark.parametrize('content', ['', 'null', '{"commits": []}', '{\n"commits": [\n\n]\n}'])
+def test_iter_commits_yields_nothing_for_empty_outputs(tmp_path, content):
+    output_path = tmp_path / 'empty.json'
+    output_path.write_text(content, encoding='utf-8')
+
+    assert list(iter_commits(str(output_path), chunk_size=4)) == []
+
+def test_iter_commits_raises_on_a_truncated_output(tmp_path):
+    output_path = tmp_path / 'truncated.json'
+    write_commits(make_commits(3), str(output_path))
+    content = output_path.read_text(encoding='utf-8')
+    output_path.write_text(content[:len(content) // 2], encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        list(iter_commits(str(output_path), chunk_size=8))
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import RefactoringMinerWorkers
+import Scheduler
+from RefactoringMinerOutput import iter_commits, merge_outputs, write_commits
+from RefactoringMinerShards import get_commit_weights, run_sharded_refactoring_miner, split_into_shards
+
+def get_shard_commits(weights, shards):
+    """
+    Return the commits of each (start, end) shard, newest shard first, like the -bc ranges RefactoringMiner mines.
+    """
+    commits = [commit for commit, _ in weights]
+    return [commits[(commits.index(start) + 1 if start else 0):commits.index(end) + 1] for start, end in shards]
+
+@pytest.mark.parametrize('shard_count', [1, 2, 3, 7, 100])
+def test_shards_cover_the_history_once_newest_first(synthetic_repository, shard_count):
+    repo_path, _ = synthetic_repository
+    weights = get_commit_weights(repo_path)
+    shards = split_into_shards(weights, shard_count)
+
+    assert 1 <= len(shards) <= min(shard_count, len(weights))
+    assert shards[-1][0] is None
+    assert shards[0][1] == weights[-1][0]
+    for (newer_start, _), (_, older_end) in zip(shards, shards[1:]):
+        assert newer_start == older_end # the start of a range is exclusive, so ranges meet without overlapping
+    shard_commits = get_shard_commits(weights, shards)
+    assert all(shard_commits)
+    assert [commit for commits in reversed(shard_commits) for commit in commits] == [commit for commit, _ in weights]
+
+def test_shards_have_similar_weights():
+    weights = [(f'{index:040x}', 10) for index in range(100)]
+    shards = split_into_shards(weights, 4)
+
+    assert [len(commits) for commits in get_shard_commits(weights, shards)] == [25, 25, 25, 25]
+
+def test_a_heavy_commit_gets_a_shard_of_its_own():
+    weights = [(f'{index:040x}', 1000 if index == 5 else 10) for index in range(10)]
+    shards = split_into_shards(weights, 2)
+
+    assert [len(commits) for commits in get_shard_commits(weights, shards)] == [4, 6]
+
+def test_a_single_commit_is_a_single_shard():
+    assert split_into_shards([('a' * 40, 10)], 4) == [(None, 'a' * 40)]
+
+def make_commit(sha1, description):
+    return {'repository': 'https://github.com/test/test.git', 'sha1': sha1, 'url': f'https://github.com/test/test/commit/{sha1}',
+            'refactorings': [{'type': 'Rename Method', 'description': description}]}
+
+def test_merge_outputs_keeps_the_order_of_the_files(tmp_path):
+    newest = [make_commit('c' * 40, 'newest'), make_commit('b' * 40, 'newest')]
+    oldest = [make_commit('a' * 40, 'oldest')]
+    write_commits(newest, str(tmp_path / 'shard_0.json'))
+    write_commits(oldest, str(tmp_path / 'shard_1.json'))
+
+    merged_path = str(tmp_path / 'merged.json')
+    assert merge_outputs([str(tmp_path / 'shard_0.json'), str(tmp_path / 'shard_1.json')], merged_path) == 3
+    assert list(iter_commits(merged_path)) == newest + oldest
+
+def test_merge_outputs_keeps_the_first_copy_of_duplicate_commits(tmp_path):
+    write_commits([make_commit('b' * 40, 'first')], str(tmp_path / 'first.json'))
+    write_commits([make_commit('b' * 40, 'second'), make_commit('a' * 40, 'second')], str(tmp_path / 'second.json'))
+
+    merged_path = str(tmp_path / 'merged.json')
+    assert merge_outputs([str(tmp_path / 'first.json'), str(tmp_path / 'second.json')], merged_path) == 2
+    assert list(iter_commits(merged_path)) == [make_commit('b' * 40, 'first'), make_commit('a' * 40, 'second')]
+
+@pytest.mark.parametrize('miner_jobs', [1, 2, 4])
+def test_every_shard_takes_a_refactoring_miner_slot(tmp_path, monkeypatch, synthetic_repository, miner_jobs):
+    repo_path, _ = synthetic_repository
+    running = []
+    most_running = []
+    lock = threading.Lock()
+    def run_launcher(refactoringminer_path, repo_dir, json_output_file, logger, heap_mb, start_commit=None, end_commit=None):
+        with lock:
+            running.append(json_output_file)
+            most_running.append(len(running))
+        time.sleep(0.1)
+        write_commits([], json_output_file)
+        with lock:
+            running.remove(json_output_file)
+
+    monkeypatch.setattr(RefactoringMinerWorkers, 'run_launcher', run_launcher)
+    monkeypatch.setattr(Scheduler, 'stage_semaphores', {'refactoring_miner': threading.BoundedSemaphore(miner_jobs)})
+    assert run_sharded_refactoring_miner('RefactoringMiner', repo_path, str(tmp_path / 'output.json'), logging.getLogger('test'), 4)
+
+    assert len(most_running) == 4
+    assert max(most_running) <= miner_jobs
@@ -0,0 +1,68 @@
+import logging
+import subprocess
+
+import pytest
+
+from RefactoringMinerOutput import iter_commits
+from RefactoringRunner import run_incremental_refactoring_miner, run_refactoring_miner
+
+logger = logging.getLogger('test_refactoring_runner')
+
+def git(repo_dir, *args):
+    return subprocess.check_output(['git', *args], cwd=repo_dir, universal_newlines=True).strip()
+
+def add_commit(repo_dir, parent, branch=None):
+    """
+    Add an empty commit on top of parent, to HEAD or to a branch, without touching the checkout.
+    """
+    commit = git(repo_dir, '-c', 'user.name=Test', '-c', 'user.email=test@example.com', 'commit-tree', f'{parent}^{{tree}}', '-p', parent, '-m', 'Test commit')
+    git(repo_dir, 'update-ref', f'refs/heads/{branch}' if branch else 'HEAD', commit)
+    return commit
+
+def get_mined_commits(json_output_file):
+    return {commit['sha1'] for commit in iter_commits(json_output_file)}
+
+@pytest.fixture
+def previous_output(tmp_path, repository_clone, fake_refactoring_miner):
+    previous_output_file = str(tmp_path / 'previous.json')
+    assert run_refactoring_miner('RefactoringMiner', repository_clone, previous_output_file, logger)
+    fake_refactoring_miner.calls.clear()
+    return previous_output_file
+
+def test_new_commits_of_head_are_mined_and_merged(tmp_path, repository_clone, fake_refactoring_miner, previous_output):
+    previous_head = git(repository_clone, 'rev-parse', 'HEAD')
+    new_commit = add_commit(repository_clone, 'HEAD')
+    output_file = str(tmp_path / 'output.json')
+
+    assert run_incremental_refactoring_miner('RefactoringMiner', repository_clone, previous_output, output_file, logger)
+    assert fake_refactoring_miner.calls == [('range', previous_head, new_commit)]
+    assert get_mined_commits(output_file) == get_mined_commits(previous_output) | {new_commit}
+
+def test_an_up_to_date_output_is_complete(tmp_path, repository_clone, fake_refactoring_miner, previous_output):
+    output_file = str(tmp_path / 'output.json')
+
+    assert run_incremental_refactoring_miner('RefactoringMiner', repository_clone, previous_output, output_file, logger)
+    assert fake_refactoring_miner.calls == []
+    assert get_mined_commits(output_file) == get_mined_commits(previous_output)
+
+@pytest.mark.parametrize('head_moved', [False, True])
+def test_new_commits_of_other_branches_make_the_output_partial(tmp_path, repository_clone, fake_refactoring_miner, previous_output, head_moved):
+    add_commit(repository_clone, 'HEAD~5', branch='feature')
+    if head_moved:
+        add_commit(repository_clone, 'HEAD')
+
+    assert not run_incremental_refactoring_miner('RefactoringMiner', repository_clone, previous_output, str(tmp_path / 'output.json'), logger)
+
+def test_other_branches_mined_before_keep_the_output_complete(tmp_path, repository_clone, fake_refactoring_miner):
+    add_commit(repository_clone, 'HEAD~5', branch='feature')
+    previous_output_file = str(tmp_path / 'previous.json')
+    assert run_refactoring_miner('RefactoringMiner', repository_clone, previous_output_file, logger)
+    add_commit(repository_clone, 'HEAD')
+
+    assert run_incremental_refactoring_miner('RefactoringMiner', repository_clone, previous_output_file, str(tmp_path / 'output.json'), logger)
+
+def test_new_commits_mined_in_shards_make_the_output_partial(tmp_path, repository_clone, fake_refactoring_miner, previous_output):
+    add_commit(repository_clone, 'HEAD')
+
+    assert not run_incremental_refactoring_miner('RefactoringMiner', repository_clone, previous_output, str(tmp_path / 'output.json'), logger, shard_count=2)
+    assert [call for call, _, _ in fake_refactoring_miner.calls] == ['shards']
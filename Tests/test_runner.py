@@ -0,0 +1,63 @@
+import functools
+import subprocess
+
+import pytest
+
+import LocCache
+import RefactoringRunner
+import Runner
+from JobLedger import JobLedger
+from StageCache import StageCache, get_local_head
+
+REPOSITORY = 'https://github.com/test/synthetic'
+
+@pytest.fixture
+def runner_environment(tmp_path, monkeypatch, synthetic_repository, fake_refactoring_miner):
+    """
+    Runs analyse_repository_stages offline in tmp_path: repositories are cloned from the synthetic repository,
+    RefactoringMiner is faked, issues are not fetched and the caches and ledger are kept in tmp_path.
+    """
+    repo_path, _ = synthetic_repository
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Runner, 'StageCache', functools.partial(StageCache, str(tmp_path / 'stage_cache.sqlite')))
+    monkeypatch.setattr(Runner, 'JobLedger', functools.partial(JobLedger, str(tmp_path / 'job_ledger.sqlite')))
+    monkeypatch.setattr(LocCache, 'LOC_CACHE_PATH', str(tmp_path / 'loc_cache.sqlite'))
+    monkeypatch.setattr(Runner, 'fetch_issue_data', lambda *args: None)
+    monkeypatch.setattr(Runner, 'get_remote_head', lambda repository: get_local_head(repo_path))
+    monkeypatch.setattr(RefactoringRunner, 'check_executable_exists', lambda executable, logger: None)
+    monkeypatch.setattr(RefactoringRunner, 'REFACTORING_MINER_PATH', repo_path)
+
+    clone_count = iter(range(1000))
+    def clone(repository_url, logger, profile=None):
+        clone_path = str(tmp_path / f'clone_{next(clone_count)}')
+        subprocess.check_call(['git', 'clone', '--quiet', '--shared', repo_path, clone_path])
+        return clone_path
+    monkeypatch.setattr(RefactoringRunner, 'clone_to_temporary_directory', clone)
+    return fake_refactoring_miner
+
+def analyse(**options):
+    return Runner.analyse_repository_stages(REPOSITORY, 'user', 'token', {**Runner.DEFAULT_OPTIONS, 'stage_retries': 0, **options})
+
+def test_a_full_output_is_cached(runner_environment):
+    assert analyse()
+    assert analyse()
+
+    assert runner_environment.calls == [('all', None, None)]
+
+def test_a_sharded_output_is_not_cached_as_a_full_run(runner_environment):
+    assert analyse(miner_shards=2)
+    assert analyse(miner_shards=2)
+    assert analyse()
+    assert analyse()
+
+    # The sharded outputs only cover the history of HEAD, so the full run still mines every branch
+    assert runner_environment.calls == [('shards', None, 'HEAD'), ('shards', None, 'HEAD'), ('all', None, None)]
+
+def test_persistent_and_launcher_outputs_are_cached_apart(runner_environment):
+    assert analyse()
+    assert analyse(persistent_miner=True)
+    assert analyse(persistent_miner=True)
+    assert analyse()
+
+    # A stage keeps one record per repository, so switching back mines again
+    assert runner_environment.calls == [('all', None, None)] * 3
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from StageCache import STAGE_SCRIPTS, StageCache, get_script_hash
+
+REPOSITORY = 'https://github.com/test/test.git'
+
+@pytest.fixture
+def stage_cache(tmp_path):
+    cache = StageCache(str(tmp_path / 'stage_cache.sqlite'))
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def stage_files(tmp_path):
+    input_path = tmp_path / 'input.json'
+    input_path.write_text('{"commits": []}', encoding='utf-8')
+    output_path = tmp_path / 'output.jsonl'
+    output_path.write_text('{"commit_hash": "a"}\n', encoding='utf-8')
+    return str(input_path), str(output_path)
+
+def store_stage(stage_cache, stage_files, head='a' * 40, params=None):
+    input_path, output_path = stage_files
+    key = stage_cache.get_key('commit_diff', REPOSITORY, head, params, [input_path], ['git'])
+    stage_cache.store(REPOSITORY, 'commit_diff', key, [output_path])
+    return key
+
+def test_the_same_key_returns_the_recorded_outputs(stage_cache, stage_files):
+    key = store_stage(stage_cache, stage_files, params={'backend': 'git'})
+
+    assert key is not None
+    assert stage_cache.get_key('commit_diff', REPOSITORY, 'a' * 40, {'backend': 'git'}, [stage_files[0]], ['git']) == key
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) == [stage_files[1]]
+
+def test_outputs_are_shared_between_instances(tmp_path, stage_files):
+    stage_cache = StageCache(str(tmp_path / 'stage_cache.sqlite'))
+    key = store_stage(stage_cache, stage_files)
+    stage_cache.close()
+
+    stage_cache = StageCache(str(tmp_path / 'stage_cache.sqlite'))
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) == [stage_files[1]]
+    stage_cache.close()
+
+@pytest.mark.parametrize('changed_argument', ['head', 'params', 'stage'])
+def test_a_changed_key_misses(stage_cache, stage_files, changed_argument):
+    store_stage(stage_cache, stage_files, params={'backend': 'git'})
+    arguments = {'stage': 'commit_diff', 'head': 'a' * 40, 'params': {'backend': 'git'}}
+    arguments[changed_argument] = {'stage': 'parquet', 'head': 'b' * 40, 'params': {'backend': 'pydriller'}}[changed_argument]
+
+    key = stage_cache.get_key(arguments['stage'], REPOSITORY, arguments['head'], arguments['params'], [stage_files[0]], ['git'])
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) is None
+
+def test_a_changed_input_misses(stage_cache, stage_files):
+    input_path, _ = stage_files
+    key = store_stage(stage_cache, stage_files)
+    with open(input_path, 'w', encoding='utf-8') as file:
+        file.write('{"commits": [{"sha1": "a"}]}')
+
+    assert stage_cache.get_key('commit_diff', REPOSITORY, 'a' * 40, None, [input_path], ['git']) != key
+
+def test_a_deleted_output_misses(stage_cache, stage_files):
+    key = store_stage(stage_cache, stage_files)
+    os.remove(stage_files[1])
+
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) is None
+
+def test_a_modified_output_misses(stage_cache, stage_files):
+    key = store_stage(stage_cache, stage_files)
+    with open(stage_files[1], 'a', encoding='utf-8') as file:
+        file.write('{"commit_hash": "b"}\n')
+
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) is None
+
+def test_a_touched_output_with_the_same_content_hits(stage_cache, stage_files):
+    key = store_stage(stage_cache, stage_files)
+    status = os.stat(stage_files[1])
+    os.utime(stage_files[1], ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) == [stage_files[1]]
+
+def test_invalidate_forgets_the_stage(stage_cache, stage_files):
+    key = store_stage(stage_cache, stage_files)
+    stage_cache.invalidate(REPOSITORY, 'commit_diff')
+
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', key) is None
+
+def test_an_unknown_head_has_no_key(stage_cache, stage_files):
+    assert stage_cache.get_key('commit_diff', REPOSITORY, None, None, [stage_files[0]], ['git']) is None
+    assert stage_cache.get_outputs(REPOSITORY, 'commit_diff', None) is None
+
+def test_a_disabled_cache_never_hits(tmp_path, stage_files):
+    stage_cache = StageCache(str(tmp_path / 'disabled' / 'stage_cache.sqlite'), enabled=False)
+
+    assert stage_cache.get_key('commit_diff', REPOSITORY, 'a' * 40, None, [stage_files[0]], ['git']) is None
+    assert not (tmp_path / 'disabled').exists()
+    stage_cache.close()
+
+def test_every_script_of_a_stage_exists():
+    for stage_name in STAGE_SCRIPTS:
+        assert get_script_hash(stage_name)